@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+from parse_message_file import parse_file, iter_parse_file
+
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_BATCH_SIZE = 64
+
+_DONE = object()
+
+# Parsing is CPU bound and the readers block, so all of it runs in an
+# executor and coroutines only wait on results.  Async generators need
+# Python 3.6+.
+
+async def parse_file_async(filename, validate_only=False, verbose=False, stats=None, executor=None, threads=1):
+    """ parse_file() on an executor (the loop's default one if None).
+
+    A ProcessPoolExecutor works too, as long as stats is not given (it
+    would be updated in the child process).
+    """
+    loop = asyncio.get_event_loop()
+    call = functools.partial(parse_file, filename, validate_only=validate_only, verbose=verbose, stats=stats, threads=threads)
+    return await loop.run_in_executor(executor, call)
+
+async def iter_parse_file_async(filename, verbose=False, stats=None, executor=None, threads=1,
+                                queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE):
+    """ Async generator over the (event, service, item) tuples of iter_parse_file().
+
+    The parser runs on a thread of executor (which must be a thread pool)
+    and puts batches of batch_size events on a queue holding at most
+    queue_size batches.  Leaving the async for early stops the parser.
+    """
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue(queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                future.result(0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+
+    def produce():
+        events = iter_parse_file(filename, verbose=verbose, stats=stats, threads=threads)
+        batch = []
+        try:
+            for event in events:
+                batch.append(event)
+                if len(batch) >= batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch and not put(batch):
+                return
+            put(_DONE)
+        except Exception as e:
+            put(e)
+        finally:
+            events.close()
+
+    producer = loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            batch = await queue.get()
+            if batch is _DONE:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            for event in batch:
+                yield event
+    finally:
+        stop.set()
+        await producer
+
+async def iter_threads_async(filename, verbose=False, stats=None, executor=None, threads=1):
+    """ Async generator over (service, thread) for every message thread of filename. """
+    events = iter_parse_file_async(filename, verbose=verbose, stats=stats, executor=executor, threads=threads)
+    try:
+        async for event, service, item in events:
+            if event == 'thread':
+                yield service, item
+    finally:
+        await events.aclose()
+
+class AsyncIngestor:
+    """ Parse many archives concurrently from asyncio with bounded resources.
+
+    All work shares one thread pool of max_workers threads (or the executor
+    given), and at most max_concurrency files are open at a time; further
+    requests wait on a semaphore, so ingesting hundreds of archives never
+    creates more than max_workers threads.
+    """
+
+    def __init__(self, max_workers=4, max_concurrency=None, executor=None):
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else concurrent.futures.ThreadPoolExecutor(max_workers)
+        self.max_concurrency = max_concurrency or max_workers
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # Created on first use so it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def parse_file(self, filename, **options):
+        async with self.semaphore:
+            return await parse_file_async(filename, executor=self.executor, **options)
+
+    async def iter_parse_file(self, filename, **options):
+        """ Like iter_parse_file_async(), holding one concurrency slot while streaming. """
+        async with self.semaphore:
+            events = iter_parse_file_async(filename, executor=self.executor, **options)
+            try:
+                async for event in events:
+                    yield event
+            finally:
+                await events.aclose()
+
+    async def ingest(self, filenames, **options):
+        """ Parse every file in filenames, yielding (filename, services or exception) as each finishes.
+
+        filenames may be any iterable, including a lazy one; only
+        max_concurrency files are scheduled at a time.  A failing file is
+        reported with its exception instead of stopping the others.
+        """
+        filenames = iter(filenames)
+        pending = {}
+
+        def schedule():
+            for filename in filenames:
+                task = asyncio.ensure_future(self.parse_file(filename, **options))
+                pending[task] = filename
+                if len(pending) >= self.max_concurrency:
+                    return
+
+        schedule()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    filename = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        result = e
+                    yield filename, result
+                schedule()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def close(self):
+        if self._own_executor:
+            self.executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import sys
+import time
+
+try:
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+except ImportError:
+    ProcessPoolExecutor = None
+
+from parse_message_file import parse_file, CODECS
+from convert_message_file import (
+    load_from_json_file, load_from_xml_file, save_to_json_file, save_to_xml_file,
+    save_services_to_file
+)
+
+FORMATS = {
+    'original': '.txt',
+    'json': '.json',
+    'xml': '.xml',
+}
+
+def split_archive_name(filename):
+    """ Split filename into (stem, format, compression suffix), e.g. 'a.json.gz' -> ('a', 'json', '.gz'). """
+    compression = ''
+    for codec in CODECS.values():
+        for suffix in codec.suffixes:
+            if filename.endswith(suffix) and len(suffix) > len(compression):
+                compression = suffix
+    stem = filename[:len(filename) - len(compression)]
+    for file_format, extension in FORMATS.items():
+        if stem.endswith(extension):
+            return stem[:-len(extension)], file_format, compression
+    return stem, 'original', compression
+
+def load_services(filename):
+    """ Load services from an archive, JSON or XML file (compressed or not). """
+    file_format = split_archive_name(filename)[1]
+    if file_format == 'json':
+        return load_from_json_file(filename)
+    if file_format == 'xml':
+        return load_from_xml_file(filename)
+    return parse_file(filename)
+
+def save_services(services, filename, file_format, line_ending="lf", level=None):
+    if file_format == 'json':
+        save_to_json_file(services, filename, level)
+    elif file_format == 'xml':
+        save_to_xml_file(services, filename, level)
+    else:
+        save_services_to_file(services, filename, line_ending=line_ending, level=level)
+
+def _record(source, target, status, error=None):
+    return {'Source': source, 'Target': target, 'Status': status, 'Seconds': 0.0,
+            'BytesIn': 0, 'BytesOut': 0, 'Threads': 0, 'Error': error}
+
+def convert_file(source, target, to_format, line_ending="lf", level=None):
+    """ Convert one file, returning its summary record; errors are recorded, not raised. """
+    record = _record(source, target, 'converted')
+    start = time.perf_counter()
+    try:
+        record['BytesIn'] = os.path.getsize(source)
+        services = load_services(source)
+        record['Threads'] = sum(len(service.get('MessageThreads', [])) for service in services)
+        target_dir = os.path.dirname(target)
+        if target_dir:
+            # Other workers may be creating the same directory
+            os.makedirs(target_dir, exist_ok=True)
+        # Write next to the target and rename, so an interrupted run never
+        # leaves a partial file that looks up to date
+        partial = "{0}.partial{1}".format(target, split_archive_name(target)[2])
+        save_services(services, partial, to_format, line_ending, level)
+        os.rename(partial, target)
+        record['BytesOut'] = os.path.getsize(target)
+    except Exception as e:
+        record['Status'] = 'failed'
+        record['Error'] = "{0}: {1}".format(e.__class__.__name__, e)
+    record['Seconds'] = time.perf_counter() - start
+    return record
+
+def expand_inputs(inputs, pattern="*", recursive=False):
+    """ Yield (path, base directory) for every file named by inputs (files, directories or globs). """
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, dirs, files in os.walk(entry):
+                dirs.sort()
+                for name in sorted(files):
+                    if fnmatch.fnmatch(name, pattern) and not name.endswith(".idx"):
+                        yield os.path.join(root, name), entry
+                if not recursive:
+                    break
+        elif os.path.exists(entry):
+            yield entry, os.path.dirname(entry)
+        else:
+            for path in sorted(glob.glob(entry, recursive=True)):
+                if os.path.isfile(path):
+                    yield path, os.path.dirname(path)
+
+def target_filename(source, base, to_format, output_dir=None, compression=None):
+    """ Output path for source: same stem, the new format's extension and compression suffix.
+
+    compression=None keeps the source's compression suffix.
+    """
+    stem, source_format, source_compression = split_archive_name(source)
+    if compression is None:
+        compression = source_compression
+    if output_dir is not None:
+        stem = os.path.join(output_dir, os.path.relpath(stem, base or '.'))
+    return stem + FORMATS[to_format] + compression
+
+def is_up_to_date(source, target):
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+def batch_convert(inputs, to_format, output_dir=None, compression=None, pattern="*", recursive=False,
+                  workers=None, force=False, line_ending="lf", level=None, progress=None):
+    """ Convert many files on a process pool; return one record per file.
+
+    Outputs newer than their source are skipped unless force is set, and
+    inputs that would be their own output (already in to_format) always
+    are.  Each file is converted independently, so one bad file only fails
+    its own record.  progress, if given, is called with every record as it finishes.
+    """
+    records = []
+    jobs = []
+    sources = [(source, target_filename(source, base, to_format, output_dir, compression))
+               for source, base in expand_inputs(inputs, pattern, recursive)]
+    # One source per output; an original format archive wins over a JSON
+    # or XML file converted from it by an earlier run
+    producers = {}
+    for source, target in sources:
+        key = os.path.abspath(target)
+        if key not in producers or (split_archive_name(source)[1] == 'original' and split_archive_name(producers[key])[1] != 'original'):
+            producers[key] = source
+    for source, target in sources:
+        if os.path.abspath(target) == os.path.abspath(source):
+            # Already in the target format, e.g. the output of an earlier
+            # run over the same directory
+            record = _record(source, target, 'skipped', "Already a {0} file".format(to_format))
+        elif producers[os.path.abspath(target)] != source:
+            record = _record(source, target, 'skipped', "Output comes from {0}".format(producers[os.path.abspath(target)]))
+        elif not force and is_up_to_date(source, target):
+            record = _record(source, target, 'skipped')
+        else:
+            jobs.append((source, target))
+            continue
+        records.append(record)
+        if progress is not None:
+            progress(record)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or ProcessPoolExecutor is None or len(jobs) <= 1:
+        for source, target in jobs:
+            record = convert_file(source, target, to_format, line_ending, level)
+            records.append(record)
+            if progress is not None:
+                progress(record)
+        return records
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = dict((executor.submit(convert_file, source, target, to_format, line_ending, level), (source, target))
+                       for source, target in jobs)
+        for future in as_completed(futures):
+            source, target = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. killed or out of memory)
+                record = _record(source, target, 'failed', "{0}: {1}".format(e.__class__.__name__, e))
+            records.append(record)
+            if progress is not None:
+                progress(record)
+    return records
+
+def format_record(record):
+    rate = record['BytesIn'] / record['Seconds'] / 1e6 if record['Seconds'] and record['Status'] == 'converted' else 0.0
+    line = "{0:<9} {1:9.3f} s {2:9.2f} MB/s  {3} -> {4}".format(record['Status'], record['Seconds'], rate, record['Source'], record['Target'])
+    if record['Error']:
+        line += "\n          {0}".format(record['Error'])
+    return line
+
+def summarize(records, elapsed):
+    """ Totals over the records of one batch run. """
+    converted = [record for record in records if record['Status'] == 'converted']
+    bytes_in = sum(record['BytesIn'] for record in converted)
+    return {
+        'Files': len(records),
+        'Converted': len(converted),
+        'Skipped': sum(1 for record in records if record['Status'] == 'skipped'),
+        'Failed': sum(1 for record in records if record['Status'] == 'failed'),
+        'Threads': sum(record['Threads'] for record in converted),
+        'BytesIn': bytes_in,
+        'BytesOut': sum(record['BytesOut'] for record in converted),
+        'Seconds': elapsed,
+        'WorkerSeconds': sum(record['Seconds'] for record in records),
+        'MBPerSecond': bytes_in / elapsed / 1e6 if elapsed else 0.0,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert many message archives between the original, JSON and XML formats.")
+    parser.add_argument("inputs", nargs="+", help="Files, directories or glob patterns to convert")
+    parser.add_argument("--to", "-t", choices=sorted(FORMATS), required=True, help="Output format")
+    parser.add_argument("--output-dir", "-d", help="Write outputs under this directory (default: next to each input)")
+    parser.add_argument("--compression", "-c", choices=['keep', 'none'] + sorted(suffix for codec in CODECS.values() for suffix in codec.suffixes),
+                        default='keep', help="Compression suffix for outputs (default: same as the input)")
+    parser.add_argument("--pattern", "-p", default="*", help="File name pattern used inside directories")
+    parser.add_argument("--recursive", "-r", action="store_true", help="Descend into subdirectories")
+    parser.add_argument("--workers", "-w", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--force", "-f", action="store_true", help="Convert even if the output is newer than the input")
+    parser.add_argument("--line-ending", "-l", choices=["lf", "cr", "crlf"], default="lf", help="Line endings for original format outputs")
+    parser.add_argument("--compress-level", type=int, default=None, help="Compression level (codec default if omitted)")
+    parser.add_argument("--report", help="Write the per-file records and totals as JSON to this file")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Only print the summary")
+    args = parser.parse_args(argv)
+
+    compression = {'keep': None, 'none': ''}.get(args.compression, args.compression)
+    progress = None if args.quiet else lambda record: print(format_record(record))
+    start = time.perf_counter()
+    records = batch_convert(args.inputs, args.to, args.output_dir, compression, args.pattern, args.recursive,
+                            args.workers, args.force, args.line_ending, args.compress_level, progress)
+    summary = summarize(records, time.perf_counter() - start)
+    print("Converted {0}, skipped {1}, failed {2} of {3} files ({4} threads) in {5:.3f} s, {6:.2f} MB/s".format(
+        summary['Converted'], summary['Skipped'], summary['Failed'], summary['Files'], summary['Threads'],
+        summary['Seconds'], summary['MBPerSecond']))
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump({'Files': records, 'Summary': summary}, file, indent=2)
+    return 1 if summary['Failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
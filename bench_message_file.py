@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from parse_message_file import (
+    parse_file, to_json, from_json, to_xml, from_xml, services_to_string,
+    save_compressed_file, init_empty_service, add_user, add_category,
+    add_message_thread, add_message_post, add_poll, remove_user,
+    remove_category, remove_message_thread, remove_message_post,
+    LINE_ENDINGS
+)
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules whose import cost the lazy loading in parse_message_file and
+# codec_message_file is meant to avoid for plain parses and validations
+HEAVY_MODULES = ('xml.etree.ElementTree', 'xml.dom.minidom', 'json', 'gzip', 'bz2', 'lzma', 'concurrent.futures')
+
+COMPRESSION_SUFFIXES = ['', '.gz', '.bz2', '.xz', '.lzma', '.zl', '.zz', '.lsz']
+
+WORDS = ("love so strong it is creepy hello world message board thread reply post poll "
+         "feedback forum category welcome community site feature vote answer question").split()
+
+def _sentence(rng, width):
+    words = []
+    size = 0
+    while size < width:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words).capitalize() + "."
+
+def _thread_lines(rng, thread_id, posts, depth, polls, body_lines, body_width, users):
+    lines = [
+        "--- Start Message Thread ---",
+        "Thread: {0}".format(thread_id),
+        "Title: {0}".format(_sentence(rng, 30)),
+        "Category: General Discussion",
+        "Forum: Introductions",
+        "Type: Topic",
+        "State: Open",
+        "",
+    ]
+    depths = {}
+    for post_id in range(1, posts + 1):
+        if post_id == 1 or depth == 0:
+            nested = 0
+        else:
+            nested = post_id - 1 if depths[post_id - 1] < depth else 1
+        depths[post_id] = depths[nested] + 1 if nested else 0
+        day = 1 + (thread_id + post_id) % 28
+        lines.extend([
+            "--- Start Message Post ---",
+            "Author: @user{0}".format(rng.randint(1, users)),
+            "Time: {0}:{1:02d} {2}".format(1 + post_id % 12, post_id % 60, "AM" if post_id % 2 else "PM"),
+            "Date: Jan {0}, 2024".format(day),
+            "SubType: {0}".format("Post" if nested == 0 else "Reply"),
+            "Post: {0}".format(post_id),
+            "Nested: {0}".format(nested),
+            "Message:",
+            "--- Start Message Body ---",
+        ])
+        lines.extend(_sentence(rng, body_width) for _ in range(body_lines))
+        lines.append("--- End Message Body ---")
+        if polls and post_id == 1:
+            lines.extend(["", "Polls:", "--- Start Poll List ---"])
+            for num in range(1, polls + 1):
+                results = [rng.randint(0, 50) for _ in range(3)]
+                total = sum(results) or 1
+                lines.extend([
+                    "--- Start Poll Body ---",
+                    "Num: {0}".format(num),
+                    "Question: {0}".format(_sentence(rng, 30)),
+                    "Answers: Yes, No, Maybe",
+                    "Results: {0}".format(", ".join(str(result) for result in results)),
+                    "Percentage: {0}".format(", ".join("{0:.2f}".format(result * 100.0 / total) for result in results)),
+                    "Votes: {0}".format(sum(results)),
+                    "--- End Poll Body ---",
+                ])
+            lines.append("--- End Poll List ---")
+        lines.extend(["--- End Message Post ---", ""])
+    lines.append("--- End Message Thread ---")
+    return lines
+
+def generate_archive_lines(services=1, users=10, threads=10, posts=5, depth=2, polls=0,
+                           body_lines=1, body_width=60, seed=0, include_files=None, thread_start=1):
+    """ Generate a synthetic archive in the original text format, as a list of lines. """
+    rng = random.Random(seed)
+    lines = []
+    for entry in range(1, services + 1):
+        lines.extend([
+            "--- Start Archive Service ---",
+            "Entry: {0}".format(entry),
+            "Service: Benchmark Board {0}".format(entry),
+            "Info:",
+            "--- Start Info Body ---",
+            _sentence(rng, body_width),
+            "--- End Info Body ---",
+            "Interactions: Post, Reply, Poll",
+            "Status: Active",
+            "",
+            "--- Start Categorization List ---",
+            "Categories: Main Category",
+            "Forums: Main Forum",
+            "",
+            "--- Start Category List ---",
+            "Kind: Categories, Main Category",
+            "ID: 1",
+            "InSub: 0",
+            "Headline: General Discussion",
+            "Description:",
+            "--- End Category List ---",
+            "",
+            "--- Start Category List ---",
+            "Kind: Forums, Main Forum",
+            "ID: 2",
+            "InSub: 0",
+            "Headline: Introductions",
+            "Description:",
+            "--- End Category List ---",
+            "--- End Categorization List ---",
+            "",
+            "--- Start User List ---",
+        ])
+        for user_id in range(1, users + 1):
+            lines.extend([
+                "--- Start User Info ---",
+                "User: {0}".format(user_id),
+                "Name: User {0}".format(user_id),
+                "Handle: @user{0}".format(user_id),
+                "Location: Earth",
+                "Joined: Jan 1, 2020",
+                "Birthday: Jan 1, 1990",
+                "Bio:",
+                "--- Start Bio Body ---",
+                _sentence(rng, body_width),
+                "--- End Bio Body ---",
+                "--- End User Info ---",
+                "",
+            ])
+        lines.extend(["--- End User List ---", "", "--- Start Message List ---", "Interactions: Post, Reply, Poll", "Status: Active", ""])
+        for thread_id in range(thread_start, thread_start + threads):
+            lines.extend(_thread_lines(rng, thread_id, posts, depth, polls, body_lines, body_width, users))
+            lines.append("")
+        lines.append("--- End Message List ---")
+        if include_files:
+            lines.append("--- Include Messages Start ---")
+            lines.extend(include_files)
+            lines.append("--- Include Messages End ---")
+        lines.extend(["", "--- End Archive Service ---", ""])
+    return lines
+
+def write_archive(filename, line_ending="lf", include_fanout=0, **options):
+    """ Write a synthetic archive (plus include_fanout included message files) and return all paths written. """
+    written = []
+    include_files = []
+    base, suffix = filename, ''
+    for compression_suffix in COMPRESSION_SUFFIXES[1:]:
+        if filename.endswith(compression_suffix):
+            base, suffix = filename[:-len(compression_suffix)], compression_suffix
+            break
+    threads = options.get('threads', 10)
+    for include in range(include_fanout):
+        include_name = os.path.abspath("{0}.include{1}.txt{2}".format(base, include + 1, suffix))
+        include_options = dict(options, services=1, seed=options.get('seed', 0) + include + 1,
+                               thread_start=threads * (include + 1) + 1)
+        include_lines = generate_archive_lines(**include_options)
+        save_compressed_file(LINE_ENDINGS[line_ending].join(include_lines), include_name)
+        include_files.append(include_name)
+        written.append(include_name)
+    lines = generate_archive_lines(include_files=include_files, **options)
+    save_compressed_file(LINE_ENDINGS[line_ending].join(lines), filename)
+    written.insert(0, filename)
+    return written
+
+def measure(function, repeat=1, trace_memory=True):
+    """ Run function repeat times; return (result, best seconds, peak traced bytes).
+
+    Timings are taken without tracemalloc, which slows allocation-heavy code
+    down considerably; the peak is measured in one extra traced run.
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if trace_memory:
+        result = None
+        tracemalloc.start()
+        result = function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, best, peak
+
+def _record(results, name, elapsed, peak, size=None, items=None):
+    entry = {'seconds': round(elapsed, 6), 'peak_bytes': peak}
+    if size is not None:
+        entry['bytes'] = size
+        entry['mb_per_second'] = round(size / elapsed / 1e6, 3) if elapsed else None
+    if items is not None:
+        entry['items'] = items
+        entry['items_per_second'] = round(items / elapsed, 1) if elapsed else None
+    results[name] = entry
+
+def bench_mutations(results, count, repeat=1):
+    """ Time the add_*/remove_* helpers on a fresh service. """
+    def build():
+        service = init_empty_service(1, "Benchmark Board")
+        for user_id in range(1, count + 1):
+            add_user(service, user_id, "User {0}".format(user_id), "@user{0}".format(user_id))
+        add_category(service, "Categories", "Categories", "Main Category", 1, 0, "General Discussion", "")
+        for thread_id in range(1, count + 1):
+            add_message_thread(service, thread_id, title="Thread {0}".format(thread_id), category="General Discussion")
+            add_message_post(service, thread_id, "@user1", "9:00 AM", "Jan 1, 2024", "Post", 1, 0, "Hello")
+            add_poll(service, thread_id, 1, 1, "Question?", ["Yes", "No"], ["1", "1"], ["50.00", "50.00"], "2")
+        return service
+
+    service, elapsed, peak = measure(build, repeat)
+    _record(results, 'add_helpers', elapsed, peak, items=count * 4)
+
+    def teardown():
+        for thread_id in range(1, count + 1):
+            remove_message_post(service, thread_id, 1)
+            remove_message_thread(service, thread_id)
+        for user_id in range(1, count + 1):
+            remove_user(service, user_id)
+        remove_category(service, 1)
+
+    _, elapsed, peak = measure(teardown, 1, False)
+    _record(results, 'remove_helpers', elapsed, peak, items=count * 3 + 1)
+
+def measure_import_time(module, repeat=5):
+    """ Median cumulative 'python -X importtime' time of module in fresh interpreters, plus the heavy modules it loaded. """
+    times = []
+    loaded = set()
+    for _ in range(repeat):
+        process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=MODULE_DIR,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        _, output = process.communicate()
+        for line in output.splitlines():
+            parts = line.split('|')
+            if len(parts) != 3 or not parts[0].startswith('import time:'):
+                continue
+            name = parts[2].strip()
+            if name == module:
+                times.append(int(parts[1]) / 1e6)
+            elif name in HEAVY_MODULES:
+                loaded.add(name)
+    times.sort()
+    return {'seconds': times[len(times) // 2] if times else None, 'heavy_modules': sorted(loaded)}
+
+def measure_command(command, repeat=5):
+    """ Fastest wall time of running command, e.g. a whole CLI invocation including startup. """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.call(command, cwd=MODULE_DIR, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'seconds': round(best, 6)}
+
+def bench_imports(results, filename, repeat=5):
+    """ Import cost of the parser and CLI modules, and the wall time of a --validate-only run. """
+    for module in ('parse_message_file', 'display_message_file', 'convert_message_file'):
+        results[module] = measure_import_time(module, repeat)
+    script = os.path.join(MODULE_DIR, 'display_message_file.py')
+    results['validate_cli'] = measure_command([sys.executable, script, filename, '--validate-only'], repeat)
+
+def run_benchmarks(directory, options, suffixes, line_endings, include_fanout=0, repeat=1, mutations=1000):
+    """ Generate archives in directory and time every parser and serializer over them. """
+    report = {
+        'python': sys.version.split()[0],
+        'options': dict(options, include_fanout=include_fanout, repeat=repeat),
+        'cases': {},
+    }
+    for line_ending in line_endings:
+        for suffix in suffixes:
+            case = "{0}{1}".format(line_ending, suffix or '.txt')
+            results = {}
+            report['cases'][case] = results
+            filename = os.path.join(directory, "bench_{0}.txt{1}".format(line_ending, suffix))
+            try:
+                paths = write_archive(filename, line_ending=line_ending, include_fanout=include_fanout, **options)
+                size = sum(os.path.getsize(path) for path in paths)
+                services, elapsed, peak = measure(lambda: parse_file(filename), repeat)
+            except Exception as e:
+                results['error'] = "{0}: {1}".format(type(e).__name__, e)
+                continue
+            posts = sum(len(thread['Messages']) for service in services for thread in service['MessageThreads'])
+            _record(results, 'parse_file', elapsed, peak, size=size, items=posts)
+            results['parse_file']['compressed_bytes'] = size
+
+    # Serializers are independent of the input encoding, so time them once
+    services = parse_file(write_archive(os.path.join(directory, "bench_serialize.txt"), include_fanout=include_fanout, **options)[0])
+    posts = sum(len(thread['Messages']) for service in services for thread in service['MessageThreads'])
+    serializers = {}
+    report['serializers'] = serializers
+    json_str, elapsed, peak = measure(lambda: to_json(services), repeat)
+    _record(serializers, 'to_json', elapsed, peak, size=len(json_str), items=posts)
+    _, elapsed, peak = measure(lambda: from_json(json_str), repeat)
+    _record(serializers, 'from_json', elapsed, peak, size=len(json_str), items=posts)
+    xml_str, elapsed, peak = measure(lambda: to_xml(services), repeat)
+    _record(serializers, 'to_xml', elapsed, peak, size=len(xml_str), items=posts)
+    _, elapsed, peak = measure(lambda: from_xml(xml_str), repeat)
+    _record(serializers, 'from_xml', elapsed, peak, size=len(xml_str), items=posts)
+    text, elapsed, peak = measure(lambda: services_to_string(services), repeat)
+    _record(serializers, 'services_to_string', elapsed, peak, size=len(text), items=posts)
+    mutation_results = {}
+    report['mutations'] = mutation_results
+    bench_mutations(mutation_results, mutations, repeat)
+    import_results = {}
+    report['imports'] = import_results
+    bench_imports(import_results, os.path.join(directory, "bench_serialize.txt"), max(repeat, 5))
+    return report
+
+def compare_reports(baseline, current):
+    """ Return {benchmark: current seconds / baseline seconds} for every benchmark present in both. """
+    ratios = {}
+    def walk(prefix, old, new):
+        for key, value in new.items():
+            if key not in old or not isinstance(value, dict):
+                continue
+            if 'seconds' in value and 'seconds' in old[key] and old[key]['seconds']:
+                ratios[prefix + key] = round(value['seconds'] / old[key]['seconds'], 3)
+            else:
+                walk(prefix + key + ".", old[key], value)
+    walk("", baseline, current)
+    return ratios
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the message file parser and serializers over generated archives.")
+    parser.add_argument("--services", type=int, default=1, help="Services per archive")
+    parser.add_argument("--users", type=int, default=100, help="Users per service")
+    parser.add_argument("--threads", type=int, default=200, help="Message threads per service")
+    parser.add_argument("--posts", type=int, default=10, help="Posts per thread")
+    parser.add_argument("--depth", type=int, default=3, help="Maximum reply nesting depth")
+    parser.add_argument("--polls", type=int, default=1, help="Polls on the first post of every thread")
+    parser.add_argument("--body-lines", type=int, default=2, help="Lines per message body")
+    parser.add_argument("--body-width", type=int, default=80, help="Approximate characters per body line")
+    parser.add_argument("--include-fanout", type=int, default=0, help="Number of included message files per archive")
+    parser.add_argument("--line-ending", "-l", choices=["lf", "cr", "crlf"], action="append", help="Line endings to benchmark (default: all)")
+    parser.add_argument("--compression", choices=[suffix or 'none' for suffix in COMPRESSION_SUFFIXES], action="append", help="Compression suffixes to benchmark (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the fastest is reported")
+    parser.add_argument("--mutations", type=int, default=1000, help="Items for the add_*/remove_* helper benchmarks")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated archives")
+    parser.add_argument("--output", "-o", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--compare", help="Baseline JSON report; print time ratios against it")
+    parser.add_argument("--keep", help="Generate archives in this directory and keep them")
+    args = parser.parse_args()
+
+    options = {
+        'services': args.services, 'users': args.users, 'threads': args.threads, 'posts': args.posts,
+        'depth': args.depth, 'polls': args.polls, 'body_lines': args.body_lines,
+        'body_width': args.body_width, 'seed': args.seed,
+    }
+    suffixes = [('' if suffix == 'none' else suffix) for suffix in (args.compression or [suffix or 'none' for suffix in COMPRESSION_SUFFIXES])]
+    line_endings = args.line_ending or ["lf", "cr", "crlf"]
+    directory = args.keep or tempfile.mkdtemp(prefix="lovesostrong-bench-")
+    if args.keep and not os.path.isdir(directory):
+        os.makedirs(directory)
+    try:
+        report = run_benchmarks(directory, options, suffixes, line_endings, args.include_fanout, args.repeat, args.mutations)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    if args.compare:
+        with open(args.compare) as file:
+            report['comparison'] = compare_reports(json.load(file), report)
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(data)
+    else:
+        print(data)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+
+try:
+    from hashlib import blake2b
+except ImportError:
+    blake2b = None
+
+from parse_message_file import open_compressed_file, save_compressed_file
+
+KEY_SIZE = 12
+
+def body_key(body):
+    """ Content address of a message body (a hex digest of its UTF-8 bytes). """
+    data = body.encode('utf-8')
+    if blake2b is not None:
+        return blake2b(data, digest_size=KEY_SIZE).hexdigest()
+    import hashlib
+    return hashlib.sha1(data).hexdigest()[:KEY_SIZE * 2]
+
+class BodyStore:
+    """ Content-addressed store of message bodies: key -> body.
+
+    Passed to the parser (parse_file(..., bodies=store)) every post's
+    Message is interned, so posts with the same body share one string and
+    memory grows with the unique bodies rather than the posts.  Snapshots
+    (save_snapshot_file()) store each body once and refer to it by key.
+    """
+
+    def __init__(self):
+        self.bodies = {}
+        self.posts = 0
+        self.raw_bytes = 0
+
+    def add(self, body):
+        """ Store body; returns its key. """
+        key = body_key(body)
+        self.posts += 1
+        self.raw_bytes += len(body.encode('utf-8'))
+        self.bodies.setdefault(key, body)
+        return key
+
+    def intern(self, body):
+        """ Store body; returns the stored copy, shared by every post with that body. """
+        return self.bodies[self.add(body)]
+
+    def join_message(self, lines):
+        """ The parser's hook for a finished message body (a list of lines). """
+        return self.intern("\n".join(lines))
+
+    def get(self, key):
+        return self.bodies[key]
+
+    def unique_bytes(self):
+        return sum(len(body.encode('utf-8')) for body in self.bodies.values())
+
+    def to_dict(self):
+        """ Dedup statistics: posts seen, unique bodies, raw and unique UTF-8 bytes and their ratio. """
+        unique_bytes = self.unique_bytes()
+        return {
+            'Posts': self.posts,
+            'UniqueBodies': len(self.bodies),
+            'RawBytes': self.raw_bytes,
+            'UniqueBytes': unique_bytes,
+            'DedupRatio': round(self.raw_bytes / unique_bytes, 3) if unique_bytes else 1.0,
+        }
+
+    def format(self):
+        stats = self.to_dict()
+        return "Message bodies: {0} posts, {1} unique; {2} of {3} bytes kept (dedup ratio {4})".format(
+            stats['Posts'], stats['UniqueBodies'], stats['UniqueBytes'], stats['RawBytes'], stats['DedupRatio'])
+
+def _copy_with(item, key, value):
+    copied = dict(item)
+    copied[key] = value
+    return copied
+
+def to_snapshot(services, store=None):
+    """ Snapshot document of services: {'Bodies': {key: body}, 'Services': [...]}.
+
+    Each post's 'Message' is replaced by a 'MessageRef' key into Bodies.
+    The services themselves are not modified.
+    """
+    if store is None:
+        store = BodyStore()
+    snapshot_services = []
+    for service in services:
+        threads = []
+        for thread in service.get('MessageThreads', []):
+            messages = []
+            for message in thread.get('Messages', []):
+                if 'Message' in message:
+                    body = message['Message']
+                    message = dict((key, value) for key, value in message.items() if key != 'Message')
+                    message['MessageRef'] = store.add(body)
+                messages.append(message)
+            threads.append(_copy_with(dict((key, value) for key, value in thread.items() if key != 'post_ids'), 'Messages', messages))
+        snapshot_services.append(_copy_with(service, 'MessageThreads', threads))
+    return {'Bodies': store.bodies, 'Services': snapshot_services}
+
+def from_snapshot(snapshot):
+    """ Services data structure from a to_snapshot() document; posts share their body strings. """
+    bodies = snapshot['Bodies']
+    services = snapshot['Services']
+    for service in services:
+        for thread in service.get('MessageThreads', []):
+            for message in thread.get('Messages', []):
+                if 'MessageRef' in message:
+                    message['Message'] = bodies[message.pop('MessageRef')]
+                # The parser's post_ids set is not stored; rebuild it
+                if 'Post' in message:
+                    thread.setdefault('post_ids', set()).add(message['Post'])
+    return services
+
+def is_snapshot(data):
+    """ Whether a loaded JSON document is a to_snapshot() document rather than a list of services. """
+    return isinstance(data, dict) and 'Bodies' in data and 'Services' in data
+
+def save_snapshot_file(services, filename, level=None, threads=1):
+    """ Save services as a deduplicated JSON snapshot; returns the BodyStore with its statistics. """
+    store = BodyStore()
+    data = json.dumps(to_snapshot(services, store), indent=2)
+    save_compressed_file(data, filename, level, threads)
+    return store
+
+def load_snapshot_file(filename):
+    """ Load services from a save_snapshot_file() snapshot. """
+    with open_compressed_file(filename) as file:
+        return from_snapshot(json.load(file))
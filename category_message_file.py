@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+from bisect import bisect_left
+
+from parse_message_file import iter_parse_file
+
+# Category type -> the thread key that names categories of that type
+THREAD_KEYS = {'Categories': 'Category', 'Forums': 'Forum'}
+
+class CategoryTree:
+    """ One category type's hierarchy ('Categories' or 'Forums', linked by InSub -> ID) as Euler-tour intervals.
+
+    Categories are numbered in depth first order; every category's subtree
+    is the run of positions [enter[ID], leave[ID]), so an ancestor test is
+    two comparisons and a subtree is a slice of order.
+    """
+
+    def __init__(self, categories=()):
+        self.parent = {}
+        self.headline_ids = {}
+        for category in categories:
+            category_id = category['ID']
+            if category_id in self.parent:
+                continue
+            self.parent[category_id] = category.get('InSub', 0)
+            self.headline_ids.setdefault(category.get('Headline', ''), []).append(category_id)
+        children = {}
+        for category_id, parent in self.parent.items():
+            children.setdefault(parent if parent in self.parent else 0, []).append(category_id)
+        self.order = []
+        self.enter = {}
+        self.leave = {}
+        self._tour(children, children.get(0, []))
+        # Categories left over sit on an InSub cycle (only possible in hand
+        # built data); each joins the tour as a root
+        for category_id in self.parent:
+            if category_id not in self.enter:
+                self._tour(children, [category_id])
+
+    def _tour(self, children, roots):
+        stack = [(category_id, False) for category_id in reversed(roots)]
+        while stack:
+            category_id, done = stack.pop()
+            if done:
+                self.leave[category_id] = len(self.order)
+                continue
+            if category_id in self.enter:
+                continue
+            self.enter[category_id] = len(self.order)
+            self.order.append(category_id)
+            stack.append((category_id, True))
+            stack.extend((child, False) for child in reversed(children.get(category_id, [])))
+
+    def __contains__(self, category_id):
+        return category_id in self.enter
+
+    def resolve(self, headline):
+        """ IDs of the categories with this headline (usually one). """
+        return self.headline_ids.get(headline, [])
+
+    def is_ancestor(self, ancestor, descendant):
+        """ Whether descendant is ancestor or lies in its subtree. """
+        if ancestor not in self.enter or descendant not in self.enter:
+            return False
+        return self.enter[ancestor] <= self.enter[descendant] < self.leave[ancestor]
+
+    def ancestors(self, category_id):
+        """ IDs from category_id's parent up to its root. """
+        ancestors = []
+        parent = self.parent.get(category_id, 0)
+        while parent in self.parent and parent not in ancestors and parent != category_id:
+            ancestors.append(parent)
+            parent = self.parent[parent]
+        return ancestors
+
+    def descendants(self, category_id, include_self=True):
+        """ IDs of category_id's subtree in depth first order. """
+        if category_id not in self.enter:
+            return []
+        start = self.enter[category_id] + (0 if include_self else 1)
+        return self.order[start:self.leave[category_id]]
+
+class CategoryIndex:
+    """ Category and forum hierarchies of one service, with its threads resolved to category IDs.
+
+    Threads are numbered by their position in service['MessageThreads'].
+    Their Category and Forum headlines are resolved to IDs once, on the
+    first query, into a list of (tour position, thread number) pairs sorted
+    by position, so the threads under a category and all its subcategories
+    are one bisected slice.  Call refresh() after categories or threads of
+    the service change.
+    """
+
+    def __init__(self, service=None):
+        self.categories = []
+        self.thread_headlines = []
+        self.trees = None
+        self.postings = None
+        self.unresolved = set()
+        if service is not None:
+            self.set_categories(service.get('Categories', []))
+            for thread in service.get('MessageThreads', []):
+                self.add_thread(thread)
+
+    def set_categories(self, categories):
+        self.categories = list(categories)
+        self.refresh()
+
+    def add_thread(self, thread):
+        """ Record the next thread's category and forum headlines; returns its thread number. """
+        self.thread_headlines.append(tuple(tuple(headline.strip() for headline in thread.get(key) or ()) for key in THREAD_KEYS.values()))
+        self.postings = None
+        return len(self.thread_headlines) - 1
+
+    def refresh(self):
+        """ Forget the trees and thread assignments; they are rebuilt on the next query. """
+        self.trees = None
+        self.postings = None
+
+    def tree(self, category_type='Categories'):
+        if self.trees is None:
+            self.trees = dict((category_type, CategoryTree(category for category in self.categories if category.get('Type') == category_type))
+                              for category_type in THREAD_KEYS)
+        return self.trees[category_type]
+
+    def _build_postings(self):
+        self.postings = {}
+        self.unresolved = set()
+        for type_number, category_type in enumerate(THREAD_KEYS):
+            tree = self.tree(category_type)
+            pairs = set()
+            for thread_number, headlines in enumerate(self.thread_headlines):
+                for headline in headlines[type_number]:
+                    category_ids = tree.resolve(headline)
+                    if not category_ids:
+                        self.unresolved.add((category_type, headline))
+                    for category_id in category_ids:
+                        pairs.add((tree.enter[category_id], thread_number))
+            pairs = sorted(pairs)
+            self.postings[category_type] = ([position for position, thread_number in pairs],
+                                            [thread_number for position, thread_number in pairs])
+
+    def category_ids(self, category, category_type='Categories'):
+        """ IDs for category, given as an ID or a headline. """
+        tree = self.tree(category_type)
+        if isinstance(category, int):
+            return [category] if category in tree else []
+        return tree.resolve(category)
+
+    def thread_categories(self, thread_number, category_type='Categories'):
+        """ IDs of the categories a thread is filed under. """
+        headlines = self.thread_headlines[thread_number][list(THREAD_KEYS).index(category_type)]
+        tree = self.tree(category_type)
+        return [category_id for headline in headlines for category_id in tree.resolve(headline)]
+
+    def threads_under(self, category, category_type='Categories', include_subcategories=True):
+        """ Sorted numbers of the threads filed under category (an ID or headline) or, by default, any of its subcategories. """
+        if self.postings is None:
+            self._build_postings()
+        tree = self.tree(category_type)
+        positions, thread_numbers = self.postings[category_type]
+        found = set()
+        for category_id in self.category_ids(category, category_type):
+            start = tree.enter[category_id]
+            end = tree.leave[category_id] if include_subcategories else start + 1
+            found.update(thread_numbers[bisect_left(positions, start):bisect_left(positions, end)])
+        return sorted(found)
+
+    def select_threads(self, service, category, category_type='Categories', include_subcategories=True):
+        """ The threads of service (the one indexed) under category. """
+        threads = service.get('MessageThreads', [])
+        return [threads[number] for number in self.threads_under(category, category_type, include_subcategories)]
+
+def index_services(services):
+    """ A CategoryIndex for each service of a parsed services structure. """
+    return [CategoryIndex(service) for service in services]
+
+def index_file(filename, threads=1):
+    """ CategoryIndexes of an archive file, built as it is parsed without keeping its threads.
+
+    Returns (services, indexes); the services hold no MessageThreads.
+    """
+    services = []
+    indexes = []
+    current = None
+    current_service = None
+    for event, service, item in iter_parse_file(filename, threads=threads):
+        if service is not current_service and event in ('thread', 'service'):
+            current = CategoryIndex()
+            current_service = service
+        if event == 'thread':
+            current.add_thread(item)
+        elif event == 'service':
+            current.set_categories(service.get('Categories', []))
+            services.append(service)
+            indexes.append(current)
+            current = current_service = None
+    return services, indexes
@@ -0,0 +1,682 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import deque
+import bisect
+import struct
+import zlib
+import sys
+import os
+import io
+
+PY2 = sys.version_info[0] == 2
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+# Bytes read to detect a file's codec
+SNIFF_SIZE = 64
+
+# gzip, bz2, lzma and concurrent.futures are imported by the code that
+# needs them, so opening a plain archive loads none of them.
+
+def _import_lzma():
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise ImportError("lzma module is not available")
+    return lzma
+
+def _thread_pool(threads):
+    """ A ThreadPoolExecutor with threads workers, or None for threads <= 1 or without concurrent.futures. """
+    if threads <= 1:
+        return None
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError:
+        return None
+    return ThreadPoolExecutor(threads)
+
+class ZlibFile:
+    def __init__(self, file_path=None, fileobj=None, mode='rb', level=9, wbits=15, encoding=None, errors=None, newline=None):
+        if file_path is None and fileobj is None:
+            raise ValueError("Either file_path or fileobj must be provided")
+        if file_path is not None and fileobj is not None:
+            raise ValueError("Only one of file_path or fileobj should be provided")
+
+        self.file_path = file_path
+        self.fileobj = fileobj
+        self.mode = mode
+        self.level = level
+        self.wbits = wbits
+        self.encoding = encoding
+        self.errors = errors
+        self.newline = newline
+        self._compressed_data = b''
+        self._decompressed_data = b''
+        self._position = 0
+        self._text_mode = 't' in mode
+
+        # Force binary mode for internal handling
+        internal_mode = mode.replace('t', 'b')
+
+        if 'w' in mode or 'a' in mode or 'x' in mode:
+            self.file = open(file_path, internal_mode) if file_path else fileobj
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        elif 'r' in mode:
+            if file_path:
+                if os.path.exists(file_path):
+                    self.file = open(file_path, internal_mode)
+                    self._load_file()
+                else:
+                    raise FileNotFoundError("No such file: '{}'".format(file_path))
+            elif fileobj:
+                self.file = fileobj
+                self._load_file()
+        else:
+            raise ValueError("Mode should be 'rb' or 'wb'")
+
+    def write(self, data):
+        """Write data to the file, compressing it in the process."""
+        if 'w' not in self.mode and 'a' not in self.mode and 'x' not in self.mode:
+            raise IOError("File not open for writing")
+
+        if self._text_mode and isinstance(data, str):
+            data = data.encode(self.encoding or 'utf-8', errors=self.errors)
+
+        compressed_data = self._compressor.compress(data)
+        self.file.write(compressed_data)
+
+    def close(self):
+        """Close the file, writing any remaining compressed data."""
+        if 'w' in self.mode or 'a' in self.mode or 'x' in self.mode:
+            self.file.write(self._compressor.flush())
+        self.file.close()
+
+    def _load_file(self):
+        """Load and decompress the file content."""
+        self._compressed_data = self.file.read()
+        self._decompressed_data = zlib.decompress(self._compressed_data, self.wbits)
+        self.file.close()
+
+    def read(self, size=-1):
+        """Read and return the decompressed data."""
+        if size == -1:
+            size = len(self._decompressed_data) - self._position
+        data = self._decompressed_data[self._position:self._position + size]
+        self._position += size
+        return data
+
+    def readline(self):
+        """Read and return a single line from the decompressed data."""
+        newline_pos = self._decompressed_data.find(b'\n', self._position)
+        if newline_pos == -1:
+            return self.read()  # Read until the end of the data
+        line = self._decompressed_data[self._position:newline_pos + 1]
+        self._position = newline_pos + 1
+        return line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Codec:
+    """ One compression format in the codec registry.
+
+    Subclasses open binary readers and writers for their format.  Formats
+    whose independently compressed blocks can simply be concatenated also
+    implement compress_block() (plus block_header()/block_trailer() when the
+    container needs them), which BlockCompressedWriter uses to compress
+    blocks on a thread pool.
+    """
+    name = None
+    suffixes = ()
+    default_level = None
+    parallel = False
+    needs_final_block = False
+    magic = ()
+
+    def sniff(self, head):
+        """ True if head, the first bytes of a file, look like this format. """
+        for magic in self.magic:
+            if head.startswith(magic):
+                return True
+        return False
+
+    def open_read(self, filename):
+        raise NotImplementedError
+
+    def open_write(self, filename, level=None):
+        raise NotImplementedError
+
+    def compress_block(self, data, level, final):
+        raise NotImplementedError
+
+    def block_header(self, level):
+        return b''
+
+    def update_checksum(self, data, checksum):
+        return checksum
+
+    def block_trailer(self, level, checksum, size):
+        return b''
+
+    def open_block_writer(self, fileobj, level=None, chunk_size=None, threads=1):
+        return BlockCompressedWriter(fileobj, self, level, chunk_size, threads)
+
+class PlainCodec(Codec):
+    name = 'none'
+
+    def open_read(self, filename):
+        return io.open(filename, 'rb')
+
+    def open_write(self, filename, level=None):
+        return io.open(filename, 'wb')
+
+class GzipCodec(Codec):
+    name = 'gzip'
+    suffixes = ('.gz',)
+    default_level = 9
+    parallel = True
+    magic = (b'\x1f\x8b',)
+
+    def open_read(self, filename):
+        import gzip
+        return gzip.open(filename, 'rb')
+
+    def open_write(self, filename, level=None):
+        import gzip
+        return gzip.open(filename, 'wb', compresslevel=self.default_level if level is None else level)
+
+    def compress_block(self, data, level, final):
+        # Every block is a complete gzip member; readers concatenate members
+        compressor = zlib.compressobj(self.default_level if level is None else level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+class Bz2Codec(Codec):
+    name = 'bzip2'
+    suffixes = ('.bz2',)
+    default_level = 9
+    parallel = True
+    magic = (b'BZh',)
+
+    def open_read(self, filename):
+        import bz2
+        return bz2.BZ2File(filename, 'rb')
+
+    def open_write(self, filename, level=None):
+        import bz2
+        return bz2.BZ2File(filename, 'wb', compresslevel=self.default_level if level is None else level)
+
+    def compress_block(self, data, level, final):
+        import bz2
+        return bz2.compress(data, self.default_level if level is None else level)
+
+class XzCodec(Codec):
+    name = 'xz'
+    suffixes = ('.xz', '.lzma')
+    default_level = 6
+    parallel = True
+    # xz container, and the legacy .lzma header (lc/lp/pb 0x5d, then a 32-bit dictionary size)
+    magic = (b'\xfd7zXZ\x00', b'\x5d\x00\x00')
+
+    def open_read(self, filename):
+        return _import_lzma().open(filename, 'rb')
+
+    def open_write(self, filename, level=None):
+        return _import_lzma().open(filename, 'wb', preset=self.default_level if level is None else level)
+
+    def compress_block(self, data, level, final):
+        return _import_lzma().compress(data, preset=self.default_level if level is None else level)
+
+class ZlibCodec(Codec):
+    name = 'zlib'
+    suffixes = ('.zl', '.zz')
+    default_level = 9
+    parallel = True
+    needs_final_block = True
+
+    def sniff(self, head):
+        # CMF 0x78 (deflate, 32K window) with a FLG byte that makes the header
+        # checksum valid and asks for no preset dictionary; plenty of text
+        # ("x marks the spot") passes that much, so the head must also start
+        # a valid deflate stream
+        if len(head) < 2 or head[:1] != b'\x78':
+            return False
+        if (ord(head[0:1]) * 256 + ord(head[1:2])) % 31 != 0 or ord(head[1:2]) & 0x20:
+            return False
+        try:
+            zlib.decompressobj().decompress(head)
+        except zlib.error:
+            return False
+        return True
+
+    def open_read(self, filename):
+        return ZlibReader(io.open(filename, 'rb'))
+
+    def open_write(self, filename, level=None):
+        return BlockCompressedWriter(io.open(filename, 'wb'), self, level)
+
+    def block_header(self, level):
+        return zlib.compress(b'', self.default_level if level is None else level)[:2]
+
+    def compress_block(self, data, level, final):
+        # Raw deflate; a sync flush ends non-final blocks on a byte boundary so
+        # independently compressed blocks form one valid deflate stream.
+        compressor = zlib.compressobj(self.default_level if level is None else level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+    def update_checksum(self, data, checksum):
+        return zlib.adler32(data, 1 if checksum is None else checksum)
+
+    def block_trailer(self, level, checksum, size):
+        return struct.pack('>I', (1 if checksum is None else checksum) & 0xffffffff)
+
+SEEKABLE_MAGIC = b'LSSZ\x01\x00\x00\x00'
+SEEKABLE_FOOTER_MAGIC = b'LSSZIDX1'
+SEEKABLE_CHUNK_SIZE = 1 << 18
+
+class SeekableCodec(Codec):
+    """ Seekable container: independently zlib-compressed blocks plus a block index.
+
+    Layout: SEEKABLE_MAGIC, the compressed blocks, the index (block count,
+    then compressed and uncompressed size of each block, little-endian
+    uint64) and a footer holding the index offset and SEEKABLE_FOOTER_MAGIC.
+    Blocks are cut at '--- Start Message Thread ---' lines, so a thread found
+    through an ArchiveIndex usually decompresses a single block.
+    """
+    name = 'seekable'
+    suffixes = ('.lsz',)
+    default_level = 6
+    parallel = True
+    needs_final_block = True
+    magic = (SEEKABLE_MAGIC[:4],)
+
+    def open_read(self, filename, threads=1):
+        return SeekableBlockReader(io.open(filename, 'rb'), threads)
+
+    def open_write(self, filename, level=None):
+        return SeekableBlockWriter(io.open(filename, 'wb'), self, level)
+
+    def open_block_writer(self, fileobj, level=None, chunk_size=None, threads=1):
+        return SeekableBlockWriter(fileobj, self, level, chunk_size, threads)
+
+    def block_header(self, level):
+        return SEEKABLE_MAGIC
+
+    def compress_block(self, data, level, final):
+        return zlib.compress(data, self.default_level if level is None else level)
+
+CODECS = {}
+
+def register_codec(codec):
+    """ Add a codec instance to the registry, replacing any codec with the same name. """
+    CODECS[codec.name] = codec
+    return codec
+
+for _codec in (PlainCodec(), GzipCodec(), Bz2Codec(), XzCodec(), ZlibCodec(), SeekableCodec()):
+    register_codec(_codec)
+
+def codec_for_filename(filename):
+    """ Return the registered codec whose suffix matches filename, or the plain codec. """
+    for codec in CODECS.values():
+        for suffix in codec.suffixes:
+            if filename.endswith(suffix):
+                return codec
+    return CODECS['none']
+
+def sniff_codec(filename, head=None):
+    """ Detect a file's codec from its first bytes, falling back to its suffix for empty files. """
+    if head is None:
+        with io.open(filename, 'rb') as file:
+            head = file.read(SNIFF_SIZE)
+    if not head:
+        return codec_for_filename(filename)
+    for codec in CODECS.values():
+        if codec.sniff(head):
+            return codec
+    # Nothing matched; a suffix is only believed for a codec without magic
+    # bytes (zlib), whose files may not sniff
+    codec = codec_for_filename(filename)
+    return codec if not codec.magic else CODECS['none']
+
+def open_compressed_reader(filename, threads=1):
+    """ Open filename as a buffered binary stream of its decompressed content.
+
+    threads > 1 decompresses blocks ahead of the reader in parallel for
+    codecs that store independent blocks (the seekable container).
+    """
+    codec = sniff_codec(filename)
+    if isinstance(codec, SeekableCodec):
+        reader = codec.open_read(filename, threads)
+    else:
+        reader = codec.open_read(filename)
+    if isinstance(reader, io.RawIOBase):
+        reader = io.BufferedReader(reader, buffer_size=DEFAULT_CHUNK_SIZE)
+    return reader
+
+def open_compressed_file(filename, threads=1):
+    """ Open a file as streaming UTF-8 text, whatever its compression or extension.
+
+    The codec is chosen from the file's magic bytes (gzip, bzip2, xz/lzma,
+    zlib), so misnamed files open with the right decompressor up front.
+    Line endings (LF, CR, CRLF) are translated to LF.
+    """
+    codec = sniff_codec(filename)
+    if codec.name == 'none':
+        return io.open(filename, 'r', encoding='utf-8')
+    return io.TextIOWrapper(open_compressed_reader(filename, threads), encoding='utf-8')
+
+class ZlibReader(io.RawIOBase):
+    """ Streaming reader for zlib (.zl/.zz) data; unlike ZlibFile it never holds the whole file. """
+
+    def __init__(self, fileobj, wbits=15, chunk_size=65536):
+        io.RawIOBase.__init__(self)
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self._decompressor = zlib.decompressobj(wbits)
+        self._buffer = b''
+        self._offset = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._offset >= len(self._buffer) and not self._eof:
+            chunk = self.fileobj.read(self.chunk_size)
+            if chunk:
+                self._buffer = self._decompressor.decompress(chunk)
+            else:
+                self._buffer = self._decompressor.flush()
+                self._eof = True
+            self._offset = 0
+        size = min(len(b), len(self._buffer) - self._offset)
+        b[:size] = self._buffer[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.fileobj.close()
+        io.RawIOBase.close(self)
+
+class BlockCompressedWriter(io.RawIOBase):
+    """ Binary writer that compresses fixed-size blocks independently.
+
+    With threads > 1 the blocks are compressed on a thread pool (zlib, bz2
+    and lzma release the GIL) and written in order; at most 2 * threads
+    blocks are in flight, so memory stays bounded.  The codec decides how
+    blocks are framed (gzip/bz2/xz members, or one zlib stream).
+    """
+
+    def __init__(self, fileobj, codec, level=None, chunk_size=DEFAULT_CHUNK_SIZE, threads=1):
+        io.RawIOBase.__init__(self)
+        self.fileobj = fileobj
+        self.codec = codec
+        self.level = level
+        self.chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        self._executor = _thread_pool(threads)
+        self.threads = threads if self._executor is not None else 1
+        self._futures = deque()
+        self._pending = []
+        self._pending_size = 0
+        self._blocks = 0
+        self._size = 0
+        self._checksum = None
+        self.fileobj.write(codec.block_header(level))
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        while self._pending_size >= self.chunk_size:
+            pending = b''.join(self._pending)
+            self._submit(pending[:self.chunk_size], False)
+            rest = pending[self.chunk_size:]
+            self._pending = [rest] if rest else []
+            self._pending_size = len(rest)
+        return len(data)
+
+    def _submit(self, block, final):
+        self._checksum = self.codec.update_checksum(block, self._checksum)
+        self._size += len(block)
+        self._blocks += 1
+        if self._executor is None:
+            self._write_block(self.codec.compress_block(block, self.level, final))
+            return
+        self._futures.append(self._executor.submit(self.codec.compress_block, block, self.level, final))
+        while len(self._futures) > self.threads * 2:
+            self._write_block(self._futures.popleft().result())
+
+    def _write_block(self, data):
+        self.fileobj.write(data)
+
+    def _trailer(self):
+        return self.codec.block_trailer(self.level, self._checksum, self._size)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._pending or self._blocks == 0 or self.codec.needs_final_block:
+                self._submit(b''.join(self._pending), True)
+            self._pending = []
+            while self._futures:
+                self._write_block(self._futures.popleft().result())
+            self.fileobj.write(self._trailer())
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self.fileobj.close()
+            io.RawIOBase.close(self)
+
+class SeekableBlockWriter(BlockCompressedWriter):
+    """ BlockCompressedWriter for the seekable container.
+
+    Blocks end just before a '--- Start Message Thread ---' line once they
+    reach chunk_size; a single thread is only split (at a line end) when it
+    grows past four times chunk_size.  The block index is written on close.
+    """
+    THREAD_MARKER = b'--- Start Message Thread ---'
+
+    def __init__(self, fileobj, codec, level=None, chunk_size=None, threads=1):
+        BlockCompressedWriter.__init__(self, fileobj, codec, level, chunk_size or SEEKABLE_CHUNK_SIZE, threads)
+        self._block_sizes = []
+        self._block_lengths = []
+
+    def write(self, data):
+        data = bytes(data)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size < self.chunk_size:
+            return len(data)
+        pending = b''.join(self._pending)
+        cut = self._find_cut(pending)
+        while cut:
+            self._submit(pending[:cut], False)
+            pending = pending[cut:]
+            cut = self._find_cut(pending) if len(pending) >= self.chunk_size else 0
+        self._pending = [pending] if pending else []
+        self._pending_size = len(pending)
+        return len(data)
+
+    def _find_cut(self, pending):
+        marker = self.THREAD_MARKER
+        # Prefer the last thread start that keeps the block within chunk_size,
+        # otherwise the first one after it
+        position = pending.rfind(marker, 1, self.chunk_size + len(marker))
+        if position <= 0:
+            position = pending.find(marker, self.chunk_size)
+        if position > 0:
+            cut = max(pending.rfind(b'\n', 0, position), pending.rfind(b'\r', 0, position)) + 1
+            if cut > 0:
+                return cut
+        if len(pending) >= self.chunk_size * 4:
+            cut = max(pending.rfind(b'\n', 0, self.chunk_size), pending.rfind(b'\r', 0, self.chunk_size)) + 1
+            if not cut:
+                return self.chunk_size
+            # Never between the CR and LF of one line ending
+            if pending[cut - 1:cut + 1] == b'\r\n':
+                cut += 1
+            return cut
+        return 0
+
+    def _submit(self, block, final):
+        self._block_lengths.append(len(block))
+        BlockCompressedWriter._submit(self, block, final)
+
+    def _write_block(self, data):
+        self._block_sizes.append(len(data))
+        self.fileobj.write(data)
+
+    def _trailer(self):
+        index_offset = len(SEEKABLE_MAGIC) + sum(self._block_sizes)
+        index = [struct.pack('<Q', len(self._block_sizes))]
+        for size, length in zip(self._block_sizes, self._block_lengths):
+            index.append(struct.pack('<QQ', size, length))
+        index.append(struct.pack('<Q', index_offset) + SEEKABLE_FOOTER_MAGIC)
+        return b''.join(index)
+
+class SeekableBlockReader(io.RawIOBase):
+    """ Random-access reader for the seekable container.
+
+    seek() only touches the block holding the target offset.  With
+    threads > 1 the next blocks are decompressed on a thread pool while the
+    current one is being read.
+    """
+
+    def __init__(self, fileobj, threads=1):
+        io.RawIOBase.__init__(self)
+        self.fileobj = fileobj
+        self._executor = _thread_pool(threads)
+        self.threads = threads if self._executor is not None else 1
+        self._futures = {}
+        file_size = fileobj.seek(0, io.SEEK_END)
+        # Magic, block count and footer at the least
+        if file_size < len(SEEKABLE_MAGIC) + 8 + 16:
+            raise ValueError("Seekable archive has no block index footer.")
+        fileobj.seek(file_size - 16)
+        footer = fileobj.read(16)
+        if len(footer) != 16 or footer[8:] != SEEKABLE_FOOTER_MAGIC:
+            raise ValueError("Seekable archive has no block index footer.")
+        index_offset = struct.unpack('<Q', footer[:8])[0]
+        if index_offset > file_size - 8 - 16:
+            raise ValueError("Seekable archive has a damaged block index.")
+        fileobj.seek(index_offset)
+        count = struct.unpack('<Q', fileobj.read(8))[0]
+        if index_offset + 8 + 16 * count + 16 != file_size:
+            raise ValueError("Seekable archive has a damaged block index.")
+        entries = fileobj.read(16 * count)
+        self.compressed_offsets = []
+        self.compressed_sizes = []
+        self.offsets = []
+        self.lengths = []
+        compressed_offset = len(SEEKABLE_MAGIC)
+        offset = 0
+        for number in range(count):
+            size, length = struct.unpack('<QQ', entries[number * 16:number * 16 + 16])
+            self.compressed_offsets.append(compressed_offset)
+            self.compressed_sizes.append(size)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            compressed_offset += size
+            offset += length
+        self.size = offset
+        self._position = 0
+        self._block_number = None
+        self._block = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position {0}".format(offset))
+        self._position = offset
+        return offset
+
+    def _read_compressed(self, number):
+        self.fileobj.seek(self.compressed_offsets[number])
+        return self.fileobj.read(self.compressed_sizes[number])
+
+    def read_block(self, number):
+        """ Return the decompressed content of block number. """
+        if number == self._block_number:
+            return self._block
+        future = self._futures.pop(number, None)
+        if future is not None:
+            block = future.result()
+        else:
+            # Blocks that were scheduled for a different read position are stale
+            self._futures.clear()
+            block = zlib.decompress(self._read_compressed(number))
+        if self._executor is not None:
+            for ahead in range(number + 1, min(number + 1 + self.threads, len(self.offsets))):
+                if ahead not in self._futures:
+                    self._futures[ahead] = self._executor.submit(zlib.decompress, self._read_compressed(ahead))
+        self._block_number = number
+        self._block = block
+        return block
+
+    def readinto(self, b):
+        if self._position >= self.size:
+            return 0
+        number = bisect.bisect_right(self.offsets, self._position) - 1
+        block = self.read_block(number)
+        start = self._position - self.offsets[number]
+        size = min(len(b), len(block) - start)
+        b[:size] = block[start:start + size]
+        self._position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self.fileobj.close()
+        io.RawIOBase.close(self)
+
+def open_compressed_writer(filename, level=None, threads=1, chunk_size=None):
+    """ Open a binary writer for filename, compressed according to its extension.
+
+    threads > 1 uses a BlockCompressedWriter for codecs that support
+    independent blocks; chunk_size is the uncompressed size of each block.
+    """
+    codec = codec_for_filename(filename)
+    if codec.parallel and (threads > 1 or chunk_size):
+        return codec.open_block_writer(io.open(filename, 'wb'), level, chunk_size, threads)
+    return codec.open_write(filename, level)
+
+def open_compressed_output(filename, level=None, threads=1, chunk_size=None):
+    """ Open a text file for streaming writes, compressed according to its extension. """
+    raw = open_compressed_writer(filename, level, threads, chunk_size)
+    if isinstance(raw, io.RawIOBase):
+        raw = io.BufferedWriter(raw, buffer_size=chunk_size or DEFAULT_CHUNK_SIZE)
+    return io.TextIOWrapper(raw, encoding='utf-8')
+
+def save_compressed_file(data, filename, level=None, threads=1, chunk_size=None):
+    """ Save data to a file, using various compression methods if specified. """
+    if isinstance(data, bytes) and not PY2:
+        with open_compressed_writer(filename, level, threads, chunk_size) as file:
+            file.write(data)
+    else:
+        with open_compressed_output(filename, level, threads, chunk_size) as file:
+            file.write(data)
@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import xml.etree.ElementTree as ET
+from xml.dom import minidom
+import io
+import json
+
+try:
+    from collections import UserString
+except ImportError:
+    from UserString import UserString
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+from parse_message_file import (
+    PY2, unicode_type, str_type, ServicesStreamWriter, open_compressed_file,
+    open_compressed_reader, open_compressed_output, save_compressed_file,
+    stream_services, iter_service_events
+)
+
+def _is_list(value):
+    """ Whether value is a list, or a list-like sequence of threads (spilled or shared). """
+    return isinstance(value, list) or (isinstance(value, Sequence) and not isinstance(value, (tuple, str_type, bytes, UserString)))
+
+def _json_default(value):
+    """ Serialize the parser's helper sets (e.g. a thread's 'post_ids') as sorted lists, lazy bodies as strings and thread sequences as lists. """
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, UserString):
+        return unicode_type(value)
+    if _is_list(value):
+        return list(value)
+    raise TypeError("Object of type {0} is not JSON serializable".format(type(value).__name__))
+
+def to_json(services):
+    """ Convert the services data structure to JSON """
+    return json.dumps(services, indent=2, default=_json_default)
+
+def _services_from_json(data):
+    # Deduplicated snapshots (bodies_message_file) keep each body once
+    if isinstance(data, dict) and 'Bodies' in data:
+        from bodies_message_file import from_snapshot
+        return from_snapshot(data)
+    return data
+
+def from_json(json_str):
+    """ Convert a JSON string (a plain dump or a deduplicated snapshot) back to the services data structure """
+    return _services_from_json(json.loads(json_str))
+
+def load_from_json_file(json_filename):
+    """ Load the services data structure from a JSON file (a plain dump or a deduplicated snapshot) """
+    with open_compressed_file(json_filename) as file:
+        return _services_from_json(json.load(file))
+
+def _xml_add_list_item(list_elem, key, item):
+    """ Append one item of the list stored under key (e.g. one thread of 'MessageThreads'). """
+    item_elem = ET.SubElement(list_elem, key[:-1])  # singular form
+    if isinstance(item, dict):
+        for subkey, subvalue in item.items():
+            sub_elem = ET.SubElement(item_elem, subkey)
+            sub_elem.text = unicode_type(subvalue)
+    else:
+        item_elem.text = unicode_type(item)
+    return item_elem
+
+def _xml_add_value(service_elem, key, value):
+    """ Append the element for one key of a service. """
+    if _is_list(value):
+        list_elem = ET.SubElement(service_elem, key)
+        for item in value:
+            _xml_add_list_item(list_elem, key, item)
+    elif isinstance(value, dict):
+        dict_elem = ET.SubElement(service_elem, key)
+        for subkey, subvalue in value.items():
+            if isinstance(subkey, str_type) and not subkey[:1].isdigit():
+                sub_elem = ET.SubElement(dict_elem, subkey)
+            else:
+                # Numeric keys such as user IDs (strings once loaded from
+                # JSON) are not valid tag names
+                sub_elem = ET.SubElement(dict_elem, key[:-1], {'ID': unicode_type(subkey)})
+            if isinstance(subvalue, list):
+                for sub_item in subvalue:
+                    sub_item_elem = ET.SubElement(sub_elem, subkey[:-1])
+                    sub_item_elem.text = unicode_type(sub_item)
+            else:
+                sub_elem.text = unicode_type(subvalue)
+    else:
+        elem = ET.SubElement(service_elem, key)
+        elem.text = unicode_type(value)
+
+def _xml_pretty(elem, depth):
+    """ Pretty print one element the way to_xml() does, indented for its depth in the document. """
+    xml_str = ET.tostring(elem, encoding='utf-8')
+    # writexml() indents tags only, so multi-line text comes out unchanged
+    output = io.StringIO()
+    minidom.parseString(xml_str).documentElement.writexml(output, "  " * depth, "  ", "\n")
+    return output.getvalue()
+
+def to_xml(services):
+    """ Convert the services data structure to an XML string """
+    root = ET.Element("Services")
+    
+    for service in services:
+        service_elem = ET.SubElement(root, "Service")
+        for key, value in service.items():
+            _xml_add_value(service_elem, key, value)
+    
+    # Convert to string
+    xml_str = ET.tostring(root, encoding='utf-8')
+    if PY2:
+        xml_str = xml_str.decode('utf-8')  # Convert bytes to str in Python 2
+    # Make the XML string pretty
+    xml_str = minidom.parseString(xml_str).toprettyxml(indent="  ")
+    return xml_str
+
+def _service_from_xml_element(service_elem):
+    """ Convert one <Service> element back to a service dict """
+    service = {}
+    for child in service_elem:
+        if list(child):  # If there are nested elements
+            if child.tag in service:
+                service[child.tag].append(parse_xml_element(child))
+            else:
+                service[child.tag] = [parse_xml_element(child)]
+        else:
+            service[child.tag] = child.text
+    return service
+
+def from_xml(xml_str):
+    """ Convert an XML string back to the services data structure """
+    services = []
+    root = ET.fromstring(xml_str)
+    
+    for service_elem in root.findall('Service'):
+        services.append(_service_from_xml_element(service_elem))
+    
+    return services
+
+def parse_xml_element(element):
+    """ Helper function to parse XML elements into a dictionary """
+    result = {}
+    for child in element:
+        if list(child):
+            result[child.tag] = parse_xml_element(child)
+        else:
+            result[child.tag] = child.text
+    return result
+
+def load_from_xml_file(xml_filename):
+    """ Load the services data structure from an XML file """
+    services = []
+    with open_compressed_reader(xml_filename) as file:
+        # Convert and drop each top level <Service> as soon as it is complete
+        # instead of building the whole tree ('Service' is also a child tag).
+        depth = 0
+        for event, elem in ET.iterparse(file, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1 and elem.tag == 'Service':
+                services.append(_service_from_xml_element(elem))
+                elem.clear()
+    return services
+
+def _has_spilled_threads(services):
+    return any(not isinstance(service.get('MessageThreads', []), list) for service in services)
+
+def _stream_to_file(services, filename, level, threads, writer_class, *args):
+    """ Write services thread by thread, so spilled threads (spill_message_file) never all come back into memory. """
+    with open_compressed_output(filename, level, threads) as file:
+        stream_services(iter_service_events(services), writer_class(file, *args))
+
+def save_to_xml_file(services, xml_filename, level=None, threads=1):
+    """ Save the services data structure to an XML file """
+    if _has_spilled_threads(services):
+        return _stream_to_file(services, xml_filename, level, threads, XMLServicesWriter)
+    xml_str = to_xml(services)
+    save_compressed_file(xml_str, xml_filename, level, threads)
+
+def save_to_json_file(services, json_filename, level=None, threads=1):
+    """ Save the services data structure to a JSON file """
+    if _has_spilled_threads(services):
+        return _stream_to_file(services, json_filename, level, threads, JSONServicesWriter)
+    json_data = to_json(services)
+    save_compressed_file(json_data, json_filename, level, threads)
+
+def _body_lines(key, section, text):
+    """ A 'Key:' line followed by its '--- Start/End <section> Body ---' block. """
+    output = ["{0}:".format(key), "--- Start {0} Body ---".format(section)]
+    if text:
+        output.extend(text.split("\n"))
+    output.append("--- End {0} Body ---".format(section))
+    return output
+
+def _service_string_header(service):
+    """ Lines of the original format that precede a service's message threads. """
+    output = []
+    output.append("--- Start Archive Service ---")
+    output.append("Entry: {0}".format(service.get('Entry', 'N/A')))
+    output.append("Service: {0}".format(service.get('Service', 'N/A')))
+    if service.get('Info'):
+        output.extend(_body_lines("Info", "Info", service['Info']))
+
+    categorization = service.get('Categorization') or {}
+    categories = service.get('Categories') or []
+    if categorization or categories:
+        output.append("")
+        output.append("--- Start Categorization List ---")
+        for category_type, category_levels in categorization.items():
+            output.append("{0}: {1}".format(category_type, ", ".join(category_levels)))
+        for category in categories:
+            output.append("")
+            output.append("--- Start Category List ---")
+            output.append("Kind: {0}".format(category.get('Kind') or "{0}, {1}".format(category.get('Type', ''), category.get('Level', ''))))
+            output.append("ID: {0}".format(category.get('ID', 'N/A')))
+            output.append("InSub: {0}".format(category.get('InSub', 0)))
+            output.append("Headline: {0}".format(category.get('Headline', '')))
+            description = category.get('Description', '')
+            if "\n" in description:
+                output.extend(_body_lines("Description", "Description", description))
+            else:
+                output.append("Description: {0}".format(description))
+            output.append("--- End Category List ---")
+        output.append("--- End Categorization List ---")
+
+    users = service.get('Users') or {}
+    if users:
+        output.append("")
+        output.append("--- Start User List ---")
+        for user_id, user in users.items():
+            output.append("--- Start User Info ---")
+            output.append("User: {0}".format(user_id))
+            output.append("Name: {0}".format(user.get('Name', '')))
+            output.append("Handle: {0}".format(user.get('Handle', '')))
+            output.append("Location: {0}".format(user.get('Location', '')))
+            output.append("Joined: {0}".format(user.get('Joined', '')))
+            output.append("Birthday: {0}".format(user.get('Birthday', '')))
+            output.extend(_body_lines("Bio", "Bio", user.get('Bio', '')))
+            output.append("--- End User Info ---")
+        output.append("--- End User List ---")
+
+    output.append("")
+    output.append("--- Start Message List ---")
+    output.append("Interactions: {0}".format(", ".join(service.get('Interactions', []))))
+    output.append("Status: {0}".format(", ".join(service.get('Status', []))))
+    return output
+
+def _thread_string_lines(thread):
+    """ Lines of the original format for one message thread. """
+    output = []
+    output.append("")
+    output.append("--- Start Message Thread ---")
+    output.append("Thread: {0}".format(thread.get('Thread', 'N/A')))
+    output.append("Title: {0}".format(thread.get('Title', '')))
+    if 'Category' in thread:
+        output.append("Category: {0}".format(", ".join(thread['Category'])))
+    if 'Forum' in thread:
+        output.append("Forum: {0}".format(", ".join(thread['Forum'])))
+    if 'Type' in thread:
+        output.append("Type: {0}".format(thread['Type']))
+    if 'State' in thread:
+        output.append("State: {0}".format(thread['State']))
+
+    for message in thread.get('Messages', []):
+        output.append("")
+        output.append("--- Start Message Post ---")
+        output.append("Author: {0}".format(message.get('Author', '')))
+        output.append("Time: {0}".format(message.get('Time', '')))
+        output.append("Date: {0}".format(message.get('Date', '')))
+        if 'SubType' in message:
+            output.append("SubType: {0}".format(message['SubType']))
+        output.append("Post: {0}".format(message.get('Post', 'N/A')))
+        output.append("Nested: {0}".format(message.get('Nested', 0)))
+        if 'Message' in message:
+            output.extend(_body_lines("Message", "Message", message['Message']))
+
+        if message.get('Polls'):
+            output.append("")
+            output.append("Polls:")
+            output.append("--- Start Poll List ---")
+            for poll in message['Polls']:
+                output.append("--- Start Poll Body ---")
+                output.append("Num: {0}".format(poll.get('Num', 'N/A')))
+                output.append("Question: {0}".format(poll.get('Question', '')))
+                output.append("Answers: {0}".format(", ".join(poll.get('Answers', []))))
+                output.append("Results: {0}".format(", ".join(str(r) for r in poll.get('Results', []))))
+                output.append("Percentage: {0}".format(", ".join(str(p) for p in poll.get('Percentage', []))))
+                output.append("Votes: {0}".format(poll.get('Votes', 'N/A')))
+                output.append("--- End Poll Body ---")
+            output.append("--- End Poll List ---")
+        output.append("--- End Message Post ---")
+    output.append("--- End Message Thread ---")
+    return output
+
+def _service_string_footer(service):
+    """ Lines of the original format that follow a service's message threads. """
+    return ["--- End Message List ---", "", "--- End Archive Service ---", ""]
+
+LINE_ENDINGS = {"lf": "\n", "cr": "\r", "crlf": "\r\n"}
+
+def services_to_string(services, line_ending="lf"):
+    """Convert the services structure into a string format suitable for saving to a file."""
+    output = []
+    
+    for service in services:
+        output.extend(_service_string_header(service))
+        for thread in service.get('MessageThreads', []):
+            output.extend(_thread_string_lines(thread))
+        output.extend(_service_string_footer(service))
+
+    return LINE_ENDINGS.get(line_ending, "\n").join(output)
+
+def save_services_to_file(services, filename, line_ending="lf", level=None, threads=1):
+    """ Save the services data structure to a file in the original text format """
+    if _has_spilled_threads(services):
+        return _stream_to_file(services, filename, level, threads, TextServicesWriter, line_ending)
+    data = services_to_string(services, line_ending)
+    save_compressed_file(data, filename, level, threads)
+
+class TextServicesWriter(ServicesStreamWriter):
+    """ Stream the services_to_string() format. """
+
+    def __init__(self, file, line_ending="lf"):
+        ServicesStreamWriter.__init__(self, file)
+        self.line_sep = LINE_ENDINGS.get(line_ending, "\n")
+        self.first_line = True
+
+    def _write_lines(self, lines):
+        if not lines:
+            return
+        data = self.line_sep.join(lines)
+        if not self.first_line:
+            data = self.line_sep + data
+        self.first_line = False
+        self.file.write(data)
+
+    def start_service(self, service):
+        self._write_lines(_service_string_header(service))
+
+    def write_thread(self, service, thread):
+        self._write_lines(_thread_string_lines(thread))
+
+    def end_service(self, service):
+        self._write_lines(_service_string_footer(service))
+
+class JSONServicesWriter(ServicesStreamWriter):
+    """ Stream the to_json() document, writing each thread as soon as it is parsed. """
+
+    def __init__(self, file):
+        ServicesStreamWriter.__init__(self, file)
+        self.file.write("[")
+        self.services_written = 0
+
+    def _dumps(self, value, depth):
+        return json.dumps(value, indent=2, default=_json_default).replace("\n", "\n" + "  " * depth)
+
+    def _write_keys(self, service, keys, first):
+        for key in keys:
+            self.file.write("{0}\n    {1}: {2}".format("" if first else ",", json.dumps(key), self._dumps(service[key], 2)))
+            first = False
+
+    def start_service(self, service):
+        self.file.write("{0}\n  {{".format("," if self.services_written else ""))
+        self.services_written += 1
+        self.header_keys = [key for key in service if key != 'MessageThreads']
+        self._write_keys(service, self.header_keys, True)
+        self.file.write("{0}\n    \"MessageThreads\": [".format("," if self.header_keys else ""))
+        self.threads_written = 0
+
+    def write_thread(self, service, thread):
+        self.file.write("{0}\n      {1}".format("," if self.threads_written else "", self._dumps(thread, 3)))
+        self.threads_written += 1
+
+    def end_service(self, service):
+        self.file.write("\n    ]" if self.threads_written else "]")
+        self._write_keys(service, [key for key in service if key != 'MessageThreads' and key not in self.header_keys], False)
+        self.file.write("\n  }")
+
+    def close(self):
+        self.file.write("\n]" if self.services_written else "]")
+        self.file.flush()
+
+class XMLServicesWriter(ServicesStreamWriter):
+    """ Stream the to_xml() document, writing each thread as soon as it is parsed. """
+
+    def __init__(self, file):
+        ServicesStreamWriter.__init__(self, file)
+        self.file.write('<?xml version="1.0" ?>\n<Services>\n')
+
+    def _write_keys(self, service, keys):
+        service_elem = ET.Element("Service")
+        for key in keys:
+            _xml_add_value(service_elem, key, service[key])
+        for child in service_elem:
+            self.file.write(_xml_pretty(child, 2))
+
+    def start_service(self, service):
+        self.file.write("  <Service>\n")
+        self.header_keys = [key for key in service if key != 'MessageThreads']
+        self._write_keys(service, self.header_keys)
+        self.file.write("    <MessageThreads>\n")
+
+    def write_thread(self, service, thread):
+        list_elem = ET.Element("MessageThreads")
+        self.file.write(_xml_pretty(_xml_add_list_item(list_elem, "MessageThreads", thread), 3))
+
+    def end_service(self, service):
+        self.file.write("    </MessageThreads>\n")
+        self._write_keys(service, [key for key in service if key != 'MessageThreads' and key not in self.header_keys])
+        self.file.write("  </Service>\n")
+
+    def close(self):
+        self.file.write("</Services>\n")
+        self.file.flush()
+
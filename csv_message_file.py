@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import csv
+
+from parse_message_file import (
+    ServicesStreamWriter, iter_parse_file, stream_services, open_compressed_output, CODECS
+)
+
+LIST_SEPARATOR = "|"
+
+# Column names of every table; each row starts with the keys that identify
+# it, so tables join on (entry, thread) and (entry, thread, post)
+TABLES = {
+    'users': ('entry', 'user', 'name', 'handle', 'location', 'joined', 'birthday', 'bio'),
+    'categories': ('entry', 'id', 'insub', 'type', 'level', 'headline', 'description'),
+    'threads': ('entry', 'thread', 'title', 'category', 'forum', 'type', 'state', 'posts'),
+    'posts': ('entry', 'thread', 'post', 'nested', 'author', 'time', 'date', 'subtype', 'message'),
+    'polls': ('entry', 'thread', 'post', 'num', 'question', 'answers', 'results', 'percentage', 'votes'),
+}
+DIALECTS = {'csv': '.csv', 'tsv': '.tsv'}
+
+_TSV_ESCAPES = {ord("\\"): "\\\\", ord("\t"): "\\t", ord("\n"): "\\n", ord("\r"): "\\r"}
+
+def split_compression(prefix):
+    """ Split a compression suffix off an output prefix, e.g. 'out.gz' -> ('out', '.gz'). """
+    for codec in CODECS.values():
+        for suffix in codec.suffixes:
+            if prefix.endswith(suffix):
+                return prefix[:-len(suffix)], suffix
+    return prefix, ''
+
+def table_filename(prefix, table, dialect='csv'):
+    """ Output file of one table, e.g. ('out.gz', 'posts') -> 'out.posts.csv.gz'. """
+    stem, compression = split_compression(prefix)
+    return "{0}.{1}{2}{3}".format(stem, table, DIALECTS[dialect], compression)
+
+def _cell(value, separator):
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return separator.join("" if item is None else "{0}".format(item) for item in value)
+    return value
+
+class TSVWriter:
+    """ csv.writer() lookalike for tab separated values.
+
+    Tabs, line breaks and backslashes inside values are escaped as \\t,
+    \\n, \\r and \\\\ (the convention of PostgreSQL's COPY and MySQL's LOAD
+    DATA), so every row is exactly one line.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def _line(self, row):
+        return "\t".join("" if value is None else "{0}".format(value).translate(_TSV_ESCAPES) for value in row) + "\n"
+
+    def writerow(self, row):
+        self.file.write(self._line(row))
+
+    def writerows(self, rows):
+        self.file.write("".join(self._line(row) for row in rows))
+
+class TableServicesWriter(ServicesStreamWriter):
+    """ Stream services as one flat CSV or TSV file per table (see TABLES).
+
+    Posts and polls are written as each thread is parsed; users and
+    categories when their service ends.  List fields (answers, thread
+    categories, ...) are joined with separator.  Files go through the
+    compression layer, chosen by a compression suffix on prefix.
+    """
+
+    def __init__(self, prefix, dialect='csv', separator=LIST_SEPARATOR, level=None, threads=1):
+        ServicesStreamWriter.__init__(self, None)
+        self.separator = separator
+        self.files = {}
+        self.writers = {}
+        self.rows = dict((table, 0) for table in TABLES)
+        for table, columns in TABLES.items():
+            file = open_compressed_output(table_filename(prefix, table, dialect), level, threads)
+            self.files[table] = file
+            if dialect == 'tsv':
+                writer = TSVWriter(file)
+            else:
+                writer = csv.writer(file, lineterminator="\n")
+            writer.writerow(columns)
+            self.writers[table] = writer
+
+    def _write(self, table, rows):
+        if rows:
+            self.writers[table].writerows(rows)
+            self.rows[table] += len(rows)
+
+    def write_thread(self, service, thread):
+        entry = service.get('Entry')
+        thread_id = thread.get('Thread')
+        messages = thread.get('Messages', [])
+        separator = self.separator
+        self._write('threads', [(entry, thread_id, thread.get('Title'), _cell(thread.get('Category'), separator),
+                                 _cell(thread.get('Forum'), separator), _cell(thread.get('Type'), separator),
+                                 _cell(thread.get('State'), separator), len(messages))])
+        posts = []
+        polls = []
+        for message in messages:
+            post_id = message.get('Post')
+            posts.append((entry, thread_id, post_id, _cell(message.get('Nested'), separator),
+                          _cell(message.get('Author'), separator), _cell(message.get('Time'), separator),
+                          _cell(message.get('Date'), separator), _cell(message.get('SubType'), separator),
+                          _cell(message.get('Message'), separator)))
+            for poll in message.get('Polls', []):
+                polls.append((entry, thread_id, post_id) + tuple(_cell(poll.get(key), separator) for key in
+                             ('Num', 'Question', 'Answers', 'Results', 'Percentage', 'Votes')))
+        self._write('posts', posts)
+        self._write('polls', polls)
+
+    def end_service(self, service):
+        entry = service.get('Entry')
+        separator = self.separator
+        self._write('users', [(entry, user_id) + tuple(_cell(user.get(key), separator) for key in
+                               ('Name', 'Handle', 'Location', 'Joined', 'Birthday', 'Bio'))
+                              for user_id, user in service.get('Users', {}).items()])
+        self._write('categories', [(entry,) + tuple(_cell(category.get(key), separator) for key in
+                                    ('ID', 'InSub', 'Type', 'Level', 'Headline', 'Description'))
+                                   for category in service.get('Categories', [])])
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+def export_tables(services, prefix, dialect='csv', separator=LIST_SEPARATOR, level=None, threads=1):
+    """ Write the services data structure as flat tables; returns the row count of each table. """
+    writer = TableServicesWriter(prefix, dialect, separator, level, threads)
+    try:
+        for service in services:
+            writer.start_service(service)
+            for thread in service.get('MessageThreads', []):
+                writer.write_thread(service, thread)
+            writer.end_service(service)
+    finally:
+        writer.close()
+    return writer.rows
+
+def export_archive_tables(filename, prefix, dialect='csv', separator=LIST_SEPARATOR, level=None, threads=1, verbose=False):
+    """ Stream an archive file straight into flat tables, one thread at a time; returns the row counts. """
+    writer = TableServicesWriter(prefix, dialect, separator, level, threads)
+    try:
+        stream_services(iter_parse_file(filename, verbose=verbose, threads=threads), writer)
+    finally:
+        writer.close()
+    return writer.rows
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import os
+from collections import namedtuple, OrderedDict
+
+try:
+    from hashlib import blake2b
+except ImportError:
+    blake2b = None
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+from parse_message_file import iter_parse_file
+
+DIGEST_SIZE = 16
+
+# Keys that are compared through their own digests (or are parser internals)
+# rather than as part of the service or thread header
+SERVICE_CHILDREN = frozenset(['Users', 'Categories', 'MessageThreads'])
+THREAD_CHILDREN = frozenset(['Messages', 'post_ids'])
+
+Change = namedtuple('Change', ['action', 'kind', 'key', 'fields'])
+Change.__doc__ = """ One difference: action is 'added', 'removed' or 'changed', kind is
+'service', 'user', 'category', 'thread' or 'post' and key the IDs leading
+to it, e.g. (entry, thread, post).  fields names the header keys that
+changed for a changed service or thread ('order' when only the order of
+its children did) and is empty otherwise.  Categories are keyed by
+(type, ID). """
+
+def _digest(data):
+    if blake2b is not None:
+        return blake2b(data, digest_size=DIGEST_SIZE).digest()
+    import hashlib
+    return hashlib.sha1(data).digest()[:DIGEST_SIZE]
+
+def _encode(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode('utf-8')
+
+def _header(item, children):
+    return dict((key, value) for key, value in item.items() if key not in children)
+
+def _keyed(ids):
+    """ Key every ID by (ID, occurrence), so a repeated ID is matched in order. """
+    seen = {}
+    keys = []
+    for item_id in ids:
+        count = seen.get(item_id, 0)
+        seen[item_id] = count + 1
+        keys.append((item_id, count))
+    return keys
+
+class ThreadDigest:
+    """ Digests of one thread: its header and each post, in order.
+
+    Post digests are kept as one bytes string of DIGEST_SIZE byte slices,
+    which keeps millions of posts affordable.
+    """
+
+    def __init__(self, thread):
+        self.header = _header(thread, THREAD_CHILDREN)
+        messages = thread.get('Messages', [])
+        self.post_ids = [message.get('Post') for message in messages]
+        self.post_digests = b"".join(_digest(_encode(message)) for message in messages)
+        self.digest = _digest(_encode(self.header) + self.post_digests)
+
+    def posts(self):
+        """ {(post ID, occurrence): digest} """
+        digests = self.post_digests
+        return dict((key, digests[number * DIGEST_SIZE:(number + 1) * DIGEST_SIZE])
+                    for number, key in enumerate(_keyed(self.post_ids)))
+
+class ServiceDigest:
+    """ Digests of one service: header, users, categories and threads.
+
+    digest covers everything below it, so two services with the same
+    digest are skipped without looking any further.
+    """
+
+    def __init__(self, service):
+        self.header = _header(service, SERVICE_CHILDREN)
+        self.threads = []
+        self.users = {}
+        self.categories = {}
+        self.digest = None
+
+    def add_thread(self, thread):
+        self.threads.append((thread.get('Thread'), ThreadDigest(thread)))
+
+    def finish(self, service):
+        """ Digest the header, users and categories once the service has been read. """
+        self.header = _header(service, SERVICE_CHILDREN)
+        self.users = dict((user_id, _digest(_encode(user))) for user_id, user in service.get('Users', {}).items())
+        categories = service.get('Categories', [])
+        for key, category in zip(_keyed((category.get('Type'), category.get('ID')) for category in categories), categories):
+            self.categories[key] = _digest(_encode(category))
+        parts = [_encode(self.header)]
+        parts.extend(_encode(user_id) + digest for user_id, digest in sorted(self.users.items()))
+        parts.extend(digest for key, digest in sorted(self.categories.items(), key=lambda item: repr(item[0])))
+        parts.extend(thread.digest for thread_id, thread in self.threads)
+        self.digest = _digest(b"\x00".join(parts))
+
+class ArchiveDigest:
+    """ Merkle digest of a whole archive: a digest per service, thread and post. """
+
+    def __init__(self):
+        self.services = []
+        self.digest = None
+
+    def finish(self):
+        self.digest = _digest(b"".join(service.digest for service in self.services))
+
+    def keyed_services(self):
+        """ OrderedDict of (Entry, occurrence) -> ServiceDigest. """
+        return OrderedDict(zip(_keyed(service.header.get('Entry') for service in self.services), self.services))
+
+def digest_services(services):
+    """ ArchiveDigest of a services data structure. """
+    archive = ArchiveDigest()
+    for service in services:
+        digest = ServiceDigest(service)
+        for thread in service.get('MessageThreads', []):
+            digest.add_thread(thread)
+        digest.finish(service)
+        archive.services.append(digest)
+    archive.finish()
+    return archive
+
+def digest_file(filename, threads=1):
+    """ ArchiveDigest of an archive file, streamed one thread at a time. """
+    archive = ArchiveDigest()
+    current = None
+    current_service = None
+    for event, service, item in iter_parse_file(filename, threads=threads):
+        if event == 'thread':
+            if service is not current_service:
+                current = ServiceDigest(service)
+                current_service = service
+            current.add_thread(item)
+        elif event == 'service':
+            if service is not current_service:
+                current = ServiceDigest(service)
+            current.finish(service)
+            archive.services.append(current)
+            current = current_service = None
+    archive.finish()
+    return archive
+
+def _path(path, key):
+    item_id = key[0]
+    return path + (item_id if isinstance(item_id, tuple) else (item_id,))
+
+def _diff_keys(old, new, kind, path, changes):
+    """ Compare two {(ID, occurrence): digest} dicts of leaves. """
+    for key, digest in old.items():
+        if key not in new:
+            changes.append(Change('removed', kind, _path(path, key), ()))
+        elif new[key] != digest:
+            changes.append(Change('changed', kind, _path(path, key), ()))
+    for key in new:
+        if key not in old:
+            changes.append(Change('added', kind, _path(path, key), ()))
+
+def _changed_fields(old, new):
+    return tuple(sorted(key for key in set(old) | set(new) if old.get(key) != new.get(key)))
+
+def _diff_threads(old, new, path, changes):
+    old_threads = OrderedDict(zip(_keyed(thread_id for thread_id, thread in old), (thread for thread_id, thread in old)))
+    new_threads = OrderedDict(zip(_keyed(thread_id for thread_id, thread in new), (thread for thread_id, thread in new)))
+    for key, old_thread in old_threads.items():
+        new_thread = new_threads.get(key)
+        if new_thread is None:
+            changes.append(Change('removed', 'thread', path + (key[0],), ()))
+            continue
+        if new_thread.digest == old_thread.digest:
+            continue
+        found = len(changes)
+        fields = _changed_fields(old_thread.header, new_thread.header)
+        if fields:
+            changes.append(Change('changed', 'thread', path + (key[0],), fields))
+        _diff_keys(old_thread.posts(), new_thread.posts(), 'post', path + (key[0],), changes)
+        if len(changes) == found:
+            # Same posts, in another order
+            changes.append(Change('changed', 'thread', path + (key[0],), ('order',)))
+    for key in new_threads:
+        if key not in old_threads:
+            changes.append(Change('added', 'thread', path + (key[0],), ()))
+
+def diff_digests(old, new):
+    """ Return the list of Changes that turn archive digest old into new.
+
+    Subtrees whose digests match are skipped without being looked into, so
+    the cost grows with the size of the change, not of the archive.
+    """
+    changes = []
+    if old.digest == new.digest:
+        return changes
+    old_services = old.keyed_services()
+    new_services = new.keyed_services()
+    for key, old_service in old_services.items():
+        new_service = new_services.get(key)
+        path = (key[0],)
+        if new_service is None:
+            changes.append(Change('removed', 'service', path, ()))
+            continue
+        if new_service.digest == old_service.digest:
+            continue
+        found = len(changes)
+        fields = _changed_fields(old_service.header, new_service.header)
+        if fields:
+            changes.append(Change('changed', 'service', path, fields))
+        _diff_keys(dict(((user_id, 0), digest) for user_id, digest in old_service.users.items()),
+                   dict(((user_id, 0), digest) for user_id, digest in new_service.users.items()), 'user', path, changes)
+        _diff_keys(old_service.categories, new_service.categories, 'category', path, changes)
+        _diff_threads(old_service.threads, new_service.threads, path, changes)
+        if len(changes) == found:
+            # Same users, categories and threads, in another order
+            changes.append(Change('changed', 'service', path, ('order',)))
+    for key in new_services:
+        if key not in old_services:
+            changes.append(Change('added', 'service', (key[0],), ()))
+    return changes
+
+def diff_services(old, new):
+    """ Changes between two services data structures. """
+    return diff_digests(digest_services(old), digest_services(new))
+
+def diff_files(old_filename, new_filename, workers=1, threads=1):
+    """ Changes between two archive files; workers=2 (None for one per CPU) digests both files at once in separate processes. """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and ProcessPoolExecutor is not None:
+        with ProcessPoolExecutor(2) as executor:
+            old = executor.submit(digest_file, old_filename, threads)
+            new = executor.submit(digest_file, new_filename, threads)
+            return diff_digests(old.result(), new.result())
+    return diff_digests(digest_file(old_filename, threads), digest_file(new_filename, threads))
+
+CHANGE_SIGNS = {'added': '+', 'removed': '-', 'changed': '~'}
+
+def format_change(change):
+    """ One line for a Change, e.g. '~ thread 1/4 (State, Title)' or '+ post 1/4/7'. """
+    line = "{0} {1} {2}".format(CHANGE_SIGNS[change.action], change.kind, "/".join("{0}".format(item) for item in change.key))
+    if change.fields:
+        line += " ({0})".format(", ".join(change.fields))
+    return line
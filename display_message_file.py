@@ -2,17 +2,49 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 import argparse
+import errno
+import os
 import sys
-from parse_message_file import (
-    parse_file, display_services, to_json, from_json, to_xml, from_xml,
-    load_from_json_file, save_to_json_file, load_from_xml_file, save_to_xml_file,
-    services_to_string, save_services_to_file
-)
+from parse_message_file import parse_file, iter_parse_file, stream_services, open_compressed_output, ParseProfile
+
+# Converters, display code, stats and the offset index are imported in the
+# branches that use them, so e.g. --validate-only never loads xml or json.
+
+def stream_file(args):
+    """ Parse args.filename thread by thread, writing each one out as soon as it is parsed. """
+    events = iter_parse_file(args.filename, verbose=args.verbose, profile=args.profile, threads=args.threads)
+    write_events(args, events)
+
+def write_events(args, events):
+    """ Write parse events to the --to-json/--to-xml/--to-original file, or display them. """
+    if args.to_json or args.to_xml or args.to_original:
+        from convert_message_file import JSONServicesWriter, XMLServicesWriter, TextServicesWriter
+        output = args.to_json or args.to_xml or args.to_original
+        with open_compressed_output(output, args.compress_level, args.threads) as file:
+            if args.to_json:
+                writer = JSONServicesWriter(file)
+            elif args.to_xml:
+                writer = XMLServicesWriter(file)
+            else:
+                writer = TextServicesWriter(file, line_ending=args.line_ending)
+            stream_services(events, writer, offset=args.offset, limit=args.limit)
+        print("Saved {0} to {1}".format("JSON" if args.to_json else "XML" if args.to_xml else "original format", output))
+    else:
+        from render_message_file import DisplayServicesWriter
+        stream_services(events, DisplayServicesWriter(sys.stdout, offset=args.offset), offset=args.offset, limit=args.limit)
 
 def main():
+    # 'batch' subcommand: many files per run, see batch_message_file.py
+    if len(sys.argv) > 1 and sys.argv[1] == "batch" and not os.path.exists("batch"):
+        from batch_message_file import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+
     parser = argparse.ArgumentParser(description="Parse and display message file content.")
-    parser.add_argument("filename", help="Path to the file to be parsed")
+    parser.add_argument("filename", nargs="?", help="Path to the file to be parsed")
     parser.add_argument("--validate-only", "-v", action="store_true", help="Only validate the file without displaying")
+    parser.add_argument("--all-errors", action="store_true", help="With --validate-only, report every error found by the stricter streaming validator instead of the parser's first")
+    parser.add_argument("--lint", action="store_true", help="Only check that section markers are balanced and nested, reporting every mismatch")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for --lint on uncompressed or seekable (.lsz) files, or 2 for --diff to read both files at once (0 for one per CPU)")
     parser.add_argument("--verbose", "-V", action="store_true", help="Enable verbose mode")
     parser.add_argument("--debug", "-d", action="store_true", help="Enable debug mode")
     parser.add_argument("--to-json", "-j", help="Convert the parsed data to JSON and save to a file")
@@ -21,47 +53,224 @@ def main():
     parser.add_argument("--to-xml", "-x", help="Convert the parsed data to XML and save to a file")
     parser.add_argument("--from-xml", "-X", help="Load the services data structure from an XML file")
     parser.add_argument("--xml-string", "-S", type=str, help="XML string to parse if --from-xml is specified")
+    parser.add_argument("--to-sqlite", help="Parse straight into a new SQLite database file (one table per services, users, categories, threads, posts and polls)")
+    parser.add_argument("--from-sqlite", help="Load the services data structure from an SQLite database")
+    parser.add_argument("--to-csv", metavar="PREFIX", help="Parse straight into flat CSV files, PREFIX.<table>.csv for users, categories, threads, posts and polls (a .gz/.bz2/... suffix on PREFIX compresses them)")
+    parser.add_argument("--to-tsv", metavar="PREFIX", help="Like --to-csv, but tab separated (PREFIX.<table>.tsv)")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"), help="List the services, users, categories, threads and posts added, removed or changed between two archive files")
+    parser.add_argument("--merge", nargs="+", metavar="FILE", help="Merge these archives into filename's in first post date order, dropping duplicate threads and posts; written like --stream")
+    parser.add_argument("--dedup-bodies", action="store_true", help="Store each distinct message body once while parsing (and in --to-json output), printing the dedup ratio to stderr")
+    parser.add_argument("--lazy-bodies", action="store_true", help="Leave message, bio and info bodies in the file until they are used (faster, smaller metadata-only scans such as --stats)")
+    parser.add_argument("--category", metavar="CATEGORY", help="Display only the threads filed under this category (a headline or ID) or any of its subcategories")
+    parser.add_argument("--forum", metavar="FORUM", help="Display only the threads filed under this forum (a headline or ID) or any of its subforums")
+    parser.add_argument("--complete", metavar="PREFIX", help="List the values of --complete-field that have a word starting with PREFIX (at most --limit, default 10)")
+    parser.add_argument("--complete-field", choices=["users", "Handle", "Name", "Headline", "Title"], default="users", help="What --complete completes: user handles and names (default), or one field")
+    parser.add_argument("--memory-budget", type=int, metavar="MB", help="Keep at most about this many megabytes of parsed threads in memory, spilling the rest to a temporary file")
+    parser.add_argument("--publish-shared", metavar="NAME", help="Parse into a read-only shared memory block named NAME for --from-shared in other processes, and keep it until Enter is pressed")
+    parser.add_argument("--from-shared", metavar="NAME", help="Display (or --stats) an archive published with --publish-shared, without parsing it again")
     parser.add_argument("--to-original", "-o", help="Convert the parsed data back to the original format and save to a file")
     parser.add_argument("--line-ending", "-l", choices=["lf", "cr", "crlf"], default="lf", help="Specify the line ending format for the output file")
+    parser.add_argument("--limit", type=int, default=None, help="Display at most this many message threads")
+    parser.add_argument("--offset", type=int, default=0, help="Skip this many message threads before displaying")
+    parser.add_argument("--stream", action="store_true", help="Parse, convert and emit one message thread at a time in constant memory")
+    parser.add_argument("--stats", action="store_true", help="Compute aggregate statistics in a single pass and print them as JSON")
+    parser.add_argument("--compress-level", type=int, default=None, help="Compression level for compressed output files (codec default if omitted)")
+    parser.add_argument("--threads", type=int, default=1, help="Compress output, and decompress seekable (.lsz) input, in independent blocks on this many threads")
+    parser.add_argument("--build-index", action="store_true", help="Write a sidecar offset index (<filename>.idx) for random access")
+    parser.add_argument("--thread", type=int, nargs=2, metavar=("ENTRY", "THREAD"), help="Display only one message thread, seeking to it through the sidecar index written by --build-index (the archive is indexed in memory if there is none)")
+    parser.add_argument("--profile", action="store_true", help="Print per-phase parse timings and counters to stderr")
     
     args = parser.parse_args()
+    if args.filename is None and not (args.diff or args.from_shared):
+        parser.error("the following arguments are required: filename")
+    args.profile = ParseProfile() if args.profile else None
 
     try:
+        if args.diff:
+            from diff_message_file import diff_files, format_change
+            changes = diff_files(args.diff[0], args.diff[1], workers=args.workers or None, threads=args.threads)
+            for change in changes:
+                print(format_change(change))
+            if changes:
+                print("{0} change(s) between '{1}' and '{2}'.".format(len(changes), args.diff[0], args.diff[1]))
+                sys.exit(1)
+            print("The files '{0}' and '{1}' are identical.".format(args.diff[0], args.diff[1]))
+            return
+        if args.from_sqlite:
+            from sqlite_message_file import from_sqlite
+        if args.from_json or args.from_xml:
+            from convert_message_file import from_json, load_from_json_file, from_xml, load_from_xml_file
+        if args.from_shared:
+            from shared_message_file import attach_archive
+        if args.from_json or args.from_xml or args.from_sqlite or args.from_shared or not (args.validate_only or args.lint or args.build_index or args.stats or args.to_sqlite or args.to_csv or args.to_tsv or args.merge or args.publish_shared or args.complete is not None):
+            from render_message_file import display_services, display_thread
+        if args.stats:
+            from stats_message_file import ArchiveStats, services_stats
+
         if args.from_json:
             if args.json_string:
                 services = from_json(args.json_string)
             else:
                 services = load_from_json_file(args.from_json)
-            display_services(services)
+            if args.stats:
+                print(services_stats(services).to_json())
+            else:
+                display_services(services, limit=args.limit, offset=args.offset)
         elif args.from_xml:
             if args.xml_string:
                 services = from_xml(args.xml_string)
             else:
                 services = load_from_xml_file(args.from_xml)
-            display_services(services)
+            if args.stats:
+                print(services_stats(services).to_json())
+            else:
+                display_services(services, limit=args.limit, offset=args.offset)
+        elif args.from_sqlite:
+            services = from_sqlite(args.from_sqlite)
+            if args.stats:
+                print(services_stats(services).to_json())
+            else:
+                display_services(services, limit=args.limit, offset=args.offset)
+        elif args.from_shared:
+            with attach_archive(args.from_shared) as services:
+                if args.stats:
+                    print(services_stats(services).to_json())
+                else:
+                    display_services(services, limit=args.limit, offset=args.offset)
         else:
-            if args.validate_only:
-                is_valid, error_message, error_line = parse_file(args.filename, validate_only=True, verbose=args.verbose)
+            if args.lint:
+                from lint_message_file import lint_file
+                errors = lint_file(args.filename, workers=args.workers or None)
+                for error in errors:
+                    print("{0}:{1}: {2}".format(error.filename, error.line_number, error.message))
+                if errors:
+                    print("The file '{0}' has {1} structural error(s).".format(args.filename, len(errors)))
+                    sys.exit(1)
+                print("The file '{0}' is well formed.".format(args.filename))
+            elif args.validate_only and args.all_errors:
+                from validate_message_file import validate_file
+                errors = validate_file(args.filename)
+                for error in errors:
+                    print("{0}:{1}: {2}".format(error.filename, error.line_number, error.message))
+                if errors:
+                    print("The file '{0}' has {1} validation error(s).".format(args.filename, len(errors)))
+                    sys.exit(1)
+                print("The file '{0}' is valid.".format(args.filename))
+            elif args.validate_only:
+                is_valid, error_message, error_line = parse_file(args.filename, validate_only=True, verbose=args.verbose, profile=args.profile)
                 if is_valid:
                     print("The file '{0}' is valid.".format(args.filename))
                 else:
                     print("Validation Error: {0}".format(error_message))
                     print("Line: {0}".format(error_line.strip()))
+            elif args.build_index:
+                from index_message_file import build_archive_index, index_filename
+                services, index = build_archive_index(args.filename, verbose=args.verbose, profile=args.profile)
+                print("Indexed {0} threads and {1} posts to {2}".format(len(index.threads), len(index.posts), index_filename(args.filename)))
+            elif args.thread:
+                from index_message_file import open_thread
+                display_thread(open_thread(args.filename, args.thread[0], args.thread[1]))
+            elif args.stats:
+                stats = ArchiveStats()
+                if args.lazy_bodies:
+                    from lazy_message_file import iter_parse_file_lazy
+                    events = iter_parse_file_lazy(args.filename, verbose=args.verbose, stats=stats)
+                else:
+                    events = iter_parse_file(args.filename, verbose=args.verbose, stats=stats, profile=args.profile, threads=args.threads)
+                for event in events:
+                    pass
+                print(stats.to_json())
+            elif args.to_sqlite:
+                from sqlite_message_file import save_archive_to_sqlite
+                save_archive_to_sqlite(args.filename, args.to_sqlite, verbose=args.verbose, threads=args.threads)
+                print("Saved SQLite database to {0}".format(args.to_sqlite))
+            elif args.to_csv or args.to_tsv:
+                from csv_message_file import export_archive_tables, table_filename
+                dialect = 'csv' if args.to_csv else 'tsv'
+                prefix = args.to_csv or args.to_tsv
+                rows = export_archive_tables(args.filename, prefix, dialect, level=args.compress_level, threads=args.threads, verbose=args.verbose)
+                for table in sorted(rows):
+                    print("Saved {0} rows to {1}".format(rows[table], table_filename(prefix, table, dialect)))
+            elif args.merge:
+                from merge_message_file import iter_merge_events
+                stats = {}
+                sources = [iter_parse_file(filename, verbose=args.verbose, threads=args.threads) for filename in [args.filename] + args.merge]
+                write_events(args, iter_merge_events(sources, stats))
+                print("Dropped {0} duplicate thread(s) and {1} duplicate post(s).".format(stats['duplicate_threads'], stats['duplicate_posts']), file=sys.stderr)
+                if stats['out_of_order']:
+                    print("Warning: {0} thread(s) were not in date order in their archive; the merge assumes each input is sorted.".format(stats['out_of_order']), file=sys.stderr)
+            elif args.complete is not None:
+                from prefix_message_file import PrefixIndex
+                index = PrefixIndex(parse_file(args.filename, verbose=args.verbose, profile=args.profile, threads=args.threads))
+                limit = args.limit if args.limit is not None else 10
+                if args.complete_field == "users":
+                    matches = index.complete_users(args.complete, limit)
+                else:
+                    matches = index.complete(args.complete, args.complete_field, limit)
+                for text, ref in matches:
+                    print("{0}\t{1}".format(text, "/".join("{0}".format(item) for item in ref)))
+            elif args.category or args.forum:
+                from category_message_file import index_services
+                services = parse_file(args.filename, verbose=args.verbose, profile=args.profile, threads=args.threads)
+                category_type = 'Categories' if args.category else 'Forums'
+                category = args.category or args.forum
+                if category.isdigit():
+                    category = int(category)
+                selected = []
+                for service, index in zip(services, index_services(services)):
+                    threads = index.select_threads(service, category, category_type)
+                    if threads:
+                        selected.append(dict(service, MessageThreads=threads))
+                display_services(selected, limit=args.limit, offset=args.offset)
+            elif args.publish_shared:
+                from shared_message_file import publish_file
+                with publish_file(args.filename, args.publish_shared, threads=args.threads) as archive:
+                    print("Published {0} bytes to shared memory '{1}'; press Enter to remove it.".format(archive.memory.size, archive.name))
+                    try:
+                        sys.stdin.readline()
+                    except KeyboardInterrupt:
+                        pass
+            elif args.stream:
+                stream_file(args)
             else:
-                services = parse_file(args.filename, verbose=args.verbose)
+                bodies = None
+                if args.dedup_bodies:
+                    from bodies_message_file import BodyStore, save_snapshot_file
+                    bodies = BodyStore()
+                if args.lazy_bodies:
+                    from lazy_message_file import parse_file_lazy
+                    services = parse_file_lazy(args.filename, verbose=args.verbose)
+                else:
+                    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None
+                    services = parse_file(args.filename, verbose=args.verbose, profile=args.profile, threads=args.threads, bodies=bodies, memory_budget=memory_budget)
+                if bodies is not None:
+                    print(bodies.format(), file=sys.stderr)
                 if args.debug:
                     import pdb; pdb.set_trace()
-                if args.to_json:
-                    save_to_json_file(services, args.to_json)
+                if args.to_json or args.to_xml or args.to_original:
+                    from convert_message_file import save_to_json_file, save_to_xml_file, save_services_to_file
+                if args.to_json and bodies is not None:
+                    save_snapshot_file(services, args.to_json, args.compress_level, args.threads)
+                    print("Saved deduplicated JSON snapshot to {0}".format(args.to_json))
+                elif args.to_json:
+                    save_to_json_file(services, args.to_json, args.compress_level, args.threads)
                     print("Saved JSON to {0}".format(args.to_json))
                 elif args.to_xml:
-                    save_to_xml_file(services, args.to_xml)
+                    save_to_xml_file(services, args.to_xml, args.compress_level, args.threads)
                     print("Saved XML to {0}".format(args.to_xml))
                 elif args.to_original:
-                    save_services_to_file(services, args.to_original, line_ending=args.line_ending)
+                    save_services_to_file(services, args.to_original, line_ending=args.line_ending, level=args.compress_level, threads=args.threads)
                     print("Saved original format to {0}".format(args.to_original))
                 else:
-                    display_services(services)
+                    display_services(services, limit=args.limit, offset=args.offset)
+            if args.profile is not None:
+                print(args.profile.format(), file=sys.stderr)
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            print("An error occurred: {0}".format(e), file=sys.stderr)
+            sys.exit(1)
+        # The reader (e.g. head) went away; stop quietly without a flush error at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
     except Exception as e:
         print("An error occurred: {0}".format(e), file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import os
+import re
+
+from parse_message_file import parse_file, parse_lines, open_compressed_reader, sniff_codec
+
+INDEX_VERSION = 2
+INDEX_SUFFIX = ".idx"
+
+_LINE_END = re.compile(b"\r\n|\r|\n")
+
+def iter_raw_lines(file, chunk_size=1 << 20):
+    """ Yield (byte offset, raw line) for a binary stream, splitting on LF, CR and CRLF. """
+    offset = 0
+    pending = b""
+    while True:
+        chunk = file.read(chunk_size)
+        data = pending + chunk if chunk else pending
+        if not data:
+            return
+        # A trailing CR may be the first half of a CRLF split across chunks
+        limit = len(data) - 1 if chunk and data.endswith(b"\r") else len(data)
+        start = 0
+        for match in _LINE_END.finditer(data, 0, limit):
+            yield offset + start, data[start:match.end()]
+            start = match.end()
+        if not chunk:
+            if start < len(data):
+                yield offset + start, data[start:]
+            return
+        offset += start
+        pending = data[start:]
+
+def index_filename(filename):
+    return filename + INDEX_SUFFIX
+
+class ArchiveIndex:
+    """ Byte offsets of every thread and post in one archive file.
+
+    Offsets are into the decompressed byte stream.  Fill one during a parse
+    with parse_file(filename, index=index), or with build_archive_index().
+    Threads are keyed by (service entry, thread ID) and posts by
+    (service entry, thread ID, post ID); each maps to the [start, end) span
+    from the '--- Start ... ---' line to the end of the matching end marker,
+    plus the included file the span lies in (None for the archive itself).
+    Threads from Include Messages sections are keyed by the including entry,
+    as the parser attaches them there.
+    """
+
+    def __init__(self):
+        self.threads = {}
+        self.posts = {}
+        self.includes = {}
+        self.size = 0
+        self.source = None
+        self.source_size = None
+        self.source_mtime = None
+        self.codec = None
+
+    def iter_lines(self, file):
+        """ Decode lines from a binary stream for the parser, recording thread and post offsets. """
+        for line in self._iter_indexed(file, None, None):
+            yield line
+
+    def _iter_indexed(self, file, source, owner):
+        # source is None for the archive itself, else the included file the
+        # spans point into; owner is the entry that included messages join
+        entry = None
+        thread_start = None
+        thread_id = None
+        post_start = None
+        post_id = None
+        include_kind = None
+        include_files = []
+        end = 0
+        for offset, raw_line in iter_raw_lines(file):
+            line = raw_line.decode('utf-8')
+            end = offset + len(raw_line)
+            marker = line.strip()
+            key = entry if owner is None else owner
+            if include_kind is not None:
+                if marker == "--- Include {0} End ---".format(include_kind):
+                    for include_file in include_files:
+                        self._index_include(include_file, key if include_kind == "Messages" else None)
+                    include_kind = None
+                else:
+                    include_files.append(marker)
+            elif marker in ("--- Include Messages Start ---", "--- Include Service Start ---"):
+                include_kind, include_files = marker.split()[2], []
+            elif marker == "--- Start Archive Service ---":
+                entry = None
+            elif marker == "--- Start Message Thread ---":
+                thread_start, thread_id = offset, None
+            elif marker == "--- Start Message Post ---":
+                post_start, post_id = offset, None
+            elif marker == "--- End Message Post ---":
+                if post_start is not None and post_id is not None:
+                    self.posts[(key, thread_id, post_id)] = (post_start, end, source)
+                post_start = None
+            elif marker == "--- End Message Thread ---":
+                if thread_start is not None and thread_id is not None:
+                    self.threads[(key, thread_id)] = (thread_start, end, source)
+                thread_start = None
+            elif marker.startswith("Entry:") and thread_start is None:
+                entry = _index_int(marker[6:])
+            elif marker.startswith("Thread:") and thread_start is not None and post_start is None:
+                thread_id = _index_int(marker[7:])
+            elif marker.startswith("Post:") and post_start is not None:
+                post_id = _index_int(marker[5:])
+            yield line
+        if source is None:
+            self.size = end
+
+    def _index_include(self, include_file, owner):
+        # Included threads are read back from their own file, which the
+        # parser opens by the same path
+        stat = os.stat(include_file)
+        self.includes[include_file] = (stat.st_size, stat.st_mtime)
+        with open_compressed_reader(include_file) as file:
+            for _ in self._iter_indexed(file, include_file, owner):
+                pass
+
+    def thread_span(self, entry, thread_id):
+        return self.threads.get((entry, thread_id))
+
+    def post_span(self, entry, thread_id, post_id):
+        return self.posts.get((entry, thread_id, post_id))
+
+    def to_dict(self):
+        return {
+            'Version': INDEX_VERSION,
+            'Source': self.source,
+            'SourceSize': self.source_size,
+            'SourceMTime': self.source_mtime,
+            'Codec': self.codec,
+            'Size': self.size,
+            'Includes': [[include_file, size, mtime] for include_file, (size, mtime) in self.includes.items()],
+            'Threads': [[entry, thread_id, start, end, source] for (entry, thread_id), (start, end, source) in self.threads.items()],
+            'Posts': [[entry, thread_id, post_id, start, end, source] for (entry, thread_id, post_id), (start, end, source) in self.posts.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('Version') != INDEX_VERSION:
+            raise ValueError("Unsupported index version '{0}'.".format(data.get('Version')))
+        index = cls()
+        index.source = data.get('Source')
+        index.source_size = data.get('SourceSize')
+        index.source_mtime = data.get('SourceMTime')
+        index.codec = data.get('Codec')
+        index.size = data.get('Size', 0)
+        for include_file, size, mtime in data.get('Includes', []):
+            index.includes[include_file] = (size, mtime)
+        for entry, thread_id, start, end, source in data.get('Threads', []):
+            index.threads[(entry, thread_id)] = (start, end, source)
+        for entry, thread_id, post_id, start, end, source in data.get('Posts', []):
+            index.posts[(entry, thread_id, post_id)] = (start, end, source)
+        return index
+
+    def matches(self, filename):
+        """ True if this index was built from filename (and its included files) as they are now on disk. """
+        stat = os.stat(filename)
+        if self.source_size != stat.st_size or self.source_mtime != stat.st_mtime:
+            return False
+        for include_file, (size, mtime) in self.includes.items():
+            try:
+                stat = os.stat(include_file)
+            except OSError:
+                return False
+            if size != stat.st_size or mtime != stat.st_mtime:
+                return False
+        return True
+
+    def save(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as file:
+            return cls.from_dict(json.load(file))
+
+def _index_int(value):
+    try:
+        return int(value.strip())
+    except ValueError:
+        return None
+
+def build_archive_index(filename, save=True, **parse_options):
+    """ Parse filename while indexing it; write the sidecar index and return (services, index). """
+    index = ArchiveIndex()
+    services = parse_file(filename, index=index, **parse_options)
+    stat = os.stat(filename)
+    index.source = os.path.basename(filename)
+    index.source_size = stat.st_size
+    index.source_mtime = stat.st_mtime
+    index.codec = sniff_codec(filename).name
+    if save:
+        index.save(index_filename(filename))
+    return services, index
+
+def load_archive_index(filename, build=False):
+    """ Load filename's sidecar index, or index the archive in memory if it is missing or stale.
+
+    Nothing is written next to the archive unless build=True, which also
+    saves the rebuilt sidecar.
+    """
+    sidecar = index_filename(filename)
+    if os.path.exists(sidecar):
+        try:
+            index = ArchiveIndex.load(sidecar)
+            if index.matches(filename):
+                return index
+        except ValueError:
+            pass
+    return build_archive_index(filename, save=build)[1]
+
+def read_span(filename, start, end):
+    """ Read the decompressed bytes [start, end) of filename. """
+    with open_compressed_reader(filename) as file:
+        if file.seekable():
+            file.seek(start)
+        else:
+            remaining = start
+            while remaining > 0:
+                skipped = len(file.read(min(remaining, 1 << 20)))
+                if not skipped:
+                    break
+                remaining -= skipped
+        return file.read(end - start)
+
+def _parse_thread_block(lines):
+    # Thread lines are only parsed inside a service's message list
+    wrapped = ["--- Start Archive Service ---", "--- Start Message List ---"]
+    wrapped.extend(lines)
+    wrapped.extend(["--- End Message List ---", "--- End Archive Service ---"])
+    services = parse_lines(wrapped)
+    return services[0]['MessageThreads'][0]
+
+def open_thread(filename, entry, thread_id, index=None, build=False):
+    """ Parse only one message thread of an archive, found through its sidecar index (see load_archive_index() for build). """
+    if index is None:
+        index = load_archive_index(filename, build)
+    span = index.thread_span(entry, thread_id)
+    if span is None:
+        raise ValueError("Thread ID {0} not found in service entry {1}.".format(thread_id, entry))
+    data = read_span(span[2] or filename, span[0], span[1]).decode('utf-8')
+    return _parse_thread_block(data.splitlines())
+
+def open_post(filename, entry, thread_id, post_id, index=None, build=False):
+    """ Parse one post, reading its thread only up to the end of that post. """
+    if index is None:
+        index = load_archive_index(filename, build)
+    thread_span = index.thread_span(entry, thread_id)
+    post_span = index.post_span(entry, thread_id, post_id)
+    if thread_span is None or post_span is None:
+        raise ValueError("Post ID {0} not found in thread {1}.".format(post_id, thread_id))
+    # Earlier posts are kept so the Nested -> Post check still has their IDs
+    data = read_span(thread_span[2] or filename, thread_span[0], post_span[1]).decode('utf-8')
+    lines = data.splitlines()
+    lines.append("--- End Message Thread ---")
+    thread = _parse_thread_block(lines)
+    return next(message for message in thread['Messages'] if message.get('Post') == post_id)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import mmap
+import re
+from collections import OrderedDict
+
+try:
+    from collections import UserString
+except ImportError:
+    from UserString import UserString
+
+from parse_message_file import iter_parse_lines, parse_lines, open_compressed_reader, sniff_codec
+
+BODY_CACHE_SIZE = 1024
+REGION_SIZE = 1 << 20
+
+# Body sections that are skipped, with their end marker
+BODY_SECTIONS = {
+    "Message": b"--- End Message Body ---",
+    "Bio": b"--- End Bio Body ---",
+    "Info": b"--- End Info Body ---",
+}
+# A start marker line, matched from the line ending before it
+_BODY_START = re.compile(br"[\r\n][ \t\f\v]*--- Start (Message|Bio|Info) Body ---[ \t\f\v]*(?:\r\n|\r|\n|$)")
+
+# Every key the parser acts on; a body line that starts with one of them (or
+# with a marker) may change the parser's state, so such bodies are read line
+# by line as usual instead of being skipped
+_PARSER_KEYS = (
+    "Author", "Birthday", "Categories", "Category", "Date", "Description", "Entry", "Forum", "Forums",
+    "Handle", "Headline", "ID", "InSub", "Info", "Interactions", "Joined", "Kind", "Location", "Name",
+    "Nested", "Post", "Service", "State", "Status", "SubType", "Thread", "Time", "Title", "Type", "User",
+)
+# Matched from the line ending before the line
+_SPECIAL_LINE = re.compile(br"[\r\n][ \t\f\v]*(?:---|(?:" + b"|".join(key.encode('ascii') for key in _PARSER_KEYS) + br")[ \t\f\v]*:)")
+_LINE_END = re.compile(br"\r\n|\r|\n")
+_TEXT_LINE_END = re.compile(r"\r\n|\r|\n")
+
+class LazyBody(UserString):
+    """ A body left in the archive until it is first used.
+
+    Behaves like a string (it is a UserString); the text is decoded from
+    the source's [start, end) byte span on access and kept in the source's
+    LRU cache.  str() gives a plain string.  UserString methods that build
+    a new string (slicing, upper(), ...) call LazyBody(text), which just
+    holds text.
+    """
+
+    def __init__(self, source, start=None, end=None):
+        self.source = source
+        self.start = start
+        self.end = end
+
+    @property
+    def data(self):
+        if self.start is None:
+            return "{0}".format(self.source)
+        return self.source.text(self.start, self.end)
+
+class BodySource:
+    """ Decompressed bytes of one archive, handing the parser lines with the bodies skipped.
+
+    Uncompressed files are memory-mapped; other codecs are decompressed
+    into memory once.  iter_lines() yields the lines of everything but
+    message, bio and info bodies (whose lines come through blank), and the
+    parser, given this source as its bodies hook, stores a LazyBody for
+    each of them.  Decoded bodies are kept in an LRU of cache_size entries.
+    """
+
+    def __init__(self, filename, cache_size=BODY_CACHE_SIZE):
+        self.filename = filename
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.decoded = 0
+        self.skipped = 0
+        self.span = None
+        if sniff_codec(filename).name == 'none':
+            with open(filename, 'rb') as file:
+                try:
+                    self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # Empty files cannot be mapped
+                    self.data = b""
+        else:
+            with open_compressed_reader(filename) as file:
+                self.data = file.read()
+
+    def text(self, start, end):
+        """ Body text of the byte span [start, end): its lines stripped and joined with LF, as the parser does. """
+        key = (start, end)
+        text = self.cache.get(key)
+        if text is not None:
+            self.cache.move_to_end(key)
+            return text
+        lines = _TEXT_LINE_END.split(self.data[start:end].decode('utf-8'))
+        if lines and not lines[-1]:
+            lines.pop()
+        text = "\n".join(line.strip() for line in lines)
+        self.decoded += 1
+        self.cache[key] = text
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return text
+
+    def _skip_body(self, start, end_marker):
+        """ End of the body starting at start if it can be skipped, else None. """
+        match = _SPECIAL_LINE.search(self.data, start - 1)
+        if match is None:
+            return None
+        line_start = match.start() + 1
+        line_end = _LINE_END.search(self.data, line_start)
+        line = self.data[line_start:line_end.start() if line_end else len(self.data)]
+        if line.strip() != end_marker:
+            return None
+        return line_start
+
+    def _region_end(self, position):
+        """ End of a run of about REGION_SIZE bytes of whole lines from position. """
+        data = self.data
+        limit = position + REGION_SIZE
+        if limit >= len(data):
+            return len(data)
+        cut = max(data.rfind(b"\n", position, limit), data.rfind(b"\r", position, limit)) + 1
+        if not cut:
+            match = _LINE_END.search(data, limit)
+            return match.end() if match else len(data)
+        if data[cut - 1:cut + 1] == b"\r\n":
+            cut += 1
+        return cut
+
+    def iter_lines(self):
+        """ Decoded lines for the parser, with the lines of skippable bodies left blank. """
+        data = self.data
+        size = len(data)
+        position = 0
+        pending = None
+        while position < size:
+            # Decode everything up to the next body start marker in one go
+            match = _BODY_START.search(data, max(position - 1, 0), position + REGION_SIZE)
+            region_end = self._region_end(position) if match is None else match.end()
+            lines = _TEXT_LINE_END.split(data[position:region_end].decode('utf-8'))
+            if not lines[-1]:
+                lines.pop()
+            position = region_end
+            # The span of a skipped body goes with its end marker, the line
+            # on which the parser asks for the body
+            self.span = pending
+            pending = None
+            for line in lines:
+                yield line
+                self.span = None
+            if match is None:
+                continue
+            body_end = self._skip_body(position, BODY_SECTIONS[match.group(1).decode('ascii')])
+            if body_end is not None:
+                # One blank line stands in for every skipped line, so the
+                # parser's line numbers still match the file
+                for line_end in _LINE_END.finditer(data, position, body_end):
+                    yield ""
+                pending = (position, body_end)
+                self.skipped += 1
+                position = body_end
+        self.span = None
+
+    def join_message(self, lines):
+        """ The parser's hook for a finished body: a LazyBody if it was skipped (its lines are just the blank stand-ins). """
+        span = self.span
+        self.span = None
+        if span is None:
+            return "\n".join(lines)
+        if span[0] == span[1]:
+            return ""
+        return LazyBody(self, span[0], span[1])
+
+    join_text = join_message
+
+def parse_file_lazy(filename, cache_size=BODY_CACHE_SIZE, verbose=False, stats=None):
+    """ parse_file() with message, bio and info bodies left as LazyBody spans of the file.
+
+    Scans that only look at metadata never decode (or allocate) the
+    bodies.  Included files are parsed as usual.
+    """
+    source = BodySource(filename, cache_size)
+    return parse_lines(source.iter_lines(), verbose=verbose, stats=stats, bodies=source)
+
+def iter_parse_file_lazy(filename, cache_size=BODY_CACHE_SIZE, verbose=False, stats=None, keep_threads=False):
+    """ iter_parse_file() with lazy bodies (see parse_file_lazy()). """
+    source = BodySource(filename, cache_size)
+    return iter_parse_lines(source.iter_lines(), verbose=verbose, stats=stats, keep_threads=keep_threads, bodies=source)
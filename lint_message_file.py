@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import io
+import os
+import re
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+from parse_message_file import open_compressed_reader, sniff_codec
+from validate_message_file import ValidationError, SECTIONS, ANYWHERE, INCLUDE_SECTIONS, MARKERS, split_marker
+
+SHARD_SIZE = 1 << 26
+
+# Shards are scanned with a leading LF so every line starts with a line ending
+_MARKER = re.compile(br"(?:\r\n?|\n)[ \t]*(---[^\r\n]*)")
+_LINE_END = re.compile(br"\r\n?|\n")
+
+def _count_lines(data, start=0, end=None):
+    """ Number of line endings (LF, CR or CRLF) in data[start:end]. """
+    if end is None:
+        end = len(data)
+    return data.count(b"\n", start, end) + data.count(b"\r", start, end) - data.count(b"\r\n", start, end)
+
+def marker_text(kind, section):
+    """ The marker line that opens (kind 'start') or closes (kind 'end') section. """
+    if section in INCLUDE_SECTIONS:
+        return "--- {0} {1} ---".format(section, "Start" if kind == 'start' else "End")
+    return "--- {0} {1} ---".format("Start" if kind == 'start' else "End", section)
+
+_BYTE_MARKERS = dict((line.encode('utf-8'), marker) for line, marker in MARKERS.items())
+
+def _find_open(stack, section):
+    """ Index of the innermost open section named section, or None. """
+    for number in range(len(stack) - 1, -1, -1):
+        if stack[number][0] == section:
+            return number
+    return None
+
+def _has_parent(section):
+    return section in SECTIONS and SECTIONS[section] is not ANYWHERE
+
+def _parent_error(section, line_number, top, top_line):
+    if top:
+        return "'{0}' on line {1} is inside '{2}' opened on line {3}".format(marker_text('start', section), line_number, top, top_line)
+    return "'{0}' on line {1} is outside of any section".format(marker_text('start', section), line_number)
+
+def _unclosed_error(name, start_line, section, line_number):
+    return "'{0}' on line {1} is not closed before '{2}' on line {3}".format(
+        marker_text('start', name), start_line, marker_text('end', section), line_number)
+
+class ShardSummary:
+    """ What one shard leaves for the merge after matching its own markers.
+
+    events holds, in order, the markers the shard could not resolve:
+    ('open', section, line, check_parent), ('close', section, line) and
+    ('check', section, lines) for runs of sections opened and closed inside
+    the shard whose parent is in an earlier one.  errors holds the errors
+    the shard found on its own as ('unknown', section, line),
+    ('parent', section, line, parent, parent line) or ('unclosed', section,
+    line, closing section, closing line).  Line numbers are relative to
+    the shard.  comment is (unmatched ends, opens left) of the
+    Comment Section markers, so the merge can tell which shards start
+    inside a comment.
+    """
+
+    def __init__(self, events, errors, lines, comment, comment_depth):
+        self.events = events
+        self.errors = errors
+        self.lines = lines
+        self.comment = comment
+        self.comment_depth = comment_depth
+
+    def comment_depth_after(self):
+        ends, opens = self.comment
+        return max(self.comment_depth - ends, 0) + opens
+
+def lint_bytes(data, comment_depth=0):
+    """ Match the section markers of one shard (whole lines of raw bytes) into a ShardSummary.
+
+    comment_depth is the number of comment sections open where the shard
+    starts; markers inside comments are ignored, as the parser does.
+    """
+    data = b"\n" + data
+    stack = []
+    events = []
+    errors = []
+    comment_ends = comment_opens = 0
+    depth = comment_depth
+    for match in _MARKER.finditer(data):
+        line = match.group(1).rstrip()
+        marker = _BYTE_MARKERS.get(line) or split_marker(line.decode('utf-8', 'replace'))
+        if marker is None:
+            continue
+        kind, section = marker
+        if section == 'Comment Section':
+            if kind == 'start':
+                depth += 1
+                comment_opens += 1
+            else:
+                depth = max(depth - 1, 0)
+                if comment_opens:
+                    comment_opens -= 1
+                else:
+                    comment_ends += 1
+        elif depth:
+            continue
+        position = match.start()
+
+        if kind == 'start':
+            if section not in SECTIONS:
+                errors.append((position, 'unknown', section))
+            if not stack:
+                # The parent is in an earlier shard, so the merge checks it
+                stack.append((section, position, _has_parent(section)))
+                continue
+            if _has_parent(section) and stack[-1][0] not in SECTIONS[section]:
+                errors.append((position, 'parent', (section, stack[-1][0], stack[-1][1])))
+            stack.append((section, position, False))
+            continue
+
+        if stack and stack[-1][0] == section:
+            name, start, check = stack.pop()
+        else:
+            opened = _find_open(stack, section)
+            if opened is None:
+                # Closes something from an earlier shard, or nothing at all; only
+                # the merge can tell, so hand it everything still open here
+                events.extend(('open', name, start, check) for name, start, check in stack)
+                events.append(('close', section, position))
+                stack = []
+                continue
+            for name, start, check in stack[opened + 1:]:
+                errors.append((position, 'unclosed', (name, start, section)))
+            name, start, check = stack[opened]
+            del stack[opened:]
+        if check:
+            if events and events[-1][0] == 'check' and events[-1][1] == name:
+                events[-1][2].append(start)
+            else:
+                events.append(('check', name, [start]))
+    events.extend(('open', name, start, check) for name, start, check in stack)
+
+    # Only now turn the byte positions still needed into line numbers
+    positions = set()
+    for event in events:
+        positions.update(event[2] if event[0] == 'check' else (event[2],))
+    for position, kind, detail in errors:
+        positions.add(position)
+        if kind == 'parent':
+            positions.add(detail[2])
+        elif kind == 'unclosed':
+            positions.add(detail[1])
+    lines = {}
+    line_count = 0
+    last = 0
+    for position in sorted(positions):
+        line_count += _count_lines(data, last, position)
+        last = position
+        lines[position] = line_count + 1
+
+    summary_events = []
+    for event in events:
+        if event[0] == 'check':
+            summary_events.append(('check', event[1], [lines[position] for position in event[2]]))
+        elif event[0] == 'open':
+            summary_events.append(('open', event[1], lines[event[2]], event[3]))
+        else:
+            summary_events.append(('close', event[1], lines[event[2]]))
+    summary_errors = []
+    for position, kind, detail in errors:
+        if kind == 'unknown':
+            summary_errors.append((kind, detail, lines[position]))
+        elif kind == 'parent':
+            summary_errors.append((kind, detail[0], lines[position], detail[1], lines[detail[2]]))
+        else:
+            summary_errors.append((kind, detail[0], lines[detail[1]], detail[2], lines[position]))
+    return ShardSummary(summary_events, summary_errors, _count_lines(data) - 1, (comment_ends, comment_opens), comment_depth)
+
+def _shard_error(error, offset):
+    kind, section, line_number = error[0], error[1], offset + error[2]
+    if kind == 'unknown':
+        return line_number, "Unknown section '{0}' on line {1}".format(section, line_number)
+    if kind == 'parent':
+        return line_number, _parent_error(section, line_number, error[3], offset + error[4])
+    # Filed under the line of the section left open, as the validator does
+    return line_number, _unclosed_error(section, line_number, error[3], offset + error[4])
+
+def merge_summaries(summaries, filename=None):
+    """ Resolve the events left by consecutive shards; return every error as a ValidationError, by line. """
+    stack = []
+    errors = []
+    offset = 0
+    for summary in summaries:
+        for error in summary.errors:
+            errors.append(_shard_error(error, offset))
+        for event in summary.events:
+            kind, section = event[0], event[1]
+            top, top_line = stack[-1] if stack else ('', 0)
+            if kind == 'check':
+                if top not in SECTIONS[section]:
+                    errors.extend((offset + line_number, _parent_error(section, offset + line_number, top, top_line)) for line_number in event[2])
+            elif kind == 'open':
+                line_number = offset + event[2]
+                if event[3] and top not in SECTIONS[section]:
+                    errors.append((line_number, _parent_error(section, line_number, top, top_line)))
+                stack.append((section, line_number))
+            else:
+                line_number = offset + event[2]
+                opened = _find_open(stack, section)
+                if opened is None:
+                    errors.append((line_number, "'{0}' on line {1} has no matching start".format(marker_text('end', section), line_number)))
+                    continue
+                errors.extend((start_line, _unclosed_error(name, start_line, section, line_number)) for name, start_line in stack[opened + 1:])
+                del stack[opened:]
+        offset += summary.lines
+    errors.sort(key=lambda error: error[0])
+    found = [ValidationError(filename, line_number, message, "") for line_number, message in errors]
+    found.extend(ValidationError(filename, start_line, "'{0}' on line {1} is never closed".format(marker_text('start', name), start_line), "")
+                 for name, start_line in stack)
+    return found
+
+def iter_stream_shards(file, shard_size=SHARD_SIZE):
+    """ Yield shards of whole lines (about shard_size bytes each) from a binary stream. """
+    pending = b""
+    while True:
+        data = file.read(shard_size)
+        if not data:
+            if pending:
+                yield pending
+            return
+        data = pending + data
+        # A trailing CR may be the first half of a CRLF split across reads
+        ends = [match.end() for match in _LINE_END.finditer(data, max(len(data) - 65536, 0))]
+        if ends and ends[-1] == len(data) and data.endswith(b"\r"):
+            ends.pop()
+        cut = ends[-1] if ends else 0
+        if cut:
+            yield data[:cut]
+        pending = data[cut:]
+
+def shard_spans(filename, shard_size=SHARD_SIZE):
+    """ [start, end) byte spans of whole lines covering filename's decompressed data. """
+    with open_compressed_reader(filename) as file:
+        size = file.seek(0, io.SEEK_END)
+        spans = []
+        start = 0
+        while start < size:
+            cut = start + shard_size
+            if cut >= size:
+                spans.append((start, size))
+                break
+            file.seek(cut)
+            data = file.read(65536)
+            while True:
+                match = _LINE_END.search(data)
+                # A CR at the very end may be the first half of a CRLF
+                if match is not None and not (match.end() == len(data) and data.endswith(b"\r")):
+                    break
+                more = file.read(65536)
+                if not more:
+                    break
+                data += more
+            end = size if match is None else cut + match.end()
+            spans.append((start, end))
+            start = end
+        return spans
+
+def lint_shard(filename, start, end, comment_depth=0):
+    """ lint_bytes() over the decompressed bytes [start, end) of filename. """
+    with open_compressed_reader(filename) as file:
+        file.seek(start)
+        return lint_bytes(file.read(end - start), comment_depth)
+
+# Codecs whose readers seek without decompressing everything before the target
+SHARDABLE_CODECS = ('none', 'seekable')
+
+def lint_file(filename, workers=1, shard_size=SHARD_SIZE):
+    """ Check that every section marker of filename is balanced and properly nested.
+
+    Returns every problem as a ValidationError; mismatches name the line of
+    the start marker and of the end marker.  Uncompressed and seekable
+    (.lsz) files are cut into shards of about shard_size bytes that
+    workers processes (None for one per CPU) check in parallel; the
+    result is the same as a serial run.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or ProcessPoolExecutor is None or sniff_codec(filename).name not in SHARDABLE_CODECS:
+        summaries = []
+        depth = 0
+        with open_compressed_reader(filename) as file:
+            for data in iter_stream_shards(file, shard_size):
+                summaries.append(lint_bytes(data, depth))
+                depth = summaries[-1].comment_depth_after()
+        return merge_summaries(summaries, filename)
+
+    spans = shard_spans(filename, shard_size)
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(lint_shard, filename, start, end) for start, end in spans]
+        summaries = [future.result() for future in futures]
+    # Shards were checked as if outside any comment; redo the rare ones that were not
+    depth = 0
+    for number, summary in enumerate(summaries):
+        if summary.comment_depth != depth:
+            summary = summaries[number] = lint_shard(filename, spans[number][0], spans[number][1], depth)
+        depth = summary.comment_depth_after()
+    return merge_summaries(summaries, filename)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import datetime
+import hashlib
+import heapq
+import itertools
+
+from parse_message_file import iter_parse_file, parse_message_datetime, stream_services
+
+# Sort keys put a service's end after all of its threads, and threads whose
+# first post has no usable date before the dated ones
+_THREAD = 0
+_SERVICE_END = 1
+_UNDATED = datetime.datetime.min
+
+def post_key(message):
+    """ What makes two posts of the same thread duplicates: (Post, Author, Date, body hash). """
+    body = message.get('Message', '')
+    return (message.get('Post'), message.get('Author'), message.get('Date'),
+            hashlib.sha1(body.encode('utf-8')).digest())
+
+def thread_time(thread):
+    """ Parsed date and time of a thread's first post, or datetime.min. """
+    messages = thread.get('Messages')
+    if not messages:
+        return _UNDATED
+    return parse_message_datetime(messages[0].get('Date'), messages[0].get('Time')) or _UNDATED
+
+class _Input:
+    """ One archive being merged: its events turned into sortable items. """
+
+    def __init__(self, number, events, stats):
+        self.number = number
+        self.events = events
+        self.stats = stats
+        self.service = None
+        self.counter = itertools.count()
+        self.last = None
+
+    def __iter__(self):
+        for event, service, item in self.events:
+            if event == 'error':
+                raise ValueError(service)
+            self.service = service
+            entry = service.get('Entry', 0)
+            if event == 'thread':
+                key = (entry, _THREAD, thread_time(item))
+            elif event == 'service':
+                key = (entry, _SERVICE_END, _UNDATED)
+            else:
+                continue
+            if self.last is not None and key < self.last:
+                self.stats['out_of_order'] += 1
+            self.last = key
+            yield key + (self.number, next(self.counter)), self, item
+
+def _merge_list(target, values):
+    for value in values:
+        if value not in target:
+            target.append(value)
+
+def merge_service_headers(target, service):
+    """ Fold service's header, users and categories into target; values already in target win. """
+    for key, value in service.items():
+        if key == 'MessageThreads':
+            continue
+        if key == 'Users':
+            users = target.setdefault('Users', {})
+            for user_id, user in value.items():
+                users.setdefault(user_id, user)
+        elif key == 'Categories':
+            categories = target.setdefault('Categories', [])
+            known = set((category.get('Type'), category.get('ID')) for category in categories)
+            for category in value:
+                if (category.get('Type'), category.get('ID')) not in known:
+                    categories.append(category)
+        elif key == 'Categorization':
+            categorization = target.setdefault('Categorization', {})
+            for category_type, levels in value.items():
+                _merge_list(categorization.setdefault(category_type, []), levels)
+        elif key in ('Interactions', 'Status'):
+            _merge_list(target.setdefault(key, []), value)
+        elif not target.get(key):
+            target[key] = value
+    return target
+
+def merge_threads(threads, stats):
+    """ Merge copies of one thread into a thread holding each distinct post once.
+
+    The first copy's header wins.  Posts keep the order they are first
+    seen in, so replies still follow the posts they are Nested under.
+    """
+    merged = dict(threads[0])
+    for thread in threads[1:]:
+        for key, value in thread.items():
+            merged.setdefault(key, value)
+    seen = set()
+    messages = []
+    for thread in threads:
+        for message in thread.get('Messages', []):
+            key = post_key(message)
+            if key in seen:
+                stats['duplicate_posts'] += 1
+                continue
+            seen.add(key)
+            messages.append(message)
+    merged['Messages'] = messages
+    if 'post_ids' in merged:
+        merged['post_ids'] = set(message.get('Post') for message in messages)
+    return merged
+
+def iter_merge_events(event_sources, stats=None):
+    """ k-way merge several iter_parse_file() event streams into one.
+
+    Each source is expected in archive order: services by Entry and threads
+    by the date of their first post, which is how exports are written.
+    Services with the same Entry become one service, and threads are
+    yielded in first post order.  Copies of a thread (same Entry, Thread and
+    first post date) are merged and their duplicate posts dropped (see
+    post_key()).  Only the head thread of every source and the copies of
+    the thread being merged are held in memory.  stats, a dict, counts the
+    duplicate threads and posts dropped, and the threads found out of order
+    (copies of those may be missed, and the output is not fully sorted).
+    """
+    if stats is None:
+        stats = {}
+    for name in ('duplicate_threads', 'duplicate_posts', 'out_of_order'):
+        stats.setdefault(name, 0)
+    inputs = [_Input(number, events, stats) for number, events in enumerate(event_sources)]
+    merged = heapq.merge(*inputs, key=lambda item: item[0])
+    service = None
+    entry = None
+    group_key = None
+    group = []
+
+    def flush():
+        by_id = {}
+        order = []
+        for thread in group:
+            thread_id = thread.get('Thread')
+            if thread_id not in by_id:
+                by_id[thread_id] = []
+                order.append(thread_id)
+            else:
+                stats['duplicate_threads'] += 1
+            by_id[thread_id].append(thread)
+        del group[:]
+        for thread_id in order:
+            copies = by_id[thread_id]
+            yield merge_threads(copies, stats) if len(copies) > 1 else copies[0]
+
+    for key, source, thread in merged:
+        if service is None or key[0] != entry:
+            if group:
+                for merged_thread in flush():
+                    yield 'thread', service, merged_thread
+            if service is not None:
+                yield 'service', service, None
+            entry = key[0]
+            # Every source already holds the header of its current service
+            service = {'MessageThreads': []}
+            for other in inputs:
+                if other.service is not None and other.service.get('Entry', 0) == entry:
+                    merge_service_headers(service, other.service)
+            group_key = None
+        if key[1] == _SERVICE_END:
+            # Users or categories may have been read after the first thread
+            merge_service_headers(service, source.service)
+            continue
+        if key[:3] != group_key:
+            for merged_thread in flush():
+                yield 'thread', service, merged_thread
+            group_key = key[:3]
+        group.append(thread)
+    for merged_thread in flush():
+        yield 'thread', service, merged_thread
+    if service is not None:
+        yield 'service', service, None
+
+def merge_archives(filenames, writer, threads=1):
+    """ Merge archive files into writer (a ServicesStreamWriter); returns counts of what was written and dropped. """
+    stats = {}
+    events = iter_merge_events([iter_parse_file(filename, threads=threads) for filename in filenames], stats)
+    stats['threads'] = stream_services(events, writer)
+    return stats
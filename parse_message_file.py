@@ -1,24 +1,12 @@
 #!/usr/bin/env python
 
 from __future__ import absolute_import, division, print_function, unicode_literals
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
-import json
-import zlib
-import gzip
-import bz2
+import importlib
+import time
 import sys
 import os
 import io
 
-try:
-    import lzma
-except ImportError:
-    try:
-        from backports import lzma
-    except ImportError:
-        lzma = None
-
 try:
     from io import StringIO
 except ImportError:
@@ -27,6 +15,12 @@ except ImportError:
     except ImportError:
         from StringIO import StringIO
 
+from codec_message_file import (
+    ZlibFile, CODECS, register_codec, codec_for_filename, sniff_codec,
+    open_compressed_reader, open_compressed_file, open_compressed_writer,
+    open_compressed_output, save_compressed_file
+)
+
 PY2 = sys.version_info[0] == 2
 
 # Compatibility for different string types between Python 2 and 3
@@ -54,132 +48,6 @@ if(__version_info__[3] is not None):
 if(__version_info__[3] is None):
  __version__ = str(__version_info__[0]) + "." + str(__version_info__[1]) + "." + str(__version_info__[2]);
 
-class ZlibFile:
-    def __init__(self, file_path=None, fileobj=None, mode='rb', level=9, wbits=15, encoding=None, errors=None, newline=None):
-        if file_path is None and fileobj is None:
-            raise ValueError("Either file_path or fileobj must be provided")
-        if file_path is not None and fileobj is not None:
-            raise ValueError("Only one of file_path or fileobj should be provided")
-
-        self.file_path = file_path
-        self.fileobj = fileobj
-        self.mode = mode
-        self.level = level
-        self.wbits = wbits
-        self.encoding = encoding
-        self.errors = errors
-        self.newline = newline
-        self._compressed_data = b''
-        self._decompressed_data = b''
-        self._position = 0
-        self._text_mode = 't' in mode
-
-        # Force binary mode for internal handling
-        internal_mode = mode.replace('t', 'b')
-
-        if 'w' in mode or 'a' in mode or 'x' in mode:
-            self.file = open(file_path, internal_mode) if file_path else fileobj
-            self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
-        elif 'r' in mode:
-            if file_path:
-                if os.path.exists(file_path):
-                    self.file = open(file_path, internal_mode)
-                    self._load_file()
-                else:
-                    raise FileNotFoundError("No such file: '{}'".format(file_path))
-            elif fileobj:
-                self.file = fileobj
-                self._load_file()
-        else:
-            raise ValueError("Mode should be 'rb' or 'wb'")
-
-    def write(self, data):
-        """Write data to the file, compressing it in the process."""
-        if 'w' not in self.mode and 'a' not in self.mode and 'x' not in self.mode:
-            raise IOError("File not open for writing")
-
-        if self._text_mode and isinstance(data, str):
-            data = data.encode(self.encoding or 'utf-8', errors=self.errors)
-
-        compressed_data = self._compressor.compress(data)
-        self.file.write(compressed_data)
-
-    def close(self):
-        """Close the file, writing any remaining compressed data."""
-        if 'w' in self.mode or 'a' in self.mode or 'x' in self.mode:
-            self.file.write(self._compressor.flush())
-        self.file.close()
-
-    def _load_file(self):
-        """Load and decompress the file content."""
-        self._compressed_data = self.file.read()
-        self._decompressed_data = zlib.decompress(self._compressed_data, self.wbits)
-        self.file.close()
-
-    def read(self, size=-1):
-        """Read and return the decompressed data."""
-        if size == -1:
-            size = len(self._decompressed_data) - self._position
-        data = self._decompressed_data[self._position:self._position + size]
-        self._position += size
-        return data
-
-    def readline(self):
-        """Read and return a single line from the decompressed data."""
-        newline_pos = self._decompressed_data.find(b'\n', self._position)
-        if newline_pos == -1:
-            return self.read()  # Read until the end of the data
-        line = self._decompressed_data[self._position:newline_pos + 1]
-        self._position = newline_pos + 1
-        return line
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
-
-
-def open_compressed_file(filename):
-    """ Open a file, trying various compression methods if available. """
-    if filename.endswith('.gz'):
-        return gzip.open(filename, 'rt', encoding='utf-8')
-    elif filename.endswith('.bz2'):
-        return bz2.open(filename, 'rt', encoding='utf-8')
-    elif filename.endswith('.xz') or filename.endswith('.lzma'):
-        if lzma:
-            return lzma.open(filename, 'rt', encoding='utf-8')
-        else:
-            raise ImportError("lzma module is not available")
-    elif filename.endswith('.zl') or filename.endswith('.zz'):
-        return ZlibFile(file_path=filename, mode='rb')
-    else:
-        return io.open(filename, 'r', encoding='utf-8')
-
-def save_compressed_file(data, filename):
-    """ Save data to a file, using various compression methods if specified. """
-    if filename.endswith('.gz'):
-        with gzip.open(filename, 'wt', encoding='utf-8') as file:
-            file.write(data)
-    elif filename.endswith('.bz2'):
-        with bz2.open(filename, 'wt', encoding='utf-8') as file:
-            file.write(data)
-    elif filename.endswith('.xz') or filename.endswith('.lzma'):
-        if lzma:
-            with lzma.open(filename, 'wt', encoding='utf-8') as file:
-                file.write(data)
-        else:
-            raise ImportError("lzma module is not available")
-    elif filename.endswith('.zl') or filename.endswith('.zz'):
-        with ZlibFile(file_path=filename, mode='wb') as file:
-            if isinstance(data, str):
-                file.write(data.encode('utf-8'))
-            else:
-                file.write(data)
-    else:
-        with io.open(filename, 'w', encoding='utf-8') as file:
-            file.write(data)
-
 def parse_line(line):
     """ Parse a line in the format 'var: value' and return the key and value. """
     parts = line.split(":", 1)
@@ -197,17 +65,230 @@ def validate_non_negative_integer(value, key, line_number):
     except ValueError as e:
         raise ValueError("Invalid integer '{0}' for key '{1}' on line {2}".format(value, key, line_number))
 
-def parse_file(filename, validate_only=False, verbose=False):
-    with open_compressed_file(filename) as file:
-        lines = file.readlines()
-    return parse_lines(lines, validate_only, verbose)
+def parse_message_datetime(date, time=None):
+    """ Parse a post 'Date' (and optional 'Time') value into a datetime, or None if it cannot be parsed. """
+    import datetime
+    if not date:
+        return None
+    date = date.strip()
+    for date_format in ("%b %d, %Y", "%B %d, %Y", "%Y-%m-%d", "%B, %Y", "%b, %Y"):
+        try:
+            parsed = datetime.datetime.strptime(date, date_format)
+            break
+        except ValueError:
+            continue
+    else:
+        return None
+    if time:
+        for time_format in ("%I:%M %p", "%H:%M", "%I:%M:%S %p", "%H:%M:%S"):
+            try:
+                parsed_time = datetime.datetime.strptime(time.strip(), time_format).time()
+                return datetime.datetime.combine(parsed.date(), parsed_time)
+            except ValueError:
+                continue
+    return parsed
+
+class ParseProfile:
+    """ Opt-in per-phase timers and counters for parse_file().
+
+    Pass an instance as parse_file(..., profile=profile) and read
+    profile.to_dict() afterwards.  Nothing is timed or counted when no
+    profile is given.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.section_lines = {}
+        self.includes = []
+
+    def add_time(self, phase, seconds):
+        self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def timed(self, phase, function):
+        """ Wrap function so every call is added to the phase timer. """
+        timer = time.perf_counter
+        def wrapper(*args):
+            start = timer()
+            try:
+                return function(*args)
+            finally:
+                self.timers[phase] = self.timers.get(phase, 0.0) + timer() - start
+        return wrapper
+
+    def iter_lines(self, lines):
+        """ Pass lines through, counting them per innermost '--- Start X ---' section. """
+        stack = ["(top level)"]
+        section_lines = self.section_lines
+        count = 0
+        for line in lines:
+            count += 1
+            marker = line.strip()
+            if marker.startswith("--- ") and marker.endswith(" ---"):
+                words = marker[4:-4]
+                if words.startswith("Start "):
+                    stack.append(words[6:])
+                elif words.startswith("End ") and len(stack) > 1:
+                    section_lines[stack[-1]] = section_lines.get(stack[-1], 0) + 1
+                    stack.pop()
+                    yield line
+                    continue
+                elif words.startswith("Include ") and words.endswith(" Start"):
+                    stack.append(words[:-6])
+                elif words.startswith("Include ") and words.endswith(" End") and len(stack) > 1:
+                    section_lines[stack[-1]] = section_lines.get(stack[-1], 0) + 1
+                    stack.pop()
+                    yield line
+                    continue
+            section_lines[stack[-1]] = section_lines.get(stack[-1], 0) + 1
+            yield line
+        self.count('lines', count)
+
+    def add_include(self, filename, seconds):
+        self.includes.append({'File': filename, 'Seconds': round(seconds, 6)})
+        self.count('include_files')
+        self.add_time('include', seconds)
+
+    def to_dict(self):
+        return {
+            'Timers': dict((phase, round(seconds, 6)) for phase, seconds in self.timers.items()),
+            'Counters': dict(self.counters),
+            'SectionLines': dict(self.section_lines),
+            'Includes': list(self.includes),
+        }
 
-def parse_string(data, validate_only=False, verbose=False):
+    def format(self):
+        """ Human readable report, as printed by display_message_file.py --profile. """
+        output = ["Parse profile:"]
+        for phase, seconds in sorted(self.timers.items(), key=lambda item: -item[1]):
+            output.append("  {0:<16} {1:10.6f} s".format(phase, seconds))
+        for name, value in sorted(self.counters.items()):
+            output.append("  {0:<16} {1:>10}".format(name, value))
+        if self.section_lines:
+            output.append("Lines per section:")
+            for section, count in sorted(self.section_lines.items(), key=lambda item: -item[1]):
+                output.append("  {0:<24} {1:>10}".format(section, count))
+        if self.includes:
+            output.append("Includes:")
+            for include in self.includes:
+                output.append("  {0:10.6f} s  {1}".format(include['Seconds'], include['File']))
+        return "\n".join(output)
+
+def parse_file(filename, validate_only=False, verbose=False, stats=None, profile=None, index=None, threads=1, bodies=None, memory_budget=None):
+    if index is not None:
+        # An index (index_message_file.ArchiveIndex) records byte offsets, so
+        # it reads the decompressed bytes itself and hands decoded lines on
+        with open_compressed_reader(filename, threads) as file:
+            return parse_lines(index.iter_lines(file), validate_only, verbose, stats, profile, bodies, memory_budget)
+    if profile is None:
+        with open_compressed_file(filename, threads) as file:
+            if memory_budget is not None:
+                # Read as parsed, so the lines are not all held at once either
+                return parse_lines(file, validate_only, verbose, stats, bodies=bodies, memory_budget=memory_budget)
+            lines = file.readlines()
+        return parse_lines(lines, validate_only, verbose, stats, bodies=bodies)
+
+    start = time.perf_counter()
+    file = open_compressed_file(filename, threads)
+    profile.add_time('open', time.perf_counter() - start)
+    with file:
+        start = time.perf_counter()
+        data = file.read()
+        profile.add_time('decompress', time.perf_counter() - start)
+    if not isinstance(data, unicode_type):
+        data = data.decode('utf-8')
+    profile.count('files', 1)
+    profile.count('bytes_decompressed', len(data.encode('utf-8')))
+    if os.path.exists(filename):
+        profile.count('bytes_on_disk', os.path.getsize(filename))
+    start = time.perf_counter()
     lines = StringIO(data).readlines()
-    return parse_lines(lines, validate_only, verbose)
+    profile.add_time('split_lines', time.perf_counter() - start)
+    # Included files record their own 'parse' time, so only count this file's share
+    included_before = profile.timers.get('include', 0.0)
+    start = time.perf_counter()
+    try:
+        return parse_lines(lines, validate_only, verbose, stats, profile, bodies, memory_budget)
+    finally:
+        included = profile.timers.get('include', 0.0) - included_before
+        profile.add_time('parse', time.perf_counter() - start - included)
 
-def parse_lines(lines, validate_only=False, verbose=False):
+def parse_string(data, validate_only=False, verbose=False, stats=None, profile=None, bodies=None, memory_budget=None):
+    lines = StringIO(data).readlines()
+    return parse_lines(lines, validate_only, verbose, stats, profile, bodies, memory_budget)
+
+def parse_lines(lines, validate_only=False, verbose=False, stats=None, profile=None, bodies=None, memory_budget=None):
+    """ Parse archive lines into a list of services.
+
+    If stats is given (see stats_message_file.ArchiveStats) it is fed every
+    service, user, thread and post as soon as the parser closes it, so
+    aggregates are computed in the same pass as the parse.  If profile is
+    given (a ParseProfile) per-phase timings and counters are added to it.
+    If bodies is given (a bodies_message_file.BodyStore) message bodies are
+    interned in it, so posts with the same body share one string;
+    lazy_message_file.BodySource uses the same hook to defer bodies.
+    If memory_budget is given (in bytes), threads beyond that much memory
+    are spilled to a temporary file and each service's 'MessageThreads' is
+    a spill_message_file.SpilledThreads sequence that reloads them on
+    demand.
+    """
+    spill = None
+    if memory_budget is not None and not validate_only:
+        from spill_message_file import SpillStore
+        spill = SpillStore(memory_budget)
     services = []
+    for event, service, item in iter_parse_lines(lines, validate_only, verbose, stats, keep_threads=spill is None, profile=profile, bodies=bodies):
+        if event == 'thread' and spill is not None:
+            spill.add_thread(service, item)
+        elif event == 'service':
+            services.append(service)
+        elif event == 'error':
+            return False, service, item
+    if validate_only:
+        return True, "", ""
+    return services
+
+def iter_parse_file(filename, verbose=False, stats=None, keep_threads=False, profile=None, threads=1, bodies=None):
+    """ Stream the events of iter_parse_lines() while the file is still being read.
+
+    threads > 1 decompresses the blocks of a seekable (.lsz) archive ahead
+    of the parser on a thread pool.
+    """
+    with open_compressed_file(filename, threads) as file:
+        if profile is not None:
+            profile.count('files', 1)
+        for event in iter_parse_lines(file, verbose=verbose, stats=stats, keep_threads=keep_threads, profile=profile, bodies=bodies):
+            yield event
+
+def iter_parse_lines(lines, validate_only=False, verbose=False, stats=None, keep_threads=True, profile=None, bodies=None):
+    """ Parse archive lines, yielding (event, service, item) tuples as sections close.
+
+    A ('thread', service, thread) event is yielded at every
+    '--- End Message Thread ---' and a ('service', service, None) event at
+    every '--- End Archive Service ---' (included files produce the same
+    events).  With keep_threads=False finished threads are not kept in
+    service['MessageThreads'], so memory stays bounded by one thread.  In
+    validate_only mode a parse error is yielded as ('error', message, line)
+    instead of being raised.
+    """
+    if profile is None:
+        split_line = parse_line
+        join_body = "\n".join
+        check_integer = validate_non_negative_integer
+    else:
+        lines = profile.iter_lines(lines)
+        split_line = profile.timed('parse_line', parse_line)
+        join_body = profile.timed('join_body', "\n".join)
+        check_integer = profile.timed('validate', validate_non_negative_integer)
+    # A body store (bodies_message_file.BodyStore) or source of lazy bodies
+    # (lazy_message_file.BodySource) builds bodies instead of join_body
+    join_message = join_text = join_body
+    if bodies is not None:
+        join_message = bodies.join_message
+        join_text = getattr(bodies, 'join_text', join_body)
     current_service = None
     in_section = {
         'user_list': False,
@@ -241,40 +322,55 @@ def parse_lines(lines, validate_only=False, verbose=False):
     categorization_values = {'Categories': [], 'Forums': []}
     category_ids = {'Categories': set(), 'Forums': set()}
     post_id = 1
-
-    def parse_include_files(file_list):
-        included_services = []
+    # Line on which the message or bio body still being read started
+    body_line = None
+
+    def check_body_closed(line, line_number):
+        for section, name in (('message_body', "Message"), ('bio_body', "Bio")):
+            if in_section[section]:
+                raise ValueError("'{0}' on line {1} is inside the {2} Body opened on line {3}, which is missing its '--- End {2} Body ---'.".format(line, line_number, name, body_line))
+
+    def parse_include(include_file):
+        include_stats = stats.__class__() if stats is not None else None
+        start = time.perf_counter() if profile is not None else None
+        included = parse_file(include_file, verbose=verbose, stats=include_stats, profile=profile, bodies=bodies)
+        if profile is not None:
+            profile.add_include(include_file, time.perf_counter() - start)
+        if stats is not None:
+            stats.merge(include_stats)
+        return included
+
+    def iter_include_files(file_list):
         for include_file in file_list:
-            included_services.extend(parse_file(include_file, validate_only, verbose))
-        return included_services
+            include_stats = stats.__class__() if stats is not None else None
+            start = time.perf_counter() if profile is not None else None
+            for event in iter_parse_file(include_file, verbose, include_stats, keep_threads, profile, bodies=bodies):
+                yield event
+            if profile is not None:
+                profile.add_include(include_file, time.perf_counter() - start)
+            if stats is not None:
+                stats.merge(include_stats)
 
     def parse_include_users(file_list):
         users = {}
         for include_file in file_list:
-            included_users = parse_file(include_file, validate_only, verbose)
+            included_users = parse_include(include_file)
             for service in included_users:
                 users.update(service['Users'])
         return users
 
-    def parse_include_messages(file_list):
-        messages = []
-        for include_file in file_list:
-            included_messages = parse_file(include_file, validate_only, verbose)
-            for service in included_messages:
-                messages.extend(service['MessageThreads'])
-        return messages
-
     def parse_include_categories(file_list):
         categories = []
         for include_file in file_list:
-            included_categories = parse_file(include_file, validate_only, verbose)
+            included_categories = parse_include(include_file)
             for service in included_categories:
                 categories.extend(service['Categories'])
         return categories
 
+    raw_line = ""
     try:
-        for line_number, line in enumerate(lines, 1):
-            line = line.strip()
+        for line_number, raw_line in enumerate(lines, 1):
+            line = raw_line.strip()
             if line == "--- Include Service Start ---":
                 in_section['include_service'] = True
                 include_files = []
@@ -285,7 +381,8 @@ def parse_lines(lines, validate_only=False, verbose=False):
                 in_section['include_service'] = False
                 if verbose:
                     print("Line {0}: {1} (Ending include service section)".format(line_number, line))
-                services.extend(parse_include_files(include_files))
+                for event in iter_include_files(include_files):
+                    yield event
                 continue
             elif in_section['include_service']:
                 include_files.append(line)
@@ -321,7 +418,11 @@ def parse_lines(lines, validate_only=False, verbose=False):
                 if verbose:
                     print("Line {0}: {1} (Ending include messages section)".format(line_number, line))
                 if current_service:
-                    current_service['MessageThreads'].extend(parse_include_messages(include_files))
+                    for event, service, thread in iter_include_files(include_files):
+                        if event == 'thread':
+                            if keep_threads:
+                                current_service['MessageThreads'].append(thread)
+                            yield 'thread', current_service, thread
                 continue
             elif in_section['include_messages']:
                 include_files.append(line)
@@ -357,7 +458,9 @@ def parse_lines(lines, validate_only=False, verbose=False):
                     print("Line {0}: {1} (Starting new archive service)".format(line_number, line))
                 continue
             elif line == "--- End Archive Service ---":
-                services.append(current_service)
+                if stats is not None:
+                    stats.add_service(current_service)
+                yield 'service', current_service, None
                 current_service = None
                 if verbose:
                     print("Line {0}: {1} (Ending archive service)".format(line_number, line))
@@ -377,6 +480,8 @@ def parse_lines(lines, validate_only=False, verbose=False):
                     print("Line {0}: {1} (Comment)".format(line_number, line))
                 continue
             elif line == "--- Start Category List ---":
+                if current_service is None:
+                    raise ValueError("'{0}' on line {1} is outside of an archive service.".format(line, line_number))
                 in_section['category_list'] = True
                 current_category = {}
                 if verbose:
@@ -399,6 +504,8 @@ def parse_lines(lines, validate_only=False, verbose=False):
                     print("Line {0}: {1} (Ending category list)".format(line_number, line))
                 continue
             elif line == "--- Start Categorization List ---":
+                if current_service is None:
+                    raise ValueError("'{0}' on line {1} is outside of an archive service.".format(line, line_number))
                 in_section['categorization_list'] = True
                 current_service['Categorization'] = {}
                 if verbose:
@@ -420,7 +527,7 @@ def parse_lines(lines, validate_only=False, verbose=False):
             elif line == "--- End Info Body ---":
                 in_section['info_body'] = False
                 if current_service and current_info is not None:
-                    current_service['Info'] = "\n".join(current_info)
+                    current_service['Info'] = join_text(current_info)
                     current_info = None
                     if verbose:
                         print("Line {0}: {1} (Ending info body)".format(line_number, line))
@@ -459,7 +566,7 @@ def parse_lines(lines, validate_only=False, verbose=False):
                     print("Line {0}: {1} (Ending poll body)".format(line_number, line))
                 continue
             elif in_section['poll_body']:
-                key, value = parse_line(line)
+                key, value = split_line(line)
                 if key and current_poll is not None:
                     if key in ['Answers', 'Results', 'Percentage']:
                         current_poll[key] = [item.strip() for item in value.split(',')]
@@ -467,9 +574,9 @@ def parse_lines(lines, validate_only=False, verbose=False):
                         current_poll[key] = value
                 continue
             elif current_service is not None:
-                key, value = parse_line(line)
+                key, value = split_line(line)
                 if key == "Entry":
-                    current_service['Entry'] = validate_non_negative_integer(value, "Entry", line_number)
+                    current_service['Entry'] = check_integer(value, "Entry", line_number)
                 elif key == "Service":
                     current_service['Service'] = value
                 elif key == "Categories":
@@ -484,9 +591,9 @@ def parse_lines(lines, validate_only=False, verbose=False):
                     if key == "Kind":
                         current_category['Kind'] = value
                     elif key == "ID":
-                        current_category['ID'] = validate_non_negative_integer(value, "ID", line_number)
+                        current_category['ID'] = check_integer(value, "ID", line_number)
                     elif key == "InSub":
-                        current_category['InSub'] = validate_non_negative_integer(value, "InSub", line_number)
+                        current_category['InSub'] = check_integer(value, "InSub", line_number)
                     elif key == "Headline":
                         current_category['Headline'] = value
                     elif key == "Description":
@@ -507,7 +614,10 @@ def parse_lines(lines, validate_only=False, verbose=False):
                         print("Line {0}: {1} (Starting user info)".format(line_number, line))
                     continue
                 elif line == "--- End User Info ---":
+                    check_body_closed(line, line_number)
                     in_section['user_info'] = False
+                    if stats is not None and user_id is not None:
+                        stats.add_user(current_service, user_id, current_service['Users'][user_id])
                     user_id = None
                     if verbose:
                         print("Line {0}: {1} (Ending user info)".format(line_number, line))
@@ -523,6 +633,9 @@ def parse_lines(lines, validate_only=False, verbose=False):
                         print("Line {0}: {1} (Ending message list)".format(line_number, line))
                     continue
                 elif line == "--- Start Message Thread ---":
+                    check_body_closed(line, line_number)
+                    if not in_section['message_list']:
+                        raise ValueError("'{0}' on line {1} is outside of a message list.".format(line, line_number))
                     in_section['message_thread'] = True
                     current_thread = {'Title': '', 'Messages': []}
                     post_id = 1
@@ -530,22 +643,33 @@ def parse_lines(lines, validate_only=False, verbose=False):
                         print("Line {0}: {1} (Starting message thread)".format(line_number, line))
                     continue
                 elif line == "--- End Message Thread ---":
+                    check_body_closed(line, line_number)
                     in_section['message_thread'] = False
-                    current_service['MessageThreads'].append(current_thread)
+                    if keep_threads:
+                        current_service['MessageThreads'].append(current_thread)
+                    if stats is not None:
+                        stats.add_thread(current_service, current_thread)
+                    yield 'thread', current_service, current_thread
                     current_thread = None
                     if verbose:
                         print("Line {0}: {1} (Ending message thread)".format(line_number, line))
                     continue
                 elif line == "--- Start Message Post ---":
+                    check_body_closed(line, line_number)
+                    if current_thread is None:
+                        raise ValueError("'{0}' on line {1} is outside of a message thread.".format(line, line_number))
                     in_section['message_post'] = True
                     current_message = {}
                     if verbose:
                         print("Line {0}: {1} (Starting message post)".format(line_number, line))
                     continue
                 elif line == "--- End Message Post ---":
+                    check_body_closed(line, line_number)
                     in_section['message_post'] = False
                     if current_message:
                         current_thread['Messages'].append(current_message)
+                        if stats is not None:
+                            stats.add_post(current_service, current_thread, current_message)
                     current_message = None
                     if verbose:
                         print("Line {0}: {1} (Ending message post)".format(line_number, line))
@@ -565,7 +689,7 @@ def parse_lines(lines, validate_only=False, verbose=False):
                         print("Line {0}: {1} (Starting info body)".format(line_number, line))
                 elif in_section['user_list'] and in_section['user_info']:
                     if key == "User":
-                        user_id = validate_non_negative_integer(value, "User", line_number)
+                        user_id = check_integer(value, "User", line_number)
                         current_service['Users'][user_id] = {'Bio': ""}
                         if verbose:
                             print("Line {0}: User ID set to {1}".format(line_number, user_id))
@@ -598,11 +722,12 @@ def parse_lines(lines, validate_only=False, verbose=False):
                         if user_id is not None:
                             current_bio = []
                             in_section['bio_body'] = True
+                            body_line = line_number
                             if verbose:
                                 print("Line {0}: Starting bio body".format(line_number))
                     elif line == "--- End Bio Body ---":
                         if user_id is not None and current_bio is not None:
-                            current_service['Users'][user_id]['Bio'] = "\n".join(current_bio)
+                            current_service['Users'][user_id]['Bio'] = join_text(current_bio)
                             current_bio = None
                             in_section['bio_body'] = False
                             if verbose:
@@ -613,7 +738,7 @@ def parse_lines(lines, validate_only=False, verbose=False):
                             print("Line {0}: Adding to bio body: {1}".format(line_number, line))
                 elif in_section['message_list'] and in_section['message_thread']:
                     if key == "Thread":
-                        current_thread['Thread'] = validate_non_negative_integer(value, "Thread", line_number)
+                        current_thread['Thread'] = check_integer(value, "Thread", line_number)
                         if verbose:
                             print("Line {0}: Thread ID set to {1}".format(line_number, value))
                     elif key == "Category":
@@ -636,6 +761,8 @@ def parse_lines(lines, validate_only=False, verbose=False):
                         current_thread['State'] = value
                         if verbose:
                             print("Line {0}: State set to {1}".format(line_number, value))
+                    elif key in ("Author", "Time", "Date", "SubType", "Post", "Nested") and current_message is None:
+                        raise ValueError("Key '{0}' on line {1} is outside of a message post.".format(key, line_number))
                     elif key == "Author":
                         current_message['Author'] = value
                         if verbose:
@@ -653,7 +780,7 @@ def parse_lines(lines, validate_only=False, verbose=False):
                         if verbose:
                             print("Line {0}: SubType set to {1}".format(line_number, value))
                     elif key == "Post":
-                        post_value = validate_non_negative_integer(value, "Post", line_number)
+                        post_value = check_integer(value, "Post", line_number)
                         current_message['Post'] = post_value
                         if 'post_ids' not in current_thread:
                             current_thread['post_ids'] = set()
@@ -661,7 +788,7 @@ def parse_lines(lines, validate_only=False, verbose=False):
                         if verbose:
                             print("Line {0}: Post ID set to {1}".format(line_number, post_value))
                     elif key == "Nested":
-                        nested_value = validate_non_negative_integer(value, "Nested", line_number)
+                        nested_value = check_integer(value, "Nested", line_number)
                         if nested_value != 0 and nested_value not in current_thread.get('post_ids', set()):
                             raise ValueError(
                                 "Nested value '{0}' on line {1} does not match any existing Post values in the current thread. Existing Post IDs: {2}".format(
@@ -674,11 +801,12 @@ def parse_lines(lines, validate_only=False, verbose=False):
                         if current_message is not None:
                             current_message['Message'] = []
                             in_section['message_body'] = True
+                            body_line = line_number
                             if verbose:
                                 print("Line {0}: Starting message body".format(line_number))
                     elif line == "--- End Message Body ---":
                         if current_message is not None and 'Message' in current_message:
-                            current_message['Message'] = "\n".join(current_message['Message'])
+                            current_message['Message'] = join_message(current_message['Message'])
                             in_section['message_body'] = False
                             if verbose:
                                 print("Line {0}: Ending message body".format(line_number))
@@ -687,419 +815,86 @@ def parse_lines(lines, validate_only=False, verbose=False):
                         if verbose:
                             print("Line {0}: Adding to message body: {1}".format(line_number, line))
 
-        if validate_only:
-            return True, "", ""
-
-        return services
-
     except Exception as e:
         if validate_only:
-            return False, "Error: {0}".format(str(e)), lines[line_number - 1]
+            yield 'error', "Error: {0}".format(str(e)), raw_line
         else:
             raise
 
-def display_services(services):
-    for service in services:
-        print("Service Entry: {0}".format(service['Entry']))
-        print("Service: {0}".format(service['Service']))
-        
-        if 'Info' in service and service['Info']:
-            print("Info: {0}".format(service['Info'].strip().replace("\n", "\n      ")))
-        
-        print("Interactions: {0}".format(', '.join(service['Interactions'])))
-        print("Status: {0}".format(', '.join(service.get('Status', []))))
-        
-        if 'Categorization' in service and service['Categorization']:
-            for category_type, category_levels in service['Categorization'].items():
-                print("{0}: {0}".format(category_type, ', '.join(category_levels)))
-        
-        print("Category List:")
-        for category in service['Categories']:
-            print("  Type: {0}, Level: {1}".format(category.get('Type', 'N/A'), category.get('Level', 'N/A')))
-            print("  ID: {0}".format(category['ID']))
-            print("  InSub: {0}".format(category['InSub']))
-            print("  Headline: {0}".format(category['Headline']))
-            print("  Description: {0}".format(category['Description'].strip().replace("\n", "\n    ")))
-            print("")
-        
-        print("User List:")
-        for user_id, user_info in service['Users'].items():
-            print("  User ID: {0}".format(user_id))
-            print("    Name: {0}".format(user_info['Name']))
-            print("    Handle: {0}".format(user_info['Handle']))
-            print("    Location: {0}".format(user_info.get('Location', 'N/A')))
-            print("    Joined: {0}".format(user_info.get('Joined', 'N/A')))
-            print("    Birthday: {0}".format(user_info.get('Birthday', 'N/A')))
-            print("    Bio:")
-            print("      {0}".format(user_info.get('Bio', '').strip().replace("\n", "\n      ")))
-            print("")
-        
-        print("Message Threads:")
-        for idx, thread in enumerate(service['MessageThreads']):
-            print("  --- Message Thread {0} ---".format(idx + 1))
-            if thread['Title']:
-                print("    Title: {0}".format(thread['Title']))
-            if 'Category' in thread:
-                print("    Category: {0}".format(', '.join(thread['Category'])))
-            if 'Forum' in thread:
-                print("    Forum: {0}".format(', '.join(thread['Forum'])))
-            if 'Type' in thread:
-                print("    Type: {0}".format(thread['Type']))
-            if 'State' in thread:
-                print("    State: {0}".format(thread['State']))
-            
-            for message in thread['Messages']:
-                print("    {0} ({1} on {2}): [{3}] Post ID: {4} Nested: {5}".format(
-                    message['Author'], message['Time'], message['Date'],
-                    message.get('SubType', 'Post' if message['Post'] == 1 or message['Nested'] == 0 else 'Reply'),
-                    message['Post'], message['Nested']))
-                
-                # Indent each line of the message body but keep it at the same level
-                print("      {0}".format(message['Message'].strip().replace("\n", "\n      ")))
-                
-                if 'Polls' in message and message['Polls']:
-                    print("      Polls:")
-                    for poll in message['Polls']:
-                        print("        Poll {0}:".format(poll.get('Num', 'N/A')))
-                        print("          Question: {0}".format(poll.get('Question', 'N/A')))
-                        print("          Answers: {0}".format(", ".join(poll.get('Answers', []))))
-                        print("          Results: {0}".format(", ".join(str(r) for r in poll.get('Results', []))))
-                        print("          Percentage: {0}".format(", ".join("{:.2f}".format(float(p)) for p in poll.get('Percentage', []))))
-                        print("          Votes: {0}".format(poll.get('Votes', 'N/A')))
-            print("")
-
-def save_services_to_file(services, filename, line_ending="lf"):
-    """Save the services data structure to a file with optional compression based on file extension."""
-    output = []
-
-    for service in services:
-        output.append("--- Start Archive Service ---")
-
-        output.append("Entry: {0}".format(service.get('Entry', 'N/A')))
-        output.append("Service: {0}".format(service.get('Service', 'N/A')))
-
-        if 'Info' in service:
-            output.append("Info: {0}".format(service.get('Info', '<No information provided>')))
-
-        if 'Interactions' in service:
-            output.append("Interactions: {0}".format(", ".join(service['Interactions'])))
-
-        if 'Status' in service:
-            output.append("Status: {0}".format(", ".join(service['Status'])))
-
-        if 'Categories' in service and service['Categories']:
-            output.append("Categories:")
-            for category in service['Categories']:
-                output.append("  Type: {0}, Level: {1}".format(category.get('Type', 'N/A'), category.get('Level', 'N/A')))
-                output.append("  ID: {0}".format(category.get('ID', 'N/A')))
-                output.append("  InSub: {0}".format(category.get('InSub', 'N/A')))
-                output.append("  Headline: {0}".format(category.get('Headline', 'N/A')))
-                output.append("  Description: {0}".format(category.get('Description', '')))
-
-        if 'MessageThreads' in service and service['MessageThreads']:
-            output.append("Message Threads:")
-            for thread in service['MessageThreads']:
-                output.append("  --- Start Message Thread ---")
-                output.append("  Thread: {0}".format(thread.get('Thread', 'N/A')))
-                output.append("  Title: {0}".format(thread.get('Title', 'N/A')))
-                output.append("  Category: {0}".format(", ".join(thread.get('Category', []))))
-                output.append("  Forum: {0}".format(", ".join(thread.get('Forum', []))))
-                output.append("  Type: {0}".format(thread.get('Type', 'N/A')))
-                output.append("  State: {0}".format(thread.get('State', 'N/A')))
-
-                if 'Messages' in thread and thread['Messages']:
-                    for message in thread['Messages']:
-                        output.append("  --- Start Message Post ---")
-                        output.append("  Author: {0}".format(message.get('Author', 'N/A')))
-                        output.append("  Time: {0}".format(message.get('Time', 'N/A')))
-                        output.append("  Date: {0}".format(message.get('Date', 'N/A')))
-                        output.append("  SubType: {0}".format(message.get('SubType', 'N/A')))
-                        output.append("  Post: {0}".format(message.get('Post', 'N/A')))
-                        output.append("  Nested: {0}".format(message.get('Nested', 'N/A')))
+class ServicesStreamWriter:
+    """ Base class for writers that emit services one message thread at a time.
 
-                        if 'Message' in message:
-                            output.append("  Message:")
-                            output.append("    {0}".format(message['Message']))
+    stream_services() calls start_service() before the first thread of a
+    service (or at its end if it has none), write_thread() for every thread,
+    skip_thread() for threads left out by offset, end_service() once the
+    service is complete and close() after the last service.
+    """
 
-                        if 'Polls' in message and message['Polls']:
-                            output.append("  Polls:")
-                            output.append("  --- Start Poll List ---")
-                            for poll in message['Polls']:
-                                output.append("  --- Start Poll Body ---")
-                                output.append("  Num: {0}".format(poll.get('Num', 'N/A')))
-                                output.append("  Question: {0}".format(poll.get('Question', 'N/A')))
-                                output.append("  Answers: {0}".format(", ".join(poll.get('Answers', []))))
-                                output.append("  Results: {0}".format(", ".join(str(r) for r in poll.get('Results', []))))
-                                output.append("  Percentage: {0}".format(", ".join("{:.2f}".format(float(p)) for p in poll.get('Percentage', []))))
-                                output.append("  Votes: {0}".format(poll.get('Votes', 'N/A')))
-                                output.append("  --- End Poll Body ---")
-                            output.append("  --- End Poll List ---")
-                        output.append("  --- End Message Post ---")
-                output.append("  --- End Message Thread ---")
+    def __init__(self, file):
+        self.file = file
 
-        if 'Users' in service and service['Users']:
-            output.append("User List:")
-            for user_id, user in service['Users'].items():
-                output.append("  User ID: {0}".format(user_id))
-                output.append("    Name: {0}".format(user.get('Name', 'N/A')))
-                output.append("    Handle: {0}".format(user.get('Handle', 'N/A')))
-                output.append("    Location: {0}".format(user.get('Location', 'N/A')))
-                output.append("    Joined: {0}".format(user.get('Joined', 'N/A')))
-                output.append("    Birthday: {0}".format(user.get('Birthday', 'N/A')))
-                output.append("    Bio:")
-                output.append("      {0}".format(user.get('Bio', '').replace("\n", "\n      ")))
+    def start_service(self, service):
+        pass
 
-        output.append("--- End Archive Service ---")
-        output.append("")
+    def skip_thread(self, service, thread):
+        pass
 
-    # Join all output lines with the appropriate line ending
-    data = "\n".join(output)
+    def write_thread(self, service, thread):
+        pass
 
-    # Save the data to the file with the appropriate compression
-    save_compressed_file(data, filename)
+    def end_service(self, service):
+        pass
 
+    def close(self):
+        self.file.flush()
 
-def to_json(services):
-    """ Convert the services data structure to JSON """
-    return json.dumps(services, indent=2)
-
-def from_json(json_str):
-    """ Convert a JSON string back to the services data structure """
-    return json.loads(json_str)
-
-def load_from_json_file(json_filename):
-    """ Load the services data structure from a JSON file """
-    with open_compressed_file(json_filename) as file:
-        return json.load(file)
-
-def to_xml(services):
-    """ Convert the services data structure to an XML string """
-    root = ET.Element("Services")
-    
-    for service in services:
-        service_elem = ET.SubElement(root, "Service")
-        for key, value in service.items():
-            if isinstance(value, list):
-                list_elem = ET.SubElement(service_elem, key)
-                for item in value:
-                    if isinstance(item, dict):
-                        item_elem = ET.SubElement(list_elem, key[:-1])  # singular form
-                        for subkey, subvalue in item.items():
-                            sub_elem = ET.SubElement(item_elem, subkey)
-                            sub_elem.text = unicode_type(subvalue)
-                    else:
-                        item_elem = ET.SubElement(list_elem, key[:-1])
-                        item_elem.text = unicode_type(item)
-            elif isinstance(value, dict):
-                dict_elem = ET.SubElement(service_elem, key)
-                for subkey, subvalue in value.items():
-                    sub_elem = ET.SubElement(dict_elem, subkey)
-                    if isinstance(subvalue, list):
-                        for sub_item in subvalue:
-                            sub_item_elem = ET.SubElement(sub_elem, subkey[:-1])
-                            sub_item_elem.text = unicode_type(sub_item)
-                    else:
-                        sub_elem.text = unicode_type(subvalue)
-            else:
-                elem = ET.SubElement(service_elem, key)
-                elem.text = unicode_type(value)
-    
-    # Convert to string
-    xml_str = ET.tostring(root, encoding='utf-8')
-    if PY2:
-        xml_str = xml_str.decode('utf-8')  # Convert bytes to str in Python 2
-    # Make the XML string pretty
-    xml_str = minidom.parseString(xml_str).toprettyxml(indent="  ")
-    return xml_str
-
-def from_xml(xml_str):
-    """ Convert an XML string back to the services data structure """
-    services = []
-    root = ET.fromstring(xml_str)
-    
-    for service_elem in root.findall('Service'):
-        service = {}
-        for child in service_elem:
-            if list(child):  # If there are nested elements
-                if child.tag in service:
-                    service[child.tag].append(parse_xml_element(child))
-                else:
-                    service[child.tag] = [parse_xml_element(child)]
-            else:
-                service[child.tag] = child.text
-        services.append(service)
-    
-    return services
-
-def parse_xml_element(element):
-    """ Helper function to parse XML elements into a dictionary """
-    result = {}
-    for child in element:
-        if list(child):
-            result[child.tag] = parse_xml_element(child)
-        else:
-            result[child.tag] = child.text
-    return result
-
-def open_compressed_file(filename):
-    """ Open a file, trying various compression methods if available. """
-    if filename.endswith('.gz'):
-        import gzip
-        return gzip.open(filename, 'rt', encoding='utf-8') if not PY2 else gzip.open(filename, 'r')
-    elif filename.endswith('.bz2'):
-        import bz2
-        return bz2.open(filename, 'rt', encoding='utf-8') if not PY2 else bz2.open(filename, 'r')
-    elif filename.endswith('.xz') or filename.endswith('.lzma'):
-        try:
-            import lzma
-        except ImportError:
-            from backports import lzma
-        return lzma.open(filename, 'rt', encoding='utf-8') if not PY2 else lzma.open(filename, 'r')
-    else:
-        return open(filename, 'r', encoding='utf-8') if not PY2 else open(filename, 'r')
-
-def save_compressed_file(data, filename):
-    """ Save data to a file, using various compression methods if specified. """
-    if filename.endswith('.gz'):
-        import gzip
-        with gzip.open(filename, 'wt', encoding='utf-8') if not PY2 else gzip.open(filename, 'w') as file:
-            if PY2:
-                file.write(data.encode('utf-8'))
-            else:
-                file.write(data)
-    elif filename.endswith('.bz2'):
-        import bz2
-        with bz2.open(filename, 'wt', encoding='utf-8') if not PY2 else bz2.open(filename, 'w') as file:
-            if PY2:
-                file.write(data.encode('utf-8'))
-            else:
-                file.write(data)
-    elif filename.endswith('.xz') or filename.endswith('.lzma'):
-        try:
-            import lzma
-        except ImportError:
-            from backports import lzma
-        with lzma.open(filename, 'wt', encoding='utf-8') if not PY2 else lzma.open(filename, 'w') as file:
-            if PY2:
-                file.write(data.encode('utf-8'))
-            else:
-                file.write(data)
-    else:
-        with open(filename, 'w', encoding='utf-8') if not PY2 else open(filename, 'w') as file:
-            if PY2:
-                file.write(data.encode('utf-8'))
-            else:
-                file.write(data)
-
-def load_from_xml_file(xml_filename):
-    """ Load the services data structure from an XML file """
-    with open_compressed_file(xml_filename) as file:
-        xml_str = file.read()
-    return from_xml(xml_str)
-
-def save_to_xml_file(services, xml_filename):
-    """ Save the services data structure to an XML file """
-    xml_str = to_xml(services)
-    save_compressed_file(xml_str, xml_filename)
-
-def save_to_json_file(services, json_filename):
-    """ Save the services data structure to a JSON file """
-    json_data = json.dumps(services, indent=2)
-    save_compressed_file(json_data, json_filename)
+def stream_services(events, writer, offset=0, limit=None):
+    """ Feed (event, service, item) tuples from iter_parse_file()/iter_parse_lines() to a writer.
 
-def services_to_string(services):
-    """Convert the services structure into a string format suitable for saving to a file."""
-    output = []
-    
+    offset and limit page over threads across the whole archive.  Once limit
+    threads are written the event source is closed, so the rest of the input
+    is never read.  Returns the number of threads written.
+    """
+    current_service = None
+    skipped = 0
+    written = 0
+    try:
+        for event, service, item in events:
+            if event == 'thread':
+                if service is not current_service:
+                    if current_service is not None:
+                        writer.end_service(current_service)
+                    writer.start_service(service)
+                    current_service = service
+                if skipped < offset:
+                    skipped += 1
+                    writer.skip_thread(service, item)
+                    continue
+                writer.write_thread(service, item)
+                written += 1
+                if limit is not None and written >= limit:
+                    break
+            elif event == 'service':
+                if service is not current_service:
+                    writer.start_service(service)
+                writer.end_service(service)
+                current_service = None
+            elif event == 'error':
+                raise ValueError(service)
+        if current_service is not None:
+            writer.end_service(current_service)
+    finally:
+        if hasattr(events, 'close'):
+            events.close()
+    writer.close()
+    return written
+
+def iter_service_events(services):
+    """ The iter_parse_lines() events of an already parsed services structure, for stream_services(). """
     for service in services:
-        output.append("--- Start Archive Service ---")
-        
-        output.append("Entry: {0}".format(service.get('Entry', 'N/A')))
-        output.append("Service: {0}".format(service.get('Service', 'N/A')))
-        
-        if 'Info' in service:
-            output.append("Info: {0}".format(service.get('Info', '<No information provided>')))
-        
-        if 'Interactions' in service:
-            output.append("Interactions: {0}".format(", ".join(service['Interactions'])))
-        
-        if 'Status' in service:
-            output.append("Status: {0}".format(", ".join(service['Status'])))
-        
-        if 'Categories' in service and service['Categories']:
-            output.append("Categories:")
-            for category in service['Categories']:
-                output.append("  Type: {0}, Level: {1}".format(category.get('Type', 'N/A'), category.get('Level', 'N/A')))
-                output.append("  ID: {0}".format(category.get('ID', 'N/A')))
-                output.append("  InSub: {0}".format(category.get('InSub', 'N/A')))
-                output.append("  Headline: {0}".format(category.get('Headline', 'N/A')))
-                output.append("  Description: {0}".format(category.get('Description', '')))
-        
-        if 'MessageThreads' in service and service['MessageThreads']:
-            output.append("Message Threads:")
-            for thread in service['MessageThreads']:
-                output.append("  --- Start Message Thread ---")
-                output.append("  Thread: {0}".format(thread.get('Thread', 'N/A')))
-                output.append("  Title: {0}".format(thread.get('Title', 'N/A')))
-                output.append("  Category: {0}".format(", ".join(thread.get('Category', []))))
-                output.append("  Forum: {0}".format(", ".join(thread.get('Forum', []))))
-                output.append("  Type: {0}".format(thread.get('Type', 'N/A')))
-                output.append("  State: {0}".format(thread.get('State', 'N/A')))
-                
-                if 'Messages' in thread and thread['Messages']:
-                    for message in thread['Messages']:
-                        output.append("  --- Start Message Post ---")
-                        output.append("  Author: {0}".format(message.get('Author', 'N/A')))
-                        output.append("  Time: {0}".format(message.get('Time', 'N/A')))
-                        output.append("  Date: {0}".format(message.get('Date', 'N/A')))
-                        output.append("  SubType: {0}".format(message.get('SubType', 'N/A')))
-                        output.append("  Post: {0}".format(message.get('Post', 'N/A')))
-                        output.append("  Nested: {0}".format(message.get('Nested', 'N/A')))
-                        
-                        if 'Message' in message:
-                            output.append("  Message:")
-                            output.append("    {0}".format(message['Message']))
-                        
-                        if 'Polls' in message and message['Polls']:
-                            output.append("  Polls:")
-                            output.append("  --- Start Poll List ---")
-                            for poll in message['Polls']:
-                                output.append("  --- Start Poll Body ---")
-                                output.append("  Num: {0}".format(poll.get('Num', 'N/A')))
-                                output.append("  Question: {0}".format(poll.get('Question', 'N/A')))
-                                output.append("  Answers: {0}".format(", ".join(poll.get('Answers', []))))
-                                output.append("  Results: {0}".format(", ".join(str(r) for r in poll.get('Results', []))))
-                                output.append("  Percentage: {0}".format(", ".join("{:.2f}".format(float(p)) for p in poll.get('Percentage', []))))
-                                output.append("  Votes: {0}".format(poll.get('Votes', 'N/A')))
-                                output.append("  --- End Poll Body ---")
-                            output.append("  --- End Poll List ---")
-                        output.append("  --- End Message Post ---")
-                output.append("  --- End Message Thread ---")
-        
-        if 'Users' in service and service['Users']:
-            output.append("User List:")
-            for user_id, user in service['Users'].items():
-                output.append("  User ID: {0}".format(user_id))
-                output.append("    Name: {0}".format(user.get('Name', 'N/A')))
-                output.append("    Handle: {0}".format(user.get('Handle', 'N/A')))
-                output.append("    Location: {0}".format(user.get('Location', 'N/A')))
-                output.append("    Joined: {0}".format(user.get('Joined', 'N/A')))
-                output.append("    Birthday: {0}".format(user.get('Birthday', 'N/A')))
-                output.append("    Bio:")
-                output.append("      {0}".format(user.get('Bio', '').replace("\n", "\n      ")))
-        
-        output.append("--- End Archive Service ---")
-        output.append("")
-
-    return "\n".join(output)
-    
-    line_sep = {"lf": "\n", "cr": "\r", "crlf": "\r\n"}
-    return line_sep.get(line_ending, "\n").join(lines)
-
-def save_services_to_file(services, filename, line_ending="lf"):
-    """ Save the services data structure to a file in the original text format """
-    data = services_to_string(services, line_ending)
-    save_compressed_file(data, filename)
+        for thread in service.get('MessageThreads', []):
+            yield 'thread', service, thread
+        yield 'service', service, None
 
 def init_empty_service(entry, service_name, info=''):
     """ Initialize an empty service structure """
@@ -1114,8 +909,8 @@ def init_empty_service(entry, service_name, info=''):
         'Info': info,
     }
 
-def add_user(service, user_id, name, handle, location='', joined='', birthday='', bio=''):
-    """ Add a user to the service """
+def add_user(service, user_id, name, handle, location='', joined='', birthday='', bio='', prefix_index=None):
+    """ Add a user to the service (and to prefix_index, a prefix_message_file.PrefixIndex, if given) """
     service['Users'][user_id] = {
         'Name': name,
         'Handle': handle,
@@ -1124,8 +919,10 @@ def add_user(service, user_id, name, handle, location='', joined='', birthday=''
         'Birthday': birthday,
         'Bio': bio
     }
+    if prefix_index is not None:
+        prefix_index.add_user(service, user_id, service['Users'][user_id])
 
-def add_category(service, kind, category_type, category_level, category_id, insub, headline, description):
+def add_category(service, kind, category_type, category_level, category_id, insub, headline, description, prefix_index=None):
     category = {
         'Kind': "{0}, {1}".format(kind, category_level),
         'Type': category_type,
@@ -1143,9 +940,11 @@ def add_category(service, kind, category_type, category_level, category_id, insu
     if insub != 0:
         if not any(cat['ID'] == insub for cat in service['Categories']):
             raise ValueError("InSub value '{0}' does not match any existing ID in service.".format(insub))
+    if prefix_index is not None:
+        prefix_index.add_category(service, category)
 
-def add_message_thread(service, thread_id, title='', category='', forum='', thread_type='', state=''):
-    """ Add a message thread to the service """
+def add_message_thread(service, thread_id, title='', category='', forum='', thread_type='', state='', prefix_index=None):
+    """ Add a message thread to the service (and to prefix_index, if given) """
     thread = {
         'Thread': thread_id,
         'Title': title,
@@ -1156,74 +955,88 @@ def add_message_thread(service, thread_id, title='', category='', forum='', thre
         'Messages': []
     }
     service['MessageThreads'].append(thread)
+    if prefix_index is not None:
+        prefix_index.add_thread(service, thread)
+
+def _find_thread(service, thread_id):
+    """ (index, thread) of thread_id in the service's MessageThreads """
+    for index, thread in enumerate(service['MessageThreads']):
+        if thread['Thread'] == thread_id:
+            return index, thread
+    raise ValueError("Thread ID {0} not found in service.".format(thread_id))
+
+def _store_thread(service, index, thread):
+    # A spilled thread (spill_message_file) is loaded as a copy, so the
+    # edited thread is stored back
+    service['MessageThreads'][index] = thread
 
 def add_message_post(service, thread_id, author, time, date, subtype, post_id, nested, message):
-    thread = next((t for t in service['MessageThreads'] if t['Thread'] == thread_id), None)
-    if thread is not None:
-        new_post = {
-            'Author': author,
-            'Time': time,
-            'Date': date,
-            'SubType': subtype,
-            'Post': post_id,
-            'Nested': nested,
-            'Message': message
-        }
-        thread['Messages'].append(new_post)
-    else:
-        raise ValueError("Thread ID {0} not found in service.".format(thread_id))
+    index, thread = _find_thread(service, thread_id)
+    new_post = {
+        'Author': author,
+        'Time': time,
+        'Date': date,
+        'SubType': subtype,
+        'Post': post_id,
+        'Nested': nested,
+        'Message': message
+    }
+    thread['Messages'].append(new_post)
+    _store_thread(service, index, thread)
 
 def add_poll(service, thread_id, post_id, poll_num, question, answers, results, percentages, votes):
-    thread = next((t for t in service['MessageThreads'] if t['Thread'] == thread_id), None)
-    if thread is not None:
-        message = next((m for m in thread['Messages'] if m['Post'] == post_id), None)
-        if message is not None:
-            if 'Polls' not in message:
-                message['Polls'] = []
-            new_poll = {
-                'Num': poll_num,
-                'Question': question,
-                'Answers': answers,
-                'Results': results,
-                'Percentage': percentages,
-                'Votes': votes
-            }
-            message['Polls'].append(new_poll)
-        else:
-            raise ValueError("Post ID {0} not found in thread {1}.".format(post_id, thread_id))
+    index, thread = _find_thread(service, thread_id)
+    message = next((m for m in thread['Messages'] if m['Post'] == post_id), None)
+    if message is not None:
+        if 'Polls' not in message:
+            message['Polls'] = []
+        new_poll = {
+            'Num': poll_num,
+            'Question': question,
+            'Answers': answers,
+            'Results': results,
+            'Percentage': percentages,
+            'Votes': votes
+        }
+        message['Polls'].append(new_poll)
+        _store_thread(service, index, thread)
     else:
-        raise ValueError("Thread ID {0} not found in service.".format(thread_id))
+        raise ValueError("Post ID {0} not found in thread {1}.".format(post_id, thread_id))
 
-def remove_user(service, user_id):
+def remove_user(service, user_id, prefix_index=None):
     if user_id in service['Users']:
         del service['Users'][user_id]
+        if prefix_index is not None:
+            prefix_index.remove_user(service, user_id)
     else:
         raise ValueError("User ID {0} not found in service.".format(user_id))
 
-def remove_category(service, category_id):
+def remove_category(service, category_id, prefix_index=None):
     category = next((c for c in service['Categories'] if c['ID'] == category_id), None)
     if category:
         service['Categories'].remove(category)
+        if prefix_index is not None:
+            prefix_index.remove_category(service, category)
     else:
         raise ValueError("Category ID {0} not found in service.".format(category_id))
 
-def remove_message_thread(service, thread_id):
+def remove_message_thread(service, thread_id, prefix_index=None):
     thread = next((t for t in service['MessageThreads'] if t['Thread'] == thread_id), None)
     if thread:
         service['MessageThreads'].remove(thread)
+        if prefix_index is not None:
+            prefix_index.remove_thread(service, thread)
     else:
         raise ValueError("Thread ID {0} not found in service.".format(thread_id))
 
 def remove_message_post(service, thread_id, post_id):
-    thread = next((t for t in service['MessageThreads'] if t['Thread'] == thread_id), None)
-    if thread is not None:
-        message = next((m for m in thread['Messages'] if m['Post'] == post_id), None)
-        if message is not None:
-            thread['Messages'].remove(message)
-        else:
-            raise ValueError("Post ID {0} not found in thread {1}.".format(post_id, thread_id))
+    index, thread = _find_thread(service, thread_id)
+    message = next((m for m in thread['Messages'] if m['Post'] == post_id), None)
+    if message is not None:
+        thread['Messages'].remove(message)
+        _store_thread(service, index, thread)
     else:
-        raise ValueError("Thread ID {0} not found in service.".format(thread_id))
+        raise ValueError("Post ID {0} not found in thread {1}.".format(post_id, thread_id))
 
 def add_service(services, entry, service_name, info=None):
     new_service = {
@@ -1246,3 +1059,35 @@ def remove_service(services, entry):
         services.remove(service)
     else:
         raise ValueError("Service entry {0} not found.".format(entry))
+
+# The converters (JSON, XML, original text) and the display code live in
+# convert_message_file and render_message_file; their names are still
+# importable from here but the modules (and xml/json) are only loaded on
+# first use, which keeps plain parses and validations quick to start.
+_LAZY_MODULES = {
+    'convert_message_file': (
+        'to_json', 'from_json', 'load_from_json_file', 'save_to_json_file',
+        'to_xml', 'from_xml', 'parse_xml_element', 'load_from_xml_file', 'save_to_xml_file',
+        'LINE_ENDINGS', 'services_to_string', 'save_services_to_file',
+        'TextServicesWriter', 'JSONServicesWriter', 'XMLServicesWriter',
+    ),
+    'render_message_file': (
+        'iter_display_services', 'display_services', 'display_thread', 'DisplayServicesWriter',
+    ),
+}
+_LAZY_NAMES = dict((name, module) for module, names in _LAZY_MODULES.items() for name in names)
+# 'from parse_message_file import *' still brings in the lazy names
+__all__ = [name for name in list(globals()) if not name.startswith('_')] + sorted(_LAZY_NAMES)
+
+def __getattr__(name):
+    module = _LAZY_NAMES.get(name)
+    if module is None:
+        raise AttributeError("module '{0}' has no attribute '{1}'".format(__name__, name))
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+if sys.version_info < (3, 7):
+    # Module level __getattr__ needs Python 3.7, so load everything up front
+    for _name in _LAZY_NAMES:
+        __getattr__(_name)
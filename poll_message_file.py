@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return 0
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+class PollTable:
+    """ Columnar table of every poll in a services structure.
+
+    Answers are kept in one flat string table and Results/Percentage in typed
+    arrays of the same length; offsets[i]:offsets[i + 1] is the slice that
+    belongs to poll i.  Votes, the poll key (entry, thread, post, num) and the
+    question are stored once per poll.  Arrays are NumPy arrays when NumPy is
+    importable and array.array otherwise, and every method works on both.
+    """
+
+    def __init__(self, use_numpy=None):
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        if use_numpy and numpy is None:
+            raise ImportError("numpy module is not available")
+        self.use_numpy = use_numpy
+        self.keys = []
+        self.questions = []
+        self.answers = []
+        self._offsets = array('q', [0])
+        self._results = array('q')
+        self._percentages = array('d')
+        self._votes = array('q')
+        self._shape_ok = array('b')
+        self._frozen = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add_poll(self, poll, key=None):
+        """ Append one parsed poll dict (Num, Question, Answers, Results, Percentage, Votes). """
+        answers = list(poll.get('Answers', []))
+        results = list(poll.get('Results', []))
+        percentages = list(poll.get('Percentage', []))
+        count = len(answers)
+        self._shape_ok.append(1 if len(results) == count and len(percentages) == count else 0)
+        results = (results + [0] * count)[:count]
+        percentages = (percentages + ['nan'] * count)[:count]
+        self.keys.append(key if key is not None else (None, None, None, poll.get('Num')))
+        self.questions.append(poll.get('Question', ''))
+        self.answers.extend(answers)
+        self._results.extend(_to_int(result) for result in results)
+        self._percentages.extend(_to_float(percentage) for percentage in percentages)
+        self._votes.append(_to_int(poll.get('Votes', 0)))
+        self._offsets.append(len(self.answers))
+        self._frozen = None
+
+    def add_services(self, services):
+        for service in services:
+            for thread in service.get('MessageThreads', []):
+                for message in thread.get('Messages', []):
+                    for poll in message.get('Polls', []):
+                        self.add_poll(poll, (service.get('Entry'), thread.get('Thread'), message.get('Post'), poll.get('Num')))
+        return self
+
+    @classmethod
+    def from_services(cls, services, use_numpy=None):
+        return cls(use_numpy).add_services(services)
+
+    def _columns(self):
+        """ Return (offsets, results, percentages, votes, shape_ok) in the table's array type. """
+        if self._frozen is None:
+            columns = (self._offsets, self._results, self._percentages, self._votes, self._shape_ok)
+            if self.use_numpy:
+                columns = tuple(numpy.frombuffer(column, dtype=column.typecode).copy() if len(column) else numpy.zeros(0, dtype=column.typecode) for column in columns)
+                columns = columns[:4] + (columns[4].astype(bool),)
+            self._frozen = columns
+        return self._frozen
+
+    @property
+    def offsets(self):
+        return self._columns()[0]
+
+    @property
+    def results(self):
+        return self._columns()[1]
+
+    @property
+    def percentages(self):
+        return self._columns()[2]
+
+    @property
+    def votes(self):
+        return self._columns()[3]
+
+    def poll_index(self):
+        """ Poll number (row in keys) for every answer slot. """
+        offsets = self.offsets
+        if self.use_numpy:
+            return numpy.repeat(numpy.arange(len(self.keys)), numpy.diff(offsets))
+        index = array('q')
+        for poll in range(len(self.keys)):
+            index.extend([poll] * (offsets[poll + 1] - offsets[poll]))
+        return index
+
+    def result_totals(self):
+        """ Sum of Results per poll. """
+        if self.use_numpy:
+            return numpy.bincount(self.poll_index(), weights=self.results, minlength=len(self.keys)).astype(numpy.int64)
+        offsets, results = self.offsets, self.results
+        return array('q', [sum(results[offsets[poll]:offsets[poll + 1]]) for poll in range(len(self.keys))])
+
+    def recompute_percentages(self, decimals=2):
+        """ Percentage of each answer recomputed from Results, rounded to decimals. """
+        totals = self.result_totals()
+        if self.use_numpy:
+            per_answer = totals[self.poll_index()].astype(numpy.float64)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                percentages = numpy.where(per_answer > 0, self.results * 100.0 / per_answer, 0.0)
+            return numpy.round(percentages, decimals)
+        results = self.results
+        return array('d', [round(results[slot] * 100.0 / totals[poll], decimals) if totals[poll] else 0.0
+                           for slot, poll in enumerate(self.poll_index())])
+
+    def validate(self, tolerance=0.01):
+        """ Return the rows of polls whose Results, Percentage and Votes disagree.
+
+        A poll is invalid when its Results/Percentage lists do not line up with
+        Answers, when Results do not add up to Votes, or when any stored
+        Percentage is more than tolerance away from the recomputed one.
+        """
+        recomputed = self.recompute_percentages()
+        totals = self.result_totals()
+        if self.use_numpy:
+            index = self.poll_index()
+            off = ~(numpy.abs(self.percentages - recomputed) <= tolerance)
+            bad = numpy.zeros(len(self.keys), dtype=bool)
+            numpy.logical_or.at(bad, index, off)
+            bad |= ~self._columns()[4]
+            bad |= totals != self.votes
+            return [int(poll) for poll in numpy.flatnonzero(bad)]
+        bad = set(poll for poll in range(len(self.keys)) if not self._shape_ok[poll] or totals[poll] != self._votes[poll])
+        percentages = self.percentages
+        for slot, poll in enumerate(self.poll_index()):
+            if not abs(percentages[slot] - recomputed[slot]) <= tolerance:
+                bad.add(poll)
+        return sorted(bad)
+
+    def aggregate(self, by='answer'):
+        """ Cross-poll totals of Results keyed by answer text, or by question when by='question'. """
+        if by == 'question':
+            totals = self.result_totals()
+            aggregated = {}
+            for poll, question in enumerate(self.questions):
+                aggregated[question] = aggregated.get(question, 0) + int(totals[poll])
+            return aggregated
+        if by != 'answer':
+            raise ValueError("Invalid aggregate key '{0}'. Expected 'answer' or 'question'.".format(by))
+        if self.use_numpy:
+            if not self.answers:
+                return {}
+            labels, inverse = numpy.unique(numpy.array(self.answers, dtype=object).astype(str), return_inverse=True)
+            sums = numpy.bincount(inverse, weights=self.results, minlength=len(labels))
+            return dict((str(label), int(total)) for label, total in zip(labels, sums))
+        aggregated = {}
+        for answer, result in zip(self.answers, self.results):
+            aggregated[answer] = aggregated.get(answer, 0) + result
+        return aggregated
+
+    def total_votes(self):
+        return int(sum(self.votes))
+
+    def to_polls(self, use_recomputed=False):
+        """ Rebuild poll dicts, with Results/Percentage as numbers rather than strings. """
+        offsets, results = self.offsets, self.results
+        percentages = self.recompute_percentages() if use_recomputed else self.percentages
+        polls = []
+        for poll, key in enumerate(self.keys):
+            start, end = offsets[poll], offsets[poll + 1]
+            polls.append({
+                'Num': key[3],
+                'Question': self.questions[poll],
+                'Answers': self.answers[start:end],
+                'Results': [int(result) for result in results[start:end]],
+                'Percentage': [float(percentage) for percentage in percentages[start:end]],
+                'Votes': int(self.votes[poll]),
+            })
+        return polls
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import itertools
+import re
+from bisect import bisect_left, insort
+
+# Indexed fields and what they belong to
+FIELDS = {'Handle': 'user', 'Name': 'user', 'Headline': 'category', 'Title': 'thread'}
+
+_WORD_START = re.compile(r"(?:^|(?<=[\s_.,/@#-]))[^\s_.,/@#-]")
+
+def normalize(text):
+    """ Key text is matched on: lower cased (case folded where available). """
+    text = "{0}".format(text)
+    return text.casefold() if hasattr(text, 'casefold') else text.lower()
+
+def _word_keys(text):
+    """ text from each word start on, so 'smi' completes 'John Smith' as well as 'smi' does 'Smith'. """
+    key = normalize(text)
+    return sorted(set(key[match.start():] for match in _WORD_START.finditer(key)) | set([key]))
+
+class PrefixIndex:
+    """ Prefix index over user handles and names, category headlines and thread titles.
+
+    Each field is a sorted list of (key, serial) pairs, one per word of
+    every indexed value, so a completion is one bisect followed by a scan
+    of the matching run; add_service() appends and sorts once, on the next
+    lookup.  Items are identified by a ref: (Entry, user ID)
+    for users, (Entry, Type, ID) for categories and (Entry, Thread) for
+    threads.  Passed as prefix_index= to parse_message_file's add_user(),
+    remove_user(), add_category(), remove_category(), add_message_thread()
+    and remove_message_thread() the index follows the edits they make.
+    """
+
+    def __init__(self, services=()):
+        self.keys = dict((field, []) for field in FIELDS)
+        self.values = {}
+        self.entries = dict((field, {}) for field in FIELDS)
+        self.serials = itertools.count()
+        self.unsorted = set()
+        for service in services:
+            self.add_service(service)
+
+    def _sorted_keys(self, field):
+        keys = self.keys[field]
+        if field in self.unsorted:
+            keys.sort()
+            self.unsorted.discard(field)
+        return keys
+
+    def add(self, field, ref, text, bulk=False):
+        """ Index text as field of the item ref, replacing what was indexed for it before. """
+        self.remove(field, ref)
+        if not text:
+            return
+        serial = next(self.serials)
+        self.values[serial] = (text, ref)
+        entries = [(key, serial) for key in _word_keys(text)]
+        if bulk:
+            self.keys[field].extend(entries)
+            self.unsorted.add(field)
+        else:
+            keys = self._sorted_keys(field)
+            for entry in entries:
+                insort(keys, entry)
+        self.entries[field][ref] = entries
+
+    def remove(self, field, ref):
+        """ Drop the item ref from field, if it is indexed. """
+        entries = self.entries[field].pop(ref, None)
+        if not entries:
+            return
+        keys = self._sorted_keys(field)
+        for entry in entries:
+            position = bisect_left(keys, entry)
+            if position < len(keys) and keys[position] == entry:
+                del keys[position]
+        self.values.pop(entries[0][1], None)
+
+    def add_user(self, service, user_id, user, bulk=False):
+        ref = (service.get('Entry'), user_id)
+        self.add('Handle', ref, user.get('Handle'), bulk)
+        self.add('Name', ref, user.get('Name'), bulk)
+
+    def remove_user(self, service, user_id):
+        ref = (service.get('Entry'), user_id)
+        self.remove('Handle', ref)
+        self.remove('Name', ref)
+
+    def add_category(self, service, category, bulk=False):
+        self.add('Headline', (service.get('Entry'), category.get('Type'), category.get('ID')), category.get('Headline'), bulk)
+
+    def remove_category(self, service, category):
+        self.remove('Headline', (service.get('Entry'), category.get('Type'), category.get('ID')))
+
+    def add_thread(self, service, thread, bulk=False):
+        self.add('Title', (service.get('Entry'), thread.get('Thread')), thread.get('Title'), bulk)
+
+    def remove_thread(self, service, thread):
+        self.remove('Title', (service.get('Entry'), thread.get('Thread')))
+
+    def add_service(self, service):
+        """ Index a parsed service's users, categories and threads. """
+        for user_id, user in service.get('Users', {}).items():
+            self.add_user(service, user_id, user, True)
+        for category in service.get('Categories', []):
+            self.add_category(service, category, True)
+        for thread in service.get('MessageThreads', []):
+            self.add_thread(service, thread, True)
+
+    def complete(self, prefix, field='Handle', limit=10):
+        """ Up to limit (text, ref) pairs whose field value has a word starting with prefix, in key order. """
+        if field not in self.keys:
+            raise ValueError("Unknown prefix index field '{0}'.".format(field))
+        prefix = normalize(prefix)
+        keys = self._sorted_keys(field)
+        results = []
+        seen = set()
+        position = bisect_left(keys, (prefix,))
+        while position < len(keys) and len(results) < limit:
+            key, serial = keys[position]
+            if not key.startswith(prefix):
+                break
+            position += 1
+            if serial not in seen:
+                seen.add(serial)
+                results.append(self.values[serial])
+        return results
+
+    def complete_users(self, prefix, limit=10):
+        """ (text, ref) pairs of users whose handle or name starts a word with prefix; handles first. """
+        results = self.complete(prefix, 'Handle', limit)
+        refs = set(ref for text, ref in results)
+        for text, ref in self.complete(prefix, 'Name', limit * 2):
+            if len(results) >= limit:
+                break
+            if ref not in refs:
+                refs.add(ref)
+                results.append((text, ref))
+        return results
+
+    def __len__(self):
+        return len(self.values)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import sys
+
+from parse_message_file import ServicesStreamWriter
+
+def _display_service_header(service):
+    """ Render the service header, category list and user list as one chunk. """
+    output = []
+    output.append("Service Entry: {0}".format(service['Entry']))
+    output.append("Service: {0}".format(service['Service']))
+
+    if 'Info' in service and service['Info']:
+        output.append("Info: {0}".format(service['Info'].strip().replace("\n", "\n      ")))
+
+    output.append("Interactions: {0}".format(', '.join(service['Interactions'])))
+    output.append("Status: {0}".format(', '.join(service.get('Status', []))))
+
+    if 'Categorization' in service and service['Categorization']:
+        for category_type, category_levels in service['Categorization'].items():
+            output.append("{0}: {1}".format(category_type, ', '.join(category_levels)))
+
+    output.append("Category List:")
+    for category in service['Categories']:
+        output.append("  Type: {0}, Level: {1}".format(category.get('Type', 'N/A'), category.get('Level', 'N/A')))
+        output.append("  ID: {0}".format(category['ID']))
+        output.append("  InSub: {0}".format(category['InSub']))
+        output.append("  Headline: {0}".format(category['Headline']))
+        output.append("  Description: {0}".format(category['Description'].strip().replace("\n", "\n    ")))
+        output.append("")
+
+    output.append("User List:")
+    for user_id, user_info in service['Users'].items():
+        output.append("  User ID: {0}".format(user_id))
+        output.append("    Name: {0}".format(user_info['Name']))
+        output.append("    Handle: {0}".format(user_info['Handle']))
+        output.append("    Location: {0}".format(user_info.get('Location', 'N/A')))
+        output.append("    Joined: {0}".format(user_info.get('Joined', 'N/A')))
+        output.append("    Birthday: {0}".format(user_info.get('Birthday', 'N/A')))
+        output.append("    Bio:")
+        output.append("      {0}".format(user_info.get('Bio', '').strip().replace("\n", "\n      ")))
+        output.append("")
+
+    output.append("Message Threads:")
+    output.append("")
+    return "\n".join(output)
+
+def _display_thread(thread, number):
+    """ Render one message thread, with its posts and polls, as one chunk. """
+    output = []
+    output.append("  --- Message Thread {0} ---".format(number))
+    if thread['Title']:
+        output.append("    Title: {0}".format(thread['Title']))
+    if 'Category' in thread:
+        output.append("    Category: {0}".format(', '.join(thread['Category'])))
+    if 'Forum' in thread:
+        output.append("    Forum: {0}".format(', '.join(thread['Forum'])))
+    if 'Type' in thread:
+        output.append("    Type: {0}".format(thread['Type']))
+    if 'State' in thread:
+        output.append("    State: {0}".format(thread['State']))
+
+    for message in thread['Messages']:
+        output.append("    {0} ({1} on {2}): [{3}] Post ID: {4} Nested: {5}".format(
+            message['Author'], message['Time'], message['Date'],
+            message.get('SubType', 'Post' if message['Post'] == 1 or message['Nested'] == 0 else 'Reply'),
+            message['Post'], message['Nested']))
+
+        # Indent each line of the message body but keep it at the same level
+        output.append("      {0}".format(message['Message'].strip().replace("\n", "\n      ")))
+
+        if 'Polls' in message and message['Polls']:
+            output.append("      Polls:")
+            for poll in message['Polls']:
+                output.append("        Poll {0}:".format(poll.get('Num', 'N/A')))
+                output.append("          Question: {0}".format(poll.get('Question', 'N/A')))
+                output.append("          Answers: {0}".format(", ".join(poll.get('Answers', []))))
+                output.append("          Results: {0}".format(", ".join(str(r) for r in poll.get('Results', []))))
+                output.append("          Percentage: {0}".format(", ".join("{:.2f}".format(float(p)) for p in poll.get('Percentage', []))))
+                output.append("          Votes: {0}".format(poll.get('Votes', 'N/A')))
+    output.append("")
+    output.append("")
+    return "\n".join(output)
+
+def iter_display_services(services, limit=None, offset=0):
+    """ Yield the human readable rendering of services one chunk at a time.
+
+    Threads are numbered per service as before, but offset and limit count
+    threads across the whole archive; once limit threads have been rendered
+    the generator stops, so nothing after the requested page is formatted.
+    A service's header is only rendered with its first thread in the page,
+    so services whose threads are all skipped are left out (as are services
+    without threads when offset is set).
+    """
+    skipped = 0
+    shown = 0
+    for service in services:
+        if limit is not None and shown >= limit:
+            return
+        threads = service['MessageThreads']
+        if not threads:
+            if not offset:
+                yield _display_service_header(service)
+            continue
+        if skipped + len(threads) <= offset:
+            skipped += len(threads)
+            continue
+        header = True
+        for idx, thread in enumerate(threads):
+            if skipped < offset:
+                skipped += 1
+                continue
+            if limit is not None and shown >= limit:
+                return
+            if header:
+                yield _display_service_header(service)
+                header = False
+            yield _display_thread(thread, idx + 1)
+            shown += 1
+
+def display_services(services, file=None, limit=None, offset=0, buffer_size=65536):
+    """ Write the human readable rendering of services through one buffered writer. """
+    if file is None:
+        file = sys.stdout
+    pending = []
+    pending_size = 0
+    for chunk in iter_display_services(services, limit, offset):
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= buffer_size:
+            file.write("".join(pending))
+            pending = []
+            pending_size = 0
+    if pending:
+        file.write("".join(pending))
+    file.flush()
+
+def display_thread(thread, file=None):
+    """ Write the human readable rendering of a single message thread. """
+    if file is None:
+        file = sys.stdout
+    file.write(_display_thread(thread, thread.get('Thread', 1)))
+    file.flush()
+
+class DisplayServicesWriter(ServicesStreamWriter):
+    """ Stream the display_services() rendering.
+
+    Like display_services(), a service's header is written with its first
+    thread in the page; pass stream_services()'s offset so services without
+    threads are left out of a page that skips threads.
+    """
+
+    def __init__(self, file, offset=0):
+        ServicesStreamWriter.__init__(self, file)
+        self.offset = offset
+        self.header_written = True
+
+    def start_service(self, service):
+        self.thread_number = 0
+        self.header_written = False
+
+    def skip_thread(self, service, thread):
+        self.thread_number += 1
+
+    def write_thread(self, service, thread):
+        self.thread_number += 1
+        if not self.header_written:
+            self.file.write(_display_service_header(service))
+            self.header_written = True
+        self.file.write(_display_thread(thread, self.thread_number))
+
+    def end_service(self, service):
+        # A service without threads still shows its header when no page is skipped
+        if not self.header_written and not self.thread_number and not self.offset:
+            self.file.write(_display_service_header(service))
+        self.header_written = True
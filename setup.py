@@ -35,7 +35,7 @@ pymodule['packagedata'] = {'data': ['*.txt']};
 pymodule['longdescription'] = 'love loveisokifnotextreme extremeloveisnotok lovesostrong lovesostrongitscreepy lovesostrongitiscreepy extreamelove excessivelove yanderelove unbendinglove loveyoucantbelievein whydidthishappentomelove creepylove loveinabundance morelovemoreextreme weheardyoulikelovesowegotyoulove iloveyoumorethenyouknow ifyoulovethemtheywilllovebackinextreme whenyoulovetheylovebackinextreme ifonlyineverlovedagain somuchloveyoucanthandleitanddie weloveonlyforlovetheyloveforextremelove iloveyoumorethenyouknowbutyouloveinextreme isextremeloverealyinhighdemand lovesostrongitscreepy lovesostrongitiscreepy extreamelove excessivelove yanderelove unbendinglove loveyoucantbelievein whydidthishappentomelove creepylove loveinabundance isloverealyinhighdemand morelovemoreextreme weheardyoulikelovesowegotyoulove iloveyoumorethenyouknow ifyoulovethemtheywilllovebackinextreme whenyoulovetheylovebackinextreme ifonlyineverlovedagain somuchloveyoucanthandleitanddie weloveonlyforlovetheyloveforextremelove iloveyoumorethenyouknowbutyouloveinextreme willidiefromallthisextremelove extremeloveyoulldiefor whydotheylovemesoextreme ionlyloveyoubutyoutookittoextremes somuchloveitsunhealthy unhealthylove whydidmylovemakethemloveinextremeamounts cantheylovemeanymoreifitsinextremeamounts willtheyeverstoplovingmeinextremeamounts extremelovestory';
 pymodule['platforms'] = 'OS Independent';
 pymodule['zipsafe'] = True;
-pymodule['pymodules'] = ['parse_message_file'];
+pymodule['pymodules'] = ['parse_message_file', 'stats_message_file', 'poll_message_file', 'bench_message_file', 'codec_message_file', 'index_message_file', 'async_message_file', 'batch_message_file', 'convert_message_file', 'render_message_file', 'validate_message_file', 'lint_message_file', 'sqlite_message_file', 'csv_message_file', 'diff_message_file', 'merge_message_file', 'bodies_message_file', 'lazy_message_file', 'shared_message_file', 'spill_message_file', 'category_message_file', 'prefix_message_file'];
 pymodule['scripts'] = ['nextest.py', 'parse_message_file.py'];
 pymodule['classifiers'] = [
  'Development Status :: 5 - Production/Stable',
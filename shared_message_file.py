@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import marshal
+import struct
+
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+# Only POSIX shared memory is registered with the resource tracker
+_TRACKED = shared_memory is not None and shared_memory._USE_POSIX
+
+from parse_message_file import iter_parse_file
+
+# Layout of a published archive, all little endian:
+#   header   magic, version, service count, offset of the service table
+#   services header blob (offset, length), thread table offset, thread count
+#   threads  one (offset, length) per thread
+#   blobs    marshal'ed service headers (everything but MessageThreads) and threads
+MAGIC = b"LSAR"
+VERSION = 1
+_HEADER = struct.Struct("<4sIQQ")
+_SERVICE = struct.Struct("<QQQQ")
+_THREAD = struct.Struct("<QQ")
+
+# Parser internals that are not published
+_THREAD_INTERNALS = frozenset(['post_ids'])
+
+def _require_shared_memory():
+    if shared_memory is None:
+        raise ImportError("multiprocessing.shared_memory is not available (Python 3.8 or later is required)")
+
+def _encode_thread(thread):
+    return marshal.dumps(dict((key, value) for key, value in thread.items() if key not in _THREAD_INTERNALS))
+
+def _encode_service(service):
+    return marshal.dumps(dict((key, value) for key, value in service.items() if key != 'MessageThreads'))
+
+class ArchiveEncoder:
+    """ Collects encoded services and threads, then lays them out in one buffer. """
+
+    def __init__(self):
+        self.services = []
+
+    def add_service(self, service, threads=None):
+        """ Add service; threads are encoded blobs, or taken from service['MessageThreads']. """
+        if threads is None:
+            threads = [_encode_thread(thread) for thread in service.get('MessageThreads', [])]
+        self.services.append((_encode_service(service), threads))
+
+    def size(self):
+        size = _HEADER.size + _SERVICE.size * len(self.services)
+        for header, threads in self.services:
+            size += len(header) + _THREAD.size * len(threads) + sum(len(blob) for blob in threads)
+        return size
+
+    def write(self, buffer):
+        """ Write the archive into buffer (at least size() bytes). """
+        table = _HEADER.size
+        position = table + _SERVICE.size * len(self.services)
+        _HEADER.pack_into(buffer, 0, MAGIC, VERSION, len(self.services), table)
+        for number, (header, threads) in enumerate(self.services):
+            header_offset = position
+            buffer[position:position + len(header)] = header
+            position += len(header)
+            thread_table = position
+            position += _THREAD.size * len(threads)
+            for thread_number, blob in enumerate(threads):
+                _THREAD.pack_into(buffer, thread_table + thread_number * _THREAD.size, position, len(blob))
+                buffer[position:position + len(blob)] = blob
+                position += len(blob)
+            _SERVICE.pack_into(buffer, table + number * _SERVICE.size, header_offset, len(header), thread_table, len(threads))
+
+class SharedThreads(Sequence):
+    """ Read-only sequence of one service's threads; each is decoded from the buffer when indexed. """
+
+    def __init__(self, buffer, table, count):
+        self._buffer = buffer
+        self._table = table
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[number] for number in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("thread index out of range")
+        offset, length = _THREAD.unpack_from(self._buffer, self._table + index * _THREAD.size)
+        return marshal.loads(self._buffer[offset:offset + length])
+
+class SharedService(Mapping):
+    """ Read-only view of one published service.
+
+    Works wherever a service dict is read: the header keys (Entry, Users,
+    Categories, ...) are decoded on first use and 'MessageThreads' is a
+    SharedThreads sequence.
+    """
+
+    def __init__(self, buffer, offset, length, thread_table, thread_count):
+        self._buffer = buffer
+        self._span = (offset, length)
+        self._header = None
+        self.threads = SharedThreads(buffer, thread_table, thread_count)
+
+    def header(self):
+        if self._header is None:
+            offset, length = self._span
+            self._header = marshal.loads(self._buffer[offset:offset + length])
+        return self._header
+
+    def __getitem__(self, key):
+        if key == 'MessageThreads':
+            return self.threads
+        return self.header()[key]
+
+    def __iter__(self):
+        for key in self.header():
+            yield key
+        yield 'MessageThreads'
+
+    def __len__(self):
+        return len(self.header()) + 1
+
+    def to_dict(self):
+        """ A plain (unshared) service dict. """
+        service = dict(self.header())
+        service['MessageThreads'] = list(self.threads)
+        return service
+
+class SharedArchive(Sequence):
+    """ A parsed archive published in shared memory, as a read-only sequence of SharedServices.
+
+    Create one with publish_services() or publish_file() and hand its name
+    to other processes, which open it with attach_archive().  Nothing is
+    decoded until a service or thread is read, so attaching is cheap and
+    the archive's memory is shared by every process.  The publisher calls
+    unlink() once the archive is no longer needed; every process calls
+    close().
+    """
+
+    def __init__(self, memory, owner=False):
+        self.memory = memory
+        self.owner = owner
+        self.buffer = memory.buf
+        magic, version, count, table = _HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Shared memory '{0}' does not hold a published archive.".format(memory.name))
+        if version != VERSION:
+            raise ValueError("Unsupported shared archive version '{0}'.".format(version))
+        self.services = [SharedService(self.buffer, *_SERVICE.unpack_from(self.buffer, table + number * _SERVICE.size))
+                         for number in range(count)]
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def __len__(self):
+        return len(self.services)
+
+    def __getitem__(self, index):
+        return self.services[index]
+
+    def to_services(self):
+        """ Plain (unshared) copy of the services data structure. """
+        return [service.to_dict() for service in self.services]
+
+    def close(self):
+        # Views into the buffer must go before the mapping can be closed
+        self.services = []
+        self.buffer = None
+        self.memory.close()
+
+    def unlink(self):
+        """ Free the shared memory (publisher only); attached processes keep their mapping until they close it. """
+        if _TRACKED:
+            # Attaching before Python 3.13 withdraws the block from the
+            # resource tracker, which this process may share with the
+            # attacher, so register it again for unlink() to withdraw
+            resource_tracker.register(self.memory._name, "shared_memory")
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        if self.owner:
+            self.unlink()
+
+def _publish(encoder, name):
+    _require_shared_memory()
+    memory = shared_memory.SharedMemory(name=name, create=True, size=max(encoder.size(), 1))
+    encoder.write(memory.buf)
+    return SharedArchive(memory, owner=True)
+
+def publish_services(services, name=None):
+    """ Publish a services data structure into a new shared memory block; returns its SharedArchive. """
+    encoder = ArchiveEncoder()
+    for service in services:
+        encoder.add_service(service)
+    return _publish(encoder, name)
+
+def publish_file(filename, name=None, threads=1):
+    """ Parse an archive file straight into shared memory.
+
+    Threads are encoded as they are parsed, so the nested dicts of the
+    whole archive never exist in this process.
+    """
+    encoder = ArchiveEncoder()
+    encoded = []
+    current_service = None
+    for event, service, item in iter_parse_file(filename, threads=threads):
+        if event == 'thread':
+            if service is not current_service:
+                encoded = []
+                current_service = service
+            encoded.append(_encode_thread(item))
+        elif event == 'service':
+            encoder.add_service(service, encoded if service is current_service else [])
+            encoded = []
+            current_service = None
+    return _publish(encoder, name)
+
+def attach_archive(name):
+    """ Open an archive another process published under name. """
+    _require_shared_memory()
+    try:
+        memory = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block with the resource
+        # tracker, which unlinks it when this process exits, so the
+        # registration is withdrawn again
+        memory = shared_memory.SharedMemory(name=name)
+        if _TRACKED:
+            resource_tracker.unregister(memory._name, "shared_memory")
+    return SharedArchive(memory)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import sys
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    from collections import MutableSequence
+
+def approximate_size(value):
+    """ Rough number of bytes value and everything it holds take in memory. """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += approximate_size(key) + approximate_size(item)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += approximate_size(item)
+    return size
+
+class _Spilled:
+    """ Where one spilled thread's pickle is in the store's file. """
+    __slots__ = ('offset', 'length')
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+class SpillStore:
+    """ Temporary file that threads are pickled to once the parsed result outgrows memory_budget.
+
+    Every SpilledThreads sequence of a parse shares one store, which keeps
+    count of the approximate size of the threads they hold in memory.  Once
+    that passes memory_budget bytes they are all appended to the file, one
+    pickle each, and only their offsets are kept.  The file is removed when
+    the store is garbage collected or closed.
+    """
+
+    def __init__(self, memory_budget, directory=None):
+        if memory_budget < 0:
+            raise ValueError("Invalid memory budget '{0}'.".format(memory_budget))
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.file = None
+        self.sequences = []
+        self.resident_bytes = 0
+        self.spilled_threads = 0
+        self.spilled_bytes = 0
+
+    def threads_of(self, service):
+        """ The SpilledThreads of service's 'MessageThreads', replacing a plain list on first use. """
+        threads = service.get('MessageThreads')
+        if not isinstance(threads, SpilledThreads) or threads.store is not self:
+            threads = service['MessageThreads'] = SpilledThreads(self, threads or [])
+        return threads
+
+    def add_thread(self, service, thread):
+        """ Append a finished thread to service's 'MessageThreads'; the parser's hook for memory_budget. """
+        self.threads_of(service).append(thread)
+
+    def account(self, size):
+        self.resident_bytes += size
+        if self.resident_bytes > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        """ Write every thread held in memory to the file. """
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(prefix="lovesostrong-", suffix=".spill", dir=self.directory)
+        self.file.seek(0, 2)
+        for threads in self.sequences:
+            threads._spill(self.file)
+        self.resident_bytes = 0
+
+    def _dump(self, file, thread):
+        data = pickle.dumps(thread, pickle.HIGHEST_PROTOCOL)
+        offset = file.tell()
+        file.write(data)
+        self.spilled_threads += 1
+        self.spilled_bytes += len(data)
+        return _Spilled(offset, len(data))
+
+    def load(self, spilled):
+        self.file.seek(spilled.offset)
+        return pickle.loads(self.file.read(spilled.length))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class SpilledThreads(MutableSequence):
+    """ A service's 'MessageThreads' under a memory budget: threads in memory or spilled to a SpillStore.
+
+    Indexing a spilled thread reloads it from disk as a new dict every
+    time, so changes to it are only kept once it is stored back
+    (threads[index] = thread), which parse_message_file's add_message_post(),
+    add_poll() and remove_message_post() do.  Everything else behaves as a
+    list.
+    """
+
+    def __init__(self, store, threads=()):
+        self.store = store
+        self.items = []
+        store.sequences.append(self)
+        for thread in threads:
+            self.append(thread)
+
+    def _spill(self, file):
+        for index, item in enumerate(self.items):
+            if not isinstance(item, _Spilled):
+                self.items[index] = self.store._dump(file, item)
+
+    def _load(self, item):
+        return self.store.load(item) if isinstance(item, _Spilled) else item
+
+    def _forget(self, item):
+        if not isinstance(item, _Spilled):
+            self.store.resident_bytes -= approximate_size(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._load(item) for item in self.items[index]]
+        return self._load(self.items[index])
+
+    def __iter__(self):
+        # Spilled threads are read in file order
+        for item in self.items:
+            yield self._load(item)
+
+    def __setitem__(self, index, thread):
+        if isinstance(index, slice):
+            threads = list(thread)
+            for item in self.items[index]:
+                self._forget(item)
+            self.items[index] = threads
+            self.store.account(sum(approximate_size(item) for item in threads))
+            return
+        self._forget(self.items[index])
+        self.items[index] = thread
+        self.store.account(approximate_size(thread))
+
+    def __delitem__(self, index):
+        items = self.items[index] if isinstance(index, slice) else [self.items[index]]
+        for item in items:
+            self._forget(item)
+        del self.items[index]
+
+    def insert(self, index, thread):
+        self.items.insert(index, thread)
+        self.store.account(approximate_size(thread))
+
+    def spilled(self):
+        """ How many of the threads are on disk. """
+        return sum(1 for item in self.items if isinstance(item, _Spilled))
+
+    def __repr__(self):
+        return "<SpilledThreads of {0} threads, {1} spilled>".format(len(self.items), self.spilled())
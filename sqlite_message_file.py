@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import os
+import sqlite3
+
+from parse_message_file import ServicesStreamWriter, iter_parse_file, stream_services
+
+BATCH_SIZE = 10000
+
+# One row per service, user, category, thread, post and poll.  Services are
+# numbered in file order (Entry values need not be unique) and threads,
+# posts and polls by their position, so the archive reads back in order;
+# the Entry/Thread/Post IDs are kept as ordinary columns for queries.
+# List fields are stored as JSON arrays and a NULL means the key was absent.
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS services (
+        service_id INTEGER PRIMARY KEY, entry INTEGER, service TEXT, info TEXT,
+        interactions TEXT, status TEXT, categorization TEXT)""",
+    """CREATE TABLE IF NOT EXISTS users (
+        service_id INTEGER, user_id INTEGER, name TEXT, handle TEXT, location TEXT,
+        joined TEXT, birthday TEXT, bio TEXT)""",
+    """CREATE TABLE IF NOT EXISTS categories (
+        service_id INTEGER, category_index INTEGER, id INTEGER, insub INTEGER, kind TEXT,
+        type TEXT, level TEXT, headline TEXT, description TEXT)""",
+    """CREATE TABLE IF NOT EXISTS threads (
+        service_id INTEGER, thread_index INTEGER, thread_id INTEGER, title TEXT,
+        category TEXT, forum TEXT, type TEXT, state TEXT)""",
+    """CREATE TABLE IF NOT EXISTS posts (
+        service_id INTEGER, thread_index INTEGER, post_index INTEGER, post_id INTEGER,
+        nested INTEGER, author TEXT, time TEXT, date TEXT, subtype TEXT, message TEXT)""",
+    """CREATE TABLE IF NOT EXISTS polls (
+        service_id INTEGER, thread_index INTEGER, post_index INTEGER, poll_index INTEGER,
+        num TEXT, question TEXT, answers TEXT, results TEXT, percentage TEXT, votes TEXT)""",
+]
+
+# Created once the rows are in; building an index over a full table is much
+# cheaper than keeping it up to date through every insert
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS users_by_id ON users (service_id, user_id)",
+    "CREATE INDEX IF NOT EXISTS categories_by_id ON categories (service_id, id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS threads_by_position ON threads (service_id, thread_index)",
+    "CREATE INDEX IF NOT EXISTS threads_by_id ON threads (service_id, thread_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS posts_by_position ON posts (service_id, thread_index, post_index)",
+    "CREATE INDEX IF NOT EXISTS posts_by_author ON posts (author)",
+    "CREATE INDEX IF NOT EXISTS polls_by_post ON polls (service_id, thread_index, post_index)",
+]
+
+INSERTS = {
+    'services': "INSERT INTO services VALUES (?, ?, ?, ?, ?, ?, ?)",
+    'users': "INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    'categories': "INSERT INTO categories VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    'threads': "INSERT INTO threads VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    'posts': "INSERT INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    'polls': "INSERT INTO polls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+}
+
+def _dump_list(value):
+    return None if value is None else json.dumps(list(value))
+
+def _load_list(value):
+    return None if value is None else json.loads(value)
+
+def _set_present(target, key, value):
+    if value is not None:
+        target[key] = value
+
+def open_database(filename, fresh=False):
+    """ Open (or create) an archive database; fresh=True replaces an existing file. """
+    if fresh and os.path.exists(filename):
+        os.remove(filename)
+    connection = sqlite3.connect(filename, isolation_level=None)
+    for statement in SCHEMA:
+        connection.execute(statement)
+    return connection
+
+class SQLiteServicesWriter(ServicesStreamWriter):
+    """ Stream services into an SQLite database as the parser produces them.
+
+    Rows are inserted with executemany() in batches of batch_size inside
+    one transaction, and the indexes are built by close().  Services are
+    appended after any already in the database.
+    """
+
+    def __init__(self, connection, batch_size=BATCH_SIZE):
+        ServicesStreamWriter.__init__(self, connection)
+        self.connection = connection
+        self.batch_size = batch_size
+        self.rows = dict((table, []) for table in INSERTS)
+        self.pending = 0
+        self.service_id = connection.execute("SELECT COALESCE(MAX(service_id), 0) FROM services").fetchone()[0]
+        if not connection.in_transaction:
+            connection.execute("BEGIN")
+
+    def _add(self, table, row):
+        self.rows[table].append(row)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for table, rows in self.rows.items():
+            if rows:
+                self.connection.executemany(INSERTS[table], rows)
+                del rows[:]
+        self.pending = 0
+
+    def start_service(self, service):
+        self.service_id += 1
+        self.thread_index = 0
+
+    def write_thread(self, service, thread):
+        service_id = self.service_id
+        thread_index = self.thread_index
+        self.thread_index += 1
+        self._add('threads', (service_id, thread_index, thread.get('Thread'), thread.get('Title'),
+                              _dump_list(thread.get('Category')), _dump_list(thread.get('Forum')),
+                              thread.get('Type'), thread.get('State')))
+        for post_index, message in enumerate(thread.get('Messages', [])):
+            self._add('posts', (service_id, thread_index, post_index, message.get('Post'), message.get('Nested'),
+                                message.get('Author'), message.get('Time'), message.get('Date'),
+                                message.get('SubType'), message.get('Message')))
+            for poll_index, poll in enumerate(message.get('Polls', [])):
+                self._add('polls', (service_id, thread_index, post_index, poll_index, poll.get('Num'), poll.get('Question'),
+                                    _dump_list(poll.get('Answers')), _dump_list(poll.get('Results')),
+                                    _dump_list(poll.get('Percentage')), poll.get('Votes')))
+
+    def skip_thread(self, service, thread):
+        self.thread_index += 1
+
+    def end_service(self, service):
+        service_id = self.service_id
+        categorization = service.get('Categorization')
+        self._add('services', (service_id, service.get('Entry'), service.get('Service'), service.get('Info'),
+                               _dump_list(service.get('Interactions')), _dump_list(service.get('Status')),
+                               None if categorization is None else json.dumps(categorization)))
+        for user_id, user in service.get('Users', {}).items():
+            self._add('users', (service_id, user_id, user.get('Name'), user.get('Handle'), user.get('Location'),
+                                user.get('Joined'), user.get('Birthday'), user.get('Bio')))
+        for category_index, category in enumerate(service.get('Categories', [])):
+            self._add('categories', (service_id, category_index, category.get('ID'), category.get('InSub'),
+                                     category.get('Kind'), category.get('Type'), category.get('Level'),
+                                     category.get('Headline'), category.get('Description')))
+
+    def close(self):
+        self.flush()
+        for statement in INDEXES:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+def _bulk_load(filename, fill, batch_size):
+    connection = open_database(filename, fresh=True)
+    try:
+        # Nothing is worth keeping from a half written export, so skip the
+        # rollback journal and fsyncs while loading
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        writer = SQLiteServicesWriter(connection, batch_size)
+        return fill(writer)
+    finally:
+        connection.close()
+
+def to_sqlite(services, filename, batch_size=BATCH_SIZE):
+    """ Save the services data structure to a new SQLite database file. """
+    def fill(writer):
+        for service in services:
+            writer.start_service(service)
+            for thread in service.get('MessageThreads', []):
+                writer.write_thread(service, thread)
+            writer.end_service(service)
+        writer.close()
+    _bulk_load(filename, fill, batch_size)
+
+def save_archive_to_sqlite(archive_filename, filename, verbose=False, threads=1, batch_size=BATCH_SIZE):
+    """ Parse an archive file straight into a new SQLite database without holding its threads.
+
+    Returns the number of threads written.
+    """
+    def fill(writer):
+        events = iter_parse_file(archive_filename, verbose=verbose, threads=threads)
+        return stream_services(events, writer)
+    return _bulk_load(filename, fill, batch_size)
+
+def from_sqlite(filename):
+    """ Load the services data structure from an SQLite database written by to_sqlite(). """
+    connection = sqlite3.connect(filename)
+    try:
+        services = []
+        by_id = {}
+        for service_id, entry, name, info, interactions, status, categorization in connection.execute(
+                "SELECT * FROM services ORDER BY service_id"):
+            service = {'Users': {}, 'MessageThreads': [], 'Categories': []}
+            _set_present(service, 'Entry', entry)
+            _set_present(service, 'Service', name)
+            _set_present(service, 'Info', info)
+            _set_present(service, 'Interactions', _load_list(interactions))
+            _set_present(service, 'Status', _load_list(status))
+            _set_present(service, 'Categorization', None if categorization is None else json.loads(categorization))
+            services.append(service)
+            by_id[service_id] = service
+
+        for row in connection.execute("SELECT * FROM users ORDER BY rowid"):
+            user = {}
+            for key, value in zip(('Name', 'Handle', 'Location', 'Joined', 'Birthday', 'Bio'), row[2:]):
+                _set_present(user, key, value)
+            by_id[row[0]]['Users'][row[1]] = user
+
+        for row in connection.execute("SELECT * FROM categories ORDER BY service_id, category_index"):
+            category = {}
+            for key, value in zip(('ID', 'InSub', 'Kind', 'Type', 'Level', 'Headline', 'Description'), row[2:]):
+                _set_present(category, key, value)
+            by_id[row[0]]['Categories'].append(category)
+
+        threads = {}
+        for row in connection.execute("SELECT * FROM threads ORDER BY service_id, thread_index"):
+            thread = {'Messages': []}
+            _set_present(thread, 'Thread', row[2])
+            _set_present(thread, 'Title', row[3])
+            _set_present(thread, 'Category', _load_list(row[4]))
+            _set_present(thread, 'Forum', _load_list(row[5]))
+            _set_present(thread, 'Type', row[6])
+            _set_present(thread, 'State', row[7])
+            by_id[row[0]]['MessageThreads'].append(thread)
+            threads[(row[0], row[1])] = thread
+
+        posts = {}
+        for row in connection.execute("SELECT * FROM posts ORDER BY service_id, thread_index, post_index"):
+            message = {}
+            for key, value in zip(('Post', 'Nested', 'Author', 'Time', 'Date', 'SubType', 'Message'), row[3:]):
+                _set_present(message, key, value)
+            thread = threads[(row[0], row[1])]
+            thread['Messages'].append(message)
+            # The parser's set of the thread's Post IDs, which it checks Nested against
+            if 'Post' in message:
+                thread.setdefault('post_ids', set()).add(message['Post'])
+            posts[(row[0], row[1], row[2])] = message
+
+        for row in connection.execute("SELECT * FROM polls ORDER BY service_id, thread_index, post_index, poll_index"):
+            poll = {}
+            _set_present(poll, 'Num', row[4])
+            _set_present(poll, 'Question', row[5])
+            _set_present(poll, 'Answers', _load_list(row[6]))
+            _set_present(poll, 'Results', _load_list(row[7]))
+            _set_present(poll, 'Percentage', _load_list(row[8]))
+            _set_present(poll, 'Votes', row[9])
+            posts[(row[0], row[1], row[2])].setdefault('Polls', []).append(poll)
+        return services
+    finally:
+        connection.close()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import Counter
+import json
+
+from parse_message_file import parse_message_datetime
+
+class ArchiveStats:
+    """ Mergeable aggregate statistics over parsed services.
+
+    An instance is fed by the parser (parse_file(..., stats=stats)) one
+    service, user, thread and post at a time, so every report is computed in
+    the same pass as the parse.  Instances built over different shards or
+    include files are combined with merge().
+    """
+
+    def __init__(self):
+        self.services = 0
+        self.users = 0
+        self.threads = 0
+        self.posts = 0
+        self.polls = 0
+        self.poll_votes = 0
+        self.posts_per_user = Counter()
+        self.posts_per_service = Counter()
+        self.posts_per_category = Counter()
+        self.posts_per_forum = Counter()
+        self.posts_per_day = Counter()
+        self.threads_per_category = Counter()
+        self.threads_per_forum = Counter()
+        self.reply_depths = Counter()
+        self.poll_results = {}
+        self._depth_thread = None
+        self._depths = {}
+
+    def add_service(self, service):
+        self.services += 1
+
+    def add_user(self, service, user_id, user):
+        self.users += 1
+
+    def add_thread(self, service, thread):
+        self.threads += 1
+        for category in thread.get('Category', []):
+            self.threads_per_category[category] += 1
+        for forum in thread.get('Forum', []):
+            self.threads_per_forum[forum] += 1
+        self._depth_thread = None
+        self._depths = {}
+
+    def add_post(self, service, thread, message):
+        self.posts += 1
+        self.posts_per_user[message.get('Author', '')] += 1
+        self.posts_per_service[service.get('Service', '') if service else ''] += 1
+        for category in thread.get('Category', []):
+            self.posts_per_category[category] += 1
+        for forum in thread.get('Forum', []):
+            self.posts_per_forum[forum] += 1
+
+        posted = parse_message_datetime(message.get('Date'))
+        self.posts_per_day[posted.strftime("%Y-%m-%d") if posted else message.get('Date', '')] += 1
+
+        # Reply depth follows the Nested -> Post chain, which the parser has
+        # already checked only points at earlier posts in the same thread.
+        if self._depth_thread is not thread:
+            self._depth_thread = thread
+            self._depths = {}
+        nested = message.get('Nested', 0)
+        depth = self._depths.get(nested, -1) + 1 if nested else 0
+        if 'Post' in message:
+            self._depths[message['Post']] = depth
+        self.reply_depths[depth] += 1
+
+        for poll in message.get('Polls', []):
+            self.add_poll(poll)
+
+    def add_poll(self, poll):
+        self.polls += 1
+        try:
+            self.poll_votes += int(poll.get('Votes', 0))
+        except ValueError:
+            pass
+        question = poll.get('Question', '')
+        results = self.poll_results.setdefault(question, Counter())
+        for answer, result in zip(poll.get('Answers', []), poll.get('Results', [])):
+            try:
+                results[answer] += int(result)
+            except ValueError:
+                continue
+
+    def add_services(self, services):
+        """ Accumulate already parsed services (e.g. loaded from JSON or XML). """
+        for service in services:
+            for user_id, user in service.get('Users', {}).items():
+                self.add_user(service, user_id, user)
+            for thread in service.get('MessageThreads', []):
+                for message in thread.get('Messages', []):
+                    self.add_post(service, thread, message)
+                self.add_thread(service, thread)
+            self.add_service(service)
+        return self
+
+    def merge(self, other):
+        """ Add the counts of another ArchiveStats into this one. """
+        self.services += other.services
+        self.users += other.users
+        self.threads += other.threads
+        self.posts += other.posts
+        self.polls += other.polls
+        self.poll_votes += other.poll_votes
+        self.posts_per_user.update(other.posts_per_user)
+        self.posts_per_service.update(other.posts_per_service)
+        self.posts_per_category.update(other.posts_per_category)
+        self.posts_per_forum.update(other.posts_per_forum)
+        self.posts_per_day.update(other.posts_per_day)
+        self.threads_per_category.update(other.threads_per_category)
+        self.threads_per_forum.update(other.threads_per_forum)
+        self.reply_depths.update(other.reply_depths)
+        for question, results in other.poll_results.items():
+            self.poll_results.setdefault(question, Counter()).update(results)
+        return self
+
+    def to_dict(self):
+        return {
+            'Services': self.services,
+            'Users': self.users,
+            'Threads': self.threads,
+            'Posts': self.posts,
+            'Polls': self.polls,
+            'PollVotes': self.poll_votes,
+            'PostsPerUser': dict(self.posts_per_user),
+            'PostsPerService': dict(self.posts_per_service),
+            'PostsPerCategory': dict(self.posts_per_category),
+            'PostsPerForum': dict(self.posts_per_forum),
+            'PostsPerDay': dict(sorted(self.posts_per_day.items())),
+            'ThreadsPerCategory': dict(self.threads_per_category),
+            'ThreadsPerForum': dict(self.threads_per_forum),
+            'ReplyDepths': dict((str(depth), count) for depth, count in sorted(self.reply_depths.items())),
+            'PollResults': dict((question, dict(results)) for question, results in self.poll_results.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Rebuild an ArchiveStats from to_dict() output, e.g. a shard's saved report. """
+        stats = cls()
+        stats.services = data.get('Services', 0)
+        stats.users = data.get('Users', 0)
+        stats.threads = data.get('Threads', 0)
+        stats.posts = data.get('Posts', 0)
+        stats.polls = data.get('Polls', 0)
+        stats.poll_votes = data.get('PollVotes', 0)
+        stats.posts_per_user.update(data.get('PostsPerUser', {}))
+        stats.posts_per_service.update(data.get('PostsPerService', {}))
+        stats.posts_per_category.update(data.get('PostsPerCategory', {}))
+        stats.posts_per_forum.update(data.get('PostsPerForum', {}))
+        stats.posts_per_day.update(data.get('PostsPerDay', {}))
+        stats.threads_per_category.update(data.get('ThreadsPerCategory', {}))
+        stats.threads_per_forum.update(data.get('ThreadsPerForum', {}))
+        stats.reply_depths.update(dict((int(depth), count) for depth, count in data.get('ReplyDepths', {}).items()))
+        for question, results in data.get('PollResults', {}).items():
+            stats.poll_results[question] = Counter(results)
+        return stats
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent)
+
+def services_stats(services):
+    """ Compute ArchiveStats for an already parsed services structure. """
+    return ArchiveStats().add_services(services)
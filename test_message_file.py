@@ -0,0 +1,768 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import glob
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from lint_message_file import lint_file
+from parse_message_file import parse_file, parse_lines, iter_parse_file, stream_services
+from render_message_file import display_services, DisplayServicesWriter
+from validate_message_file import validate_lines
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+LINE_ENDINGS = {'lf': b"\n", 'cr': b"\r", 'crlf': b"\r\n"}
+
+def sample_files():
+    return sorted(glob.glob(os.path.join(DATA_DIR, "archive_*.txt")))
+
+def sample_lines(name='archive_msgboard_lf.txt'):
+    with open(os.path.join(DATA_DIR, name), 'rb') as file:
+        return file.read().splitlines()
+
+class TempDirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, lines, line_ending=b"\n"):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'wb') as file:
+            file.write(line_ending.join(lines) + line_ending)
+        return filename
+
+def _lint_results(filename, **options):
+    return [(error.line_number, error.message) for error in lint_file(filename, **options)]
+
+class LintShardTest(TempDirTestCase):
+    """ Sharded lint runs must report exactly what one serial pass does. """
+
+    def assertShardsAgree(self, filename):
+        serial = _lint_results(filename)
+        for shard_size in (1, 7, 64, 1000):
+            self.assertEqual(_lint_results(filename, shard_size=shard_size), serial, "shard_size={0}".format(shard_size))
+            self.assertEqual(_lint_results(filename, workers=2, shard_size=shard_size), serial, "workers=2, shard_size={0}".format(shard_size))
+        return serial
+
+    def broken_variants(self):
+        lines = sample_lines()
+        end_body = lines.index(b"--- End Message Body ---")
+        end_thread = lines.index(b"--- End Message Thread ---")
+        start_list = lines.index(b"--- Start Message List ---")
+        yield 'missing_end_body', lines[:end_body] + lines[end_body + 1:]
+        yield 'missing_end_thread', lines[:end_thread] + lines[end_thread + 1:]
+        yield 'stray_end', lines[:start_list] + [b"--- End Message Post ---"] + lines[start_list:]
+        yield 'unknown', lines[:start_list] + [b"--- Start Nothing ---"] + lines[start_list:]
+        yield 'misplaced_post', [b"--- Start Message Post ---", b"--- End Message Post ---"] + lines
+
+    def test_samples(self):
+        for filename in sample_files():
+            self.assertEqual(self.assertShardsAgree(filename), [], filename)
+
+    def test_broken_line_endings(self):
+        for name, lines in self.broken_variants():
+            for ending, line_ending in LINE_ENDINGS.items():
+                filename = self.write("{0}_{1}.txt".format(name, ending), lines, line_ending)
+                self.assertNotEqual(self.assertShardsAgree(filename), [], filename)
+
+    def test_shards_starting_inside_comment(self):
+        # Markers inside a comment are ignored, however the shards cut it
+        lines = sample_lines()
+        comment = [b"--- Start Comment Section ---"]
+        comment.extend([b"--- End Message Thread ---", b"--- Start Message Post ---", b"text"] * 50)
+        comment.append(b"--- End Comment Section ---")
+        start_list = lines.index(b"--- Start Message List ---")
+        for ending, line_ending in LINE_ENDINGS.items():
+            filename = self.write("comment_{0}.txt".format(ending), lines[:start_list] + comment + lines[start_list:], line_ending)
+            self.assertEqual(self.assertShardsAgree(filename), [], filename)
+            broken = lines[:start_list] + comment + [b"--- End Message List ---"] + lines[start_list:]
+            filename = self.write("comment_broken_{0}.txt".format(ending), broken, line_ending)
+            self.assertNotEqual(self.assertShardsAgree(filename), [], filename)
+
+class UnclosedBodyTest(unittest.TestCase):
+    def test_post_inside_open_message_body(self):
+        lines = [line.decode('utf-8') for line in sample_lines()]
+        end_body = lines.index("--- End Message Body ---")
+        start_body = max(number for number in range(end_body) if lines[number] == "--- Start Message Body ---")
+        with self.assertRaises(ValueError) as raised:
+            parse_lines(lines[:end_body] + lines[end_body + 1:])
+        self.assertIn("Message Body opened on line {0}".format(start_body + 1), str(raised.exception))
+
+class ValidateAgreesWithParserTest(TempDirTestCase):
+    """ validate_only and a full parse give the same verdict. """
+
+    def verdicts(self, filename):
+        try:
+            parse_file(filename)
+            parsed = True
+        except ValueError:
+            parsed = False
+        return parse_file(filename, validate_only=True)[0], parsed
+
+    def test_samples_are_valid(self):
+        for filename in sample_files():
+            self.assertEqual(self.verdicts(filename), (True, True), filename)
+
+    def test_unclosed_message_body(self):
+        lines = sample_lines()
+        end_body = lines.index(b"--- End Message Body ---")
+        for ending, line_ending in LINE_ENDINGS.items():
+            filename = self.write("unclosed_{0}.txt".format(ending), lines[:end_body] + lines[end_body + 1:], line_ending)
+            self.assertEqual(self.verdicts(filename), (False, False), filename)
+            text = [line.decode('utf-8') for line in lines[:end_body] + lines[end_body + 1:]]
+            self.assertNotEqual(validate_lines(text), [])
+
+    def test_parser_edge_cases(self):
+        lines = sample_lines()
+        start_list = lines.index(b"--- Start Message List ---")
+        start_body = lines.index(b"--- Start Message Body ---")
+        kind = next(number for number, line in enumerate(lines) if line.startswith(b"Kind:"))
+        cases = {
+            'unknown_section': (lines[:start_list] + [b"--- Start Nothing ---", b"--- End Nothing ---"] + lines[start_list:], True),
+            'post_key_in_body': (lines[:start_body + 1] + [b"Post: 1"] + lines[start_body + 1:], True),
+            'nested_key_in_body': (lines[:start_body + 1] + [b"Nested: 99"] + lines[start_body + 1:], False),
+            'bad_category_type': (lines[:kind] + [b"Kind: Bogus, Main Category"] + lines[kind + 1:], False),
+        }
+        for name, (case, valid) in cases.items():
+            for ending, line_ending in LINE_ENDINGS.items():
+                filename = self.write("{0}_{1}.txt".format(name, ending), case, line_ending)
+                self.assertEqual(self.verdicts(filename), (valid, valid), filename)
+
+    def test_every_error_is_reported(self):
+        from validate_message_file import validate_file
+        lines = sample_lines()
+        end_thread = lines.index(b"--- End Message Thread ---")
+        end_list = lines.index(b"--- End Message List ---")
+        broken = lines[:end_thread] + lines[end_thread + 1:end_list - 1] + [b"--- Start Nothing ---"] + lines[end_list - 1:]
+        reports = []
+        for ending, line_ending in LINE_ENDINGS.items():
+            filename = self.write("two_errors_{0}.txt".format(ending), broken, line_ending)
+            errors = [(error.line_number, error.message) for error in validate_file(filename)]
+            # Both the unclosed thread and the unknown section, wherever the first one stops
+            numbers = [error[0] for error in errors]
+            self.assertIn(broken.index(b"--- Start Message Thread ---") + 1, numbers)
+            self.assertIn(broken.index(b"--- Start Nothing ---") + 1, numbers)
+            self.assertEqual([(error.line_number, error.message) for error in validate_file(filename, max_errors=1)], errors[:1])
+            reports.append(errors)
+        self.assertEqual(reports[1:], reports[:1] * (len(reports) - 1))
+
+class DisplayPagingTest(unittest.TestCase):
+    def render(self, filename, offset, limit):
+        output = io.StringIO()
+        display_services(parse_file(filename), output, limit=limit, offset=offset)
+        streamed = io.StringIO()
+        stream_services(iter_parse_file(filename), DisplayServicesWriter(streamed, offset=offset), offset=offset, limit=limit)
+        self.assertEqual(output.getvalue(), streamed.getvalue())
+        return output.getvalue()
+
+    def test_only_services_in_page_are_rendered(self):
+        filename = os.path.join(DATA_DIR, "archive_msgboard_multi_lf.txt")
+        services = parse_file(filename)
+        entries = [service['Entry'] for service in services for thread in service['MessageThreads']]
+        for offset in range(len(entries) + 1):
+            for limit in (None, 1, 2):
+                page = entries[offset:None if limit is None else offset + limit]
+                expected = [entry for number, entry in enumerate(page) if entry not in page[:number]]
+                rendered = [int(line.split(": ")[1]) for line in self.render(filename, offset, limit).splitlines() if line.startswith("Service Entry:")]
+                self.assertEqual(rendered, expected, (offset, limit))
+
+    def test_unpaged_output_lists_every_service(self):
+        filename = os.path.join(DATA_DIR, "archive_msgboard_multi_lf.txt")
+        rendered = self.render(filename, 0, None)
+        self.assertEqual(rendered.count("Service Entry:"), len(parse_file(filename)))
+
+class SQLiteRoundTripTest(TempDirTestCase):
+    def test_from_sqlite_matches_parse_file(self):
+        from sqlite_message_file import to_sqlite, from_sqlite
+        for number, filename in enumerate(sample_files()):
+            services = parse_file(filename)
+            database = os.path.join(self.directory, "{0}.db".format(number))
+            to_sqlite(services, database)
+            self.assertEqual(from_sqlite(database), services, filename)
+
+class SidecarIndexTest(TempDirTestCase):
+    def test_lookups_do_not_write_a_sidecar(self):
+        from index_message_file import index_filename, load_archive_index, open_thread, open_post
+        filename = os.path.join(self.directory, "archive.txt")
+        shutil.copy(os.path.join(DATA_DIR, "archive_msgboard_lf.txt"), filename)
+        threads = parse_file(filename)[0]['MessageThreads']
+        self.assertEqual(open_thread(filename, 1, 2), threads[1])
+        self.assertEqual(open_post(filename, 1, 2, 1), threads[1]['Messages'][0])
+        self.assertFalse(os.path.exists(index_filename(filename)))
+        load_archive_index(filename, build=True)
+        self.assertTrue(os.path.exists(index_filename(filename)))
+        self.assertEqual(open_thread(filename, 1, 1), threads[0])
+
+    def test_included_threads_can_be_opened(self):
+        from bench_message_file import write_archive
+        from index_message_file import ArchiveIndex, build_archive_index, index_filename, open_thread, open_post
+        for suffix in ("", ".gz"):
+            filename = os.path.join(self.directory, "bench.txt{0}".format(suffix))
+            write_archive(filename, "crlf", include_fanout=2, services=2, threads=3, posts=4)
+            services, index = build_archive_index(filename)
+            self.assertEqual(ArchiveIndex.load(index_filename(filename)).threads, index.threads)
+            for service in services:
+                # Three own threads, then three from each include file
+                self.assertEqual(len(service['MessageThreads']), 9)
+                for thread in service['MessageThreads']:
+                    self.assertEqual(open_thread(filename, service['Entry'], thread['Thread'], index), thread)
+                    last = thread['Messages'][-1]
+                    self.assertEqual(open_post(filename, service['Entry'], thread['Thread'], last['Post'], index), last)
+            # Rewriting an include file makes the sidecar stale
+            self.assertTrue(index.matches(filename))
+            include_file = sorted(index.includes)[0]
+            os.utime(include_file, (0, 0))
+            self.assertFalse(index.matches(filename))
+
+class TableExportTest(TempDirTestCase):
+    def test_posts_table_matches_parse(self):
+        import csv
+        from csv_message_file import export_tables, export_archive_tables, table_filename
+        for filename in sample_files():
+            services = parse_file(filename)
+            prefix = os.path.join(self.directory, "streamed")
+            rows = export_archive_tables(filename, prefix)
+            self.assertEqual(export_tables(services, os.path.join(self.directory, "parsed")), rows, filename)
+            with io.open(table_filename(prefix, 'posts'), 'r', encoding='utf-8', newline='') as file:
+                posts = [(row['entry'], row['thread'], row['post'], row['message']) for row in csv.DictReader(file)]
+            expected = [("{0}".format(service['Entry']), "{0}".format(thread['Thread']), "{0}".format(message['Post']), message['Message'])
+                        for service in services for thread in service['MessageThreads'] for message in thread['Messages']]
+            self.assertEqual(posts, expected, filename)
+            self.assertEqual(rows['posts'], len(expected), filename)
+
+class DiffTest(unittest.TestCase):
+    def test_line_endings_make_no_difference(self):
+        from diff_message_file import diff_files
+        for name in ('msgboard', 'msgboard_multi', 'xtwitter'):
+            files = [os.path.join(DATA_DIR, "archive_{0}_{1}.txt".format(name, ending)) for ending in sorted(LINE_ENDINGS)]
+            self.assertEqual(diff_files(files[0], files[1]), [], name)
+            self.assertEqual(diff_files(files[0], files[2], workers=2), [], name)
+
+    def test_edits_are_reported(self):
+        import copy
+        from diff_message_file import diff_services, format_change
+        old = parse_file(os.path.join(DATA_DIR, "archive_msgboard_lf.txt"))
+        new = copy.deepcopy(old)
+        new[0]['MessageThreads'][1]['Title'] = "Renamed"
+        new[0]['MessageThreads'][0]['Messages'][0]['Message'] = "Edited"
+        del new[0]['MessageThreads'][1]['Messages'][-1]
+        last = old[0]['MessageThreads'][1]['Messages'][-1]['Post']
+        self.assertEqual(sorted(format_change(change) for change in diff_services(old, new)),
+                         ["- post 1/2/{0}".format(last), "~ post 1/1/1", "~ thread 1/2 (Title)"])
+
+class MergeTest(unittest.TestCase):
+    def test_merging_copies_drops_every_duplicate(self):
+        from merge_message_file import iter_merge_events
+        # The xtwitter samples are not in first post order, which merging expects
+        for name in ('chatgpt', 'msgboard', 'msgboard_alt', 'msgboard_multi'):
+            files = [os.path.join(DATA_DIR, "archive_{0}_{1}.txt".format(name, ending)) for ending in sorted(LINE_ENDINGS)]
+            expected = parse_file(files[0])
+            stats = {}
+            merged = []
+            for event, service, thread in iter_merge_events([iter_parse_file(filename) for filename in files], stats):
+                if event == 'thread':
+                    service['MessageThreads'].append(thread)
+                elif event == 'service':
+                    merged.append(service)
+            self.assertEqual(merged, expected, name)
+            threads = [thread for service in expected for thread in service['MessageThreads']]
+            self.assertEqual(stats, {'duplicate_threads': 2 * len(threads), 'out_of_order': 0,
+                                     'duplicate_posts': 2 * sum(len(thread['Messages']) for thread in threads)}, name)
+
+class SnapshotTest(TempDirTestCase):
+    def test_snapshot_round_trip(self):
+        from bodies_message_file import to_snapshot, from_snapshot, save_snapshot_file
+        from convert_message_file import load_from_json_file
+        for number, filename in enumerate(sample_files()):
+            services = parse_file(filename)
+            self.assertEqual(from_snapshot(to_snapshot(services)), services, filename)
+            snapshot = os.path.join(self.directory, "{0}.json".format(number))
+            save_snapshot_file(services, snapshot)
+            loaded = load_from_json_file(snapshot)
+            self.assertEqual([thread for service in loaded for thread in service['MessageThreads']],
+                             [thread for service in services for thread in service['MessageThreads']], filename)
+
+    def test_repeated_bodies_are_stored_once(self):
+        from bodies_message_file import to_snapshot
+        services = parse_file(os.path.join(DATA_DIR, "archive_msgboard_lf.txt"))
+        messages = services[0]['MessageThreads'][0]['Messages']
+        for message in messages:
+            message['Message'] = "Same body"
+        snapshot = to_snapshot(services)
+        self.assertEqual(list(snapshot['Bodies'].values()).count("Same body"), 1)
+
+class LazyBodiesTest(TempDirTestCase):
+    def test_lazy_parse_matches_parse(self):
+        from lazy_message_file import parse_file_lazy, LazyBody
+        for filename in sample_files():
+            services = parse_file_lazy(filename)
+            self.assertEqual(services, parse_file(filename), filename)
+            messages = [message['Message'] for service in services for thread in service['MessageThreads'] for message in thread['Messages']]
+            self.assertTrue(all(isinstance(message, LazyBody) for message in messages), filename)
+
+    def test_errors_report_file_line_numbers(self):
+        from lazy_message_file import parse_file_lazy
+        lines = sample_lines()
+        # Leave the last message body open, after the others were skipped
+        end_body = len(lines) - 1 - lines[::-1].index(b"--- End Message Body ---")
+        for ending, line_ending in LINE_ENDINGS.items():
+            filename = self.write("unclosed_{0}.txt".format(ending), lines[:end_body] + lines[end_body + 1:], line_ending)
+            with self.assertRaises(ValueError) as eager:
+                parse_file(filename)
+            with self.assertRaises(ValueError) as lazy:
+                parse_file_lazy(filename)
+            self.assertEqual(str(lazy.exception), str(eager.exception), filename)
+
+def _attached_services(name):
+    from shared_message_file import attach_archive
+    archive = attach_archive(name)
+    try:
+        return archive.to_services()
+    finally:
+        archive.close()
+
+class SharedArchiveTest(unittest.TestCase):
+    def setUp(self):
+        from shared_message_file import shared_memory
+        if shared_memory is None:
+            self.skipTest("multiprocessing.shared_memory is not available")
+
+    def expected(self, filename):
+        services = parse_file(filename)
+        for service in services:
+            for thread in service['MessageThreads']:
+                thread.pop('post_ids', None)
+        return services
+
+    def test_published_file_matches_parse(self):
+        from shared_message_file import publish_file, publish_services
+        for filename in sample_files():
+            expected = self.expected(filename)
+            with publish_file(filename) as archive:
+                self.assertEqual(archive.to_services(), expected, filename)
+                self.assertEqual(_attached_services(archive.name), expected, filename)
+            with publish_services(parse_file(filename)) as archive:
+                self.assertEqual(archive.to_services(), expected, filename)
+
+    def test_worker_process_reads_archive(self):
+        from concurrent.futures import ProcessPoolExecutor
+        from shared_message_file import publish_file
+        filename = os.path.join(DATA_DIR, "archive_msgboard_multi_lf.txt")
+        with publish_file(filename) as archive:
+            with ProcessPoolExecutor(1) as executor:
+                self.assertEqual(executor.submit(_attached_services, archive.name).result(), self.expected(filename))
+
+class MemoryBudgetTest(unittest.TestCase):
+    def test_spilled_parse_matches_parse(self):
+        from convert_message_file import to_json
+        for filename in sample_files():
+            expected = parse_file(filename)
+            for memory_budget in (0, 4096, 1 << 30):
+                services = parse_file(filename, memory_budget=memory_budget)
+                self.assertEqual([list(service['MessageThreads']) for service in services],
+                                 [service['MessageThreads'] for service in expected], (filename, memory_budget))
+                self.assertEqual(to_json(services), to_json(expected), (filename, memory_budget))
+                spilled = sum(service['MessageThreads'].spilled() for service in services)
+                self.assertEqual(spilled == 0, memory_budget == 1 << 30, (filename, memory_budget))
+
+    def test_edits_of_a_budgeted_parse_are_kept(self):
+        from parse_message_file import add_message_post, add_poll, remove_message_post
+        filename = os.path.join(DATA_DIR, "archive_msgboard_lf.txt")
+        results = []
+        for memory_budget in (None, 0):
+            services = parse_file(filename, memory_budget=memory_budget)
+            service = services[0]
+            add_message_post(service, 1, "@johndoe", "9:30 AM", "Jan 2, 2020", "Reply", 3, 1, "Thanks!")
+            add_poll(service, 1, 3, 1, "Tea?", ["Yes", "No"], ["1", "0"], ["100.0", "0.0"], "1")
+            remove_message_post(service, 2, 3)
+            results.append([list(service['MessageThreads']) for service in services])
+        self.assertEqual(len(results[1][0][0]['Messages']), 3)
+        self.assertEqual(results[1][0][0]['Messages'][-1]['Polls'][0]['Question'], "Tea?")
+        self.assertEqual(results[1], results[0])
+
+    def test_spilled_threads_behave_as_a_list(self):
+        services = parse_file(os.path.join(DATA_DIR, "archive_msgboard_multi_lf.txt"), memory_budget=0)
+        threads = services[-1]['MessageThreads']
+        expected = list(threads)
+        thread = threads[0]
+        thread['Title'] = "Changed"
+        self.assertNotEqual(threads[0]['Title'], "Changed")
+        threads[0] = thread
+        expected[0] = thread
+        threads.insert(1, expected[1])
+        expected.insert(1, expected[1])
+        del threads[-1]
+        del expected[-1]
+        self.assertEqual(list(threads), expected)
+        self.assertEqual(threads[::-1], expected[::-1])
+
+class CategoryIndexTest(unittest.TestCase):
+    def brute_force(self, service, category_id, category_type):
+        """ Thread numbers under category_id, found by walking every thread's InSub chain. """
+        parents = dict((category['ID'], category.get('InSub', 0)) for category in service['Categories'] if category['Type'] == category_type)
+        key = 'Category' if category_type == 'Categories' else 'Forum'
+        found = []
+        for number, thread in enumerate(service['MessageThreads']):
+            for headline in thread.get(key) or ():
+                for category in service['Categories']:
+                    if category['Type'] != category_type or category.get('Headline') != headline.strip():
+                        continue
+                    chain = [category['ID']]
+                    while parents.get(chain[-1], 0) in parents and parents[chain[-1]] not in chain:
+                        chain.append(parents[chain[-1]])
+                    if category_id in chain and number not in found:
+                        found.append(number)
+        return sorted(found)
+
+    def assertIndexAgrees(self, service, index):
+        for category in service['Categories']:
+            category_type = category['Type']
+            self.assertEqual(index.threads_under(category['ID'], category_type), self.brute_force(service, category['ID'], category_type))
+
+    def test_samples(self):
+        from category_message_file import index_services, index_file
+        for filename in sample_files():
+            services = parse_file(filename)
+            for service, index in zip(services, index_services(services)):
+                self.assertIndexAgrees(service, index)
+            # Built while streaming, without the threads
+            for service, index in zip(services, index_file(filename)[1]):
+                self.assertIndexAgrees(service, index)
+
+    def test_deep_hierarchy(self):
+        from category_message_file import CategoryIndex
+        categories = [{'ID': number, 'InSub': number // 3, 'Type': 'Categories', 'Headline': "Category {0}".format(number)}
+                      for number in range(1, 60)]
+        threads = [{'Thread': number, 'Category': ["Category {0}".format(number % 59 + 1), "Category {0}".format(number * 7 % 59 + 1)]}
+                   for number in range(200)]
+        service = {'Categories': categories, 'MessageThreads': threads}
+        index = CategoryIndex(service)
+        self.assertIndexAgrees(service, index)
+        self.assertEqual(index.tree().ancestors(40), [13, 4, 1])
+        self.assertTrue(index.tree().is_ancestor(1, 40))
+        self.assertFalse(index.tree().is_ancestor(2, 40))
+
+class PrefixIndexTest(unittest.TestCase):
+    def brute_force(self, services, prefix, field):
+        from prefix_message_file import normalize
+        found = []
+        for service in services:
+            entry = service.get('Entry')
+            if field in ('Handle', 'Name'):
+                items = [((entry, user_id), user.get(field)) for user_id, user in service['Users'].items()]
+            elif field == 'Headline':
+                items = [((entry, category['Type'], category['ID']), category.get('Headline')) for category in service['Categories']]
+            else:
+                items = [((entry, thread['Thread']), thread.get('Title')) for thread in service['MessageThreads']]
+            for ref, text in items:
+                words = [normalize(text)] + [normalize(word) for word in re.split(r"[\s_.,/@#-]+", text or "") if word]
+                if text and any(word.startswith(normalize(prefix)) for word in words):
+                    found.append((text, ref))
+        return sorted(found)
+
+    def assertCompletes(self, index, services, prefixes):
+        for field in ('Handle', 'Name', 'Headline', 'Title'):
+            for prefix in prefixes:
+                self.assertEqual(sorted(index.complete(prefix, field, limit=1000)), self.brute_force(services, prefix, field), (field, prefix))
+
+    def test_samples(self):
+        from prefix_message_file import PrefixIndex
+        for filename in sample_files():
+            services = parse_file(filename)
+            self.assertCompletes(PrefixIndex(services), services, ("", "a", "Ch", "gen", "the", "s", "zz"))
+
+    def test_index_follows_edits(self):
+        from parse_message_file import add_user, remove_user, add_category, remove_category, add_message_thread, remove_message_thread
+        from prefix_message_file import PrefixIndex
+        services = parse_file(os.path.join(DATA_DIR, "archive_msgboard_lf.txt"))
+        service = services[0]
+        index = PrefixIndex(services)
+        add_user(service, 99, "Zed Zebra", "zebra99", prefix_index=index)
+        add_category(service, "Categories", "Categories", "Main Category", 99, 0, "Zoology", "", prefix_index=index)
+        add_message_thread(service, 99, title="Zebra crossings", prefix_index=index)
+        self.assertCompletes(index, services, ("z", "zeb", "cross"))
+        remove_user(service, 99, prefix_index=index)
+        remove_category(service, 99, prefix_index=index)
+        remove_message_thread(service, 99, prefix_index=index)
+        self.assertCompletes(index, services, ("z", "zeb", "cross"))
+        self.assertEqual(index.complete_users("z"), [])
+
+class StatsTest(unittest.TestCase):
+    def test_parser_stats_match_services_stats(self):
+        from stats_message_file import ArchiveStats, services_stats
+        merged = ArchiveStats()
+        everything = []
+        for filename in sample_files():
+            stats = ArchiveStats()
+            services = parse_file(filename, stats=stats)
+            self.assertEqual(stats.to_dict(), services_stats(services).to_dict(), filename)
+            self.assertEqual(ArchiveStats.from_dict(json.loads(stats.to_json())).to_dict(), stats.to_dict(), filename)
+            merged.merge(stats)
+            everything.extend(services)
+        self.assertEqual(merged.to_dict(), services_stats(everything).to_dict())
+
+class PollTableTest(unittest.TestCase):
+    def polls(self):
+        services = parse_file(os.path.join(DATA_DIR, "archive_msgboard_multi_lf.txt"))
+        services[0]['MessageThreads'][0]['Messages'][0].setdefault('Polls', []).extend([
+            {'Num': 7, 'Question': "Tea?", 'Answers': ["Yes", "No"], 'Results': ["3", "1"], 'Percentage': ["75.0", "25.0"], 'Votes': "4"},
+            {'Num': 8, 'Question': "Tea?", 'Answers': ["Yes", "No"], 'Results': ["1", "1"], 'Percentage': ["60.0", "40.0"], 'Votes': "2"},
+            {'Num': 9, 'Question': "Short", 'Answers': ["A", "B", "C"], 'Results': ["1"], 'Percentage': [], 'Votes': "1"},
+            {'Num': 10, 'Question': "Empty", 'Answers': [], 'Results': [], 'Percentage': [], 'Votes': "0"},
+        ])
+        return services
+
+    def summary(self, table):
+        return (table.validate(), table.aggregate(), table.aggregate('question'), table.total_votes(),
+                [round(percentage, 2) for percentage in table.recompute_percentages()], table.to_polls(use_recomputed=True))
+
+    def test_backends_agree(self):
+        from poll_message_file import PollTable, numpy
+        services = self.polls()
+        python = PollTable.from_services(services, use_numpy=False)
+        self.assertEqual(len(python), 5)
+        self.assertEqual([python.keys[poll][3] for poll in python.validate()], [8, 9])
+        self.assertEqual(python.aggregate('question')["Tea?"], 6)
+        if numpy is None:
+            self.skipTest("numpy is not installed")
+        self.assertEqual(self.summary(PollTable.from_services(services, use_numpy=True)), self.summary(python))
+
+class StreamingConvertTest(unittest.TestCase):
+    def streamed(self, filename, writer_class, *args):
+        output = io.StringIO()
+        stream_services(iter_parse_file(filename), writer_class(output, *args))
+        return output.getvalue()
+
+    def test_streamed_output_matches_converters(self):
+        from convert_message_file import (
+            JSONServicesWriter, XMLServicesWriter, TextServicesWriter, to_json, to_xml, from_xml, services_to_string
+        )
+        for filename in sample_files():
+            services = parse_file(filename)
+            self.assertEqual(json.loads(self.streamed(filename, JSONServicesWriter)), json.loads(to_json(services)), filename)
+            self.assertEqual(from_xml(self.streamed(filename, XMLServicesWriter)), from_xml(to_xml(services)), filename)
+            for line_ending in ("lf", "crlf"):
+                text = self.streamed(filename, TextServicesWriter, line_ending)
+                self.assertEqual(text, services_to_string(services, line_ending), filename)
+            self.assertEqual(parse_lines(text.splitlines()), services, filename)
+
+class CodecTest(TempDirTestCase):
+    def text(self):
+        with io.open(os.path.join(DATA_DIR, "archive_xtwitter_lf.txt"), 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def test_block_parallel_writers_round_trip(self):
+        from codec_message_file import CODECS, save_compressed_file, open_compressed_file
+        text = self.text()
+        for codec in CODECS.values():
+            for suffix in codec.suffixes[:1]:
+                for threads, chunk_size in ((1, None), (4, 4096)):
+                    filename = os.path.join(self.directory, "archive{0}-{1}.txt{2}".format(threads, codec.name, suffix))
+                    save_compressed_file(text, filename, level=1, threads=threads, chunk_size=chunk_size)
+                    with open_compressed_file(filename) as file:
+                        self.assertEqual(file.read(), text, (codec.name, threads))
+
+    def test_misnamed_files_open_by_magic(self):
+        from codec_message_file import CODECS, save_compressed_file, sniff_codec
+        filename = os.path.join(DATA_DIR, "archive_msgboard_crlf.txt")
+        with io.open(filename, 'r', encoding='utf-8') as file:
+            text = file.read()
+        expected = parse_file(filename)
+        for codec in CODECS.values():
+            if not codec.suffixes:
+                continue
+            compressed = os.path.join(self.directory, "archive.txt{0}".format(codec.suffixes[0]))
+            save_compressed_file(text, compressed)
+            misnamed = os.path.join(self.directory, "archive-{0}.txt".format(codec.name))
+            os.rename(compressed, misnamed)
+            self.assertIs(sniff_codec(misnamed), codec)
+            self.assertEqual(parse_file(misnamed), expected, codec.name)
+
+    def test_text_starting_like_zlib_is_plain(self):
+        from codec_message_file import sniff_codec
+        archive = b"\n".join(sample_lines()) + b"\n"
+        # Every printable second byte that makes 'x?' a valid zlib header checksum
+        for second in range(32, 127):
+            if (0x78 * 256 + second) % 31:
+                continue
+            filename = self.write("x_{0}.txt".format(second), [b"x" + bytearray([second]) + b" marks the spot", archive])
+            self.assertEqual(sniff_codec(filename).name, 'none', filename)
+            self.assertEqual(parse_file(filename), parse_file(os.path.join(DATA_DIR, "archive_msgboard_lf.txt")))
+
+    def test_seekable_container_random_reads(self):
+        from codec_message_file import save_compressed_file, open_compressed_reader
+        from index_message_file import open_thread
+        source = os.path.join(DATA_DIR, "archive_xtwitter_lf.txt")
+        with io.open(source, 'rb') as file:
+            data = file.read()
+        filename = os.path.join(self.directory, "archive.txt.lsz")
+        save_compressed_file(data.decode('utf-8'), filename, threads=2, chunk_size=2048)
+        with open_compressed_reader(filename) as reader:
+            self.assertEqual(reader.read(), data)
+            for offset in (0, 1, 2047, 2048, 5000, len(data) - 10, len(data)):
+                reader.seek(offset)
+                self.assertEqual(reader.read(300), data[offset:offset + 300], offset)
+        threads = parse_file(source)[0]['MessageThreads']
+        for number in (0, len(threads) // 2, len(threads) - 1):
+            self.assertEqual(open_thread(filename, 1, threads[number]['Thread']), threads[number])
+
+    def test_damaged_seekable_container(self):
+        from codec_message_file import save_compressed_file, open_compressed_reader, SEEKABLE_MAGIC
+        filename = os.path.join(self.directory, "archive.txt.lsz")
+        save_compressed_file("\n".join(line.decode('utf-8') for line in sample_lines()), filename)
+        with io.open(filename, 'rb') as file:
+            data = file.read()
+        for name, damaged in (('empty', b""), ('magic', SEEKABLE_MAGIC), ('truncated', data[:-5]), ('short', data[:len(data) // 2])):
+            broken = os.path.join(self.directory, "{0}.txt.lsz".format(name))
+            with io.open(broken, 'wb') as file:
+                file.write(damaged)
+            with self.assertRaises(ValueError, msg=name):
+                open_compressed_reader(broken).read()
+
+    def test_seekable_blocks_keep_crlf_together(self):
+        from codec_message_file import save_compressed_file, open_compressed_reader
+        # 11 byte lines: with chunk_size 98 the last line end before the
+        # limit is a CR whose LF is the first byte past it
+        data = b"aaaaaaaaa\r\n" * 100
+        filename = os.path.join(self.directory, "crlf.txt.lsz")
+        save_compressed_file(data.decode('utf-8'), filename, chunk_size=98)
+        with open_compressed_reader(filename) as reader:
+            offsets = reader.raw.offsets
+            self.assertEqual(reader.read(), data)
+        self.assertGreater(len(offsets), 1)
+        for offset in offsets[1:]:
+            self.assertNotEqual(data[offset - 1:offset + 1], b"\r\n", offset)
+
+class AsyncIngestTest(TempDirTestCase):
+    def test_ingest_reports_each_file(self):
+        import asyncio
+        from async_message_file import AsyncIngestor
+        lines = sample_lines()
+        end_body = lines.index(b"--- End Message Body ---")
+        broken = self.write("broken.txt", lines[:end_body] + lines[end_body + 1:])
+        filenames = sample_files() + [broken]
+
+        async def ingest():
+            async with AsyncIngestor(max_workers=2) as ingestor:
+                return dict([(filename, result) async for filename, result in ingestor.ingest(iter(filenames))])
+
+        results = asyncio.run(ingest())
+        self.assertEqual(sorted(results), sorted(filenames))
+        self.assertIsInstance(results.pop(broken), ValueError)
+        for filename, services in results.items():
+            self.assertEqual(services, parse_file(filename), filename)
+
+    def test_streamed_threads_and_early_exit(self):
+        import asyncio
+        from async_message_file import iter_threads_async
+        filename = os.path.join(DATA_DIR, "archive_xtwitter_lf.txt")
+
+        async def threads(limit):
+            found = []
+            events = iter_threads_async(filename)
+            try:
+                async for service, thread in events:
+                    found.append(thread['Thread'])
+                    if len(found) == limit:
+                        break
+            finally:
+                await events.aclose()
+            return found
+
+        expected = [thread['Thread'] for service in parse_file(filename) for thread in service['MessageThreads']]
+        self.assertEqual(asyncio.run(threads(None)), expected)
+        self.assertEqual(asyncio.run(threads(3)), expected[:3])
+
+class BatchConvertTest(TempDirTestCase):
+    def test_batch_convert(self):
+        from batch_message_file import batch_convert, load_services
+        from convert_message_file import from_json, to_json
+        inputs = os.path.join(self.directory, "inputs")
+        os.mkdir(inputs)
+        for filename in sample_files():
+            shutil.copy(filename, inputs)
+        lines = sample_lines()
+        end_body = lines.index(b"--- End Message Body ---")
+        with open(os.path.join(inputs, "broken.txt"), 'wb') as file:
+            file.write(b"\n".join(lines[:end_body] + lines[end_body + 1:]) + b"\n")
+        output = os.path.join(self.directory, "output")
+        records = batch_convert([inputs], 'json', output_dir=output, workers=2)
+        statuses = dict((os.path.basename(record['Source']), record['Status']) for record in records)
+        self.assertEqual(statuses.pop("broken.txt"), 'failed')
+        self.assertEqual(set(statuses.values()), set(['converted']))
+        for record in records:
+            if record['Status'] == 'converted':
+                self.assertEqual(load_services(record['Target']), from_json(to_json(parse_file(record['Source']))), record['Source'])
+        self.assertFalse(os.path.exists(os.path.join(output, "broken.json")))
+        again = batch_convert([inputs], 'json', output_dir=output, workers=1)
+        self.assertEqual(sorted(record['Status'] for record in again), ['failed'] + ['skipped'] * len(statuses))
+
+    def test_in_place_rerun_skips_earlier_outputs(self):
+        from batch_message_file import main, load_services
+        from convert_message_file import from_xml, to_xml
+        for filename in sample_files()[:3]:
+            shutil.copy(filename, self.directory)
+        for to_format in ('json', 'json', 'xml'):
+            records = os.path.join(self.directory, "report")
+            self.assertEqual(main([self.directory, "--to", to_format, "--workers", "2", "--quiet", "--report", records]), 0)
+            os.remove(records)
+        self.assertEqual(len(glob.glob(os.path.join(self.directory, "*.json"))), 3)
+        for filename in glob.glob(os.path.join(self.directory, "*.xml")):
+            self.assertEqual(load_services(filename), from_xml(to_xml(parse_file(filename[:-len(".xml")] + ".txt"))), filename)
+
+class ProfileTest(unittest.TestCase):
+    def test_profiled_parse_counts_every_line(self):
+        from parse_message_file import ParseProfile
+        for filename in sample_files():
+            profile = ParseProfile()
+            self.assertEqual(parse_file(filename, profile=profile), parse_file(filename), filename)
+            report = profile.to_dict()
+            lines = len(sample_lines(os.path.basename(filename)))
+            self.assertEqual(report['Counters']['lines'], lines, filename)
+            self.assertEqual(sum(report['SectionLines'].values()), lines, filename)
+            self.assertIn("Parse profile:", profile.format())
+
+class LazyImportTest(unittest.TestCase):
+    def test_parser_loads_no_converters(self):
+        import subprocess
+        import sys
+        heavy = ['xml.etree.ElementTree', 'json', 'gzip', 'bz2', 'lzma', 'concurrent.futures', 'convert_message_file', 'render_message_file']
+        code = "import sys, parse_message_file; print(' '.join(name for name in {0!r} if name in sys.modules))".format(heavy)
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), b"")
+
+    def test_old_names_still_import(self):
+        import parse_message_file
+        from convert_message_file import to_json
+        from render_message_file import display_services as render_display_services
+        self.assertIs(parse_message_file.to_json, to_json)
+        self.assertIs(parse_message_file.display_services, render_display_services)
+
+class GeneratedArchiveTest(TempDirTestCase):
+    def test_generated_archives_are_valid(self):
+        from bench_message_file import write_archive
+        options = dict(services=2, users=4, threads=5, posts=6, depth=3, polls=2, body_lines=3)
+        for suffix in ("", ".gz"):
+            for line_ending in ("lf", "cr", "crlf"):
+                filename = os.path.join(self.directory, "bench_{0}.txt{1}".format(line_ending, suffix))
+                write_archive(filename, line_ending, include_fanout=2, **options)
+                self.assertTrue(parse_file(filename, validate_only=True)[0], filename)
+                services = parse_file(filename)
+                self.assertEqual(len(services), 2)
+                for service in services:
+                    self.assertEqual(len(service['Users']), 4)
+                    # Each service's own threads plus those of the two include files
+                    self.assertEqual(len(service['MessageThreads']), 15)
+                    self.assertTrue(all(len(thread['Messages']) == 6 for thread in service['MessageThreads']))
+                if not suffix:
+                    self.assertEqual(_lint_results(filename), [], filename)
+
+if __name__ == "__main__":
+    unittest.main()
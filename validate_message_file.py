@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import re
+from collections import namedtuple
+
+from parse_message_file import open_compressed_file
+
+ValidationError = namedtuple('ValidationError', ['filename', 'line_number', 'message', 'line'])
+
+ANYWHERE = None
+
+# Section name -> sections it may be opened directly inside ('' is top level)
+SECTIONS = {
+    'Archive Service': ('',),
+    'Comment Section': ANYWHERE,
+    'Info Body': ('Archive Service',),
+    'Categorization List': ('Archive Service',),
+    'Category List': ('Categorization List', 'Archive Service'),
+    'Description Body': ('Category List',),
+    'User List': ('Archive Service',),
+    'User Info': ('User List',),
+    'Bio Body': ('User Info',),
+    'Message List': ('Archive Service',),
+    'Message Thread': ('Message List',),
+    'Message Post': ('Message Thread',),
+    'Message Body': ('Message Post',),
+    'Poll List': ('Message Post',),
+    'Poll Body': ('Poll List',),
+    'Include Service': ('',),
+    'Include Users': ANYWHERE,
+    'Include Messages': ANYWHERE,
+    'Include Categories': ANYWHERE,
+}
+INCLUDE_SECTIONS = frozenset(['Include Service', 'Include Users', 'Include Messages', 'Include Categories'])
+
+# Keys the checker looks at, with the section each one is read in
+KEY_SECTIONS = {
+    'Entry': 'Archive Service',
+    'User': 'User Info',
+    'Categories': 'Categorization List',
+    'Forums': 'Categorization List',
+    'Kind': 'Category List',
+    'ID': 'Category List',
+    'InSub': 'Category List',
+    'Thread': 'Message Thread',
+    'Post': 'Message Post',
+    'Nested': 'Message Post',
+}
+INTEGER_KEYS = frozenset(['Entry', 'User', 'ID', 'InSub', 'Thread', 'Post', 'Nested'])
+
+# Only marker lines and lines starting with one of the keys above are ever
+# looked at in Python; the regular expression skips everything else (bodies,
+# names, dates, ...) in C, which is what makes validating fast.  Blocks are
+# scanned with a leading LF so every line starts with one.
+_INTERESTING = re.compile(r"\n[ \t]*(?:(---[^\n]*)|({0})[ \t]*:([^\n]*))".format("|".join(KEY_SECTIONS)))
+BLOCK_SIZE = 1 << 20
+
+def split_marker(line):
+    """ Return ('start' or 'end', section name) for a section marker line, or None. """
+    if not (line.startswith("--- ") and line.endswith(" ---")):
+        return None
+    inner = line[4:-4]
+    if inner.startswith("Start "):
+        return 'start', inner[6:]
+    if inner.startswith("End "):
+        return 'end', inner[4:]
+    if inner.startswith("Include "):
+        if inner.endswith(" Start"):
+            return 'start', inner[:-6]
+        if inner.endswith(" End"):
+            return 'end', inner[:-4]
+    return None
+
+# split_marker() results for every known section, looked up first
+MARKERS = {}
+for _section in SECTIONS:
+    if _section in INCLUDE_SECTIONS:
+        MARKERS["--- {0} Start ---".format(_section)] = ('start', _section)
+        MARKERS["--- {0} End ---".format(_section)] = ('end', _section)
+    else:
+        MARKERS["--- Start {0} ---".format(_section)] = ('start', _section)
+        MARKERS["--- End {0} ---".format(_section)] = ('end', _section)
+
+def _integer_error(value, key, line_number):
+    try:
+        if int(value) >= 0:
+            return None
+        return "Negative value '{0}' for key '{1}' on line {2}".format(value, key, line_number)
+    except ValueError:
+        return "Invalid integer '{0}' for key '{1}' on line {2}".format(value, key, line_number)
+
+def iter_text_blocks(lines, block_size=BLOCK_SIZE):
+    """ Join lines (with or without line endings) into LF terminated blocks of about block_size characters. """
+    batch = []
+    size = 0
+    for line in lines:
+        line = line.rstrip("\r\n")
+        batch.append(line)
+        size += len(line) + 1
+        if size >= block_size:
+            batch.append("")
+            yield "\n".join(batch)
+            batch = []
+            size = 0
+    if batch:
+        batch.append("")
+        yield "\n".join(batch)
+
+def iter_file_blocks(file, block_size=BLOCK_SIZE):
+    """ Read a text file in blocks of about block_size characters that end on a line boundary. """
+    pending = ""
+    while True:
+        data = file.read(block_size)
+        if not data:
+            if pending:
+                yield pending + "\n"
+            return
+        data = pending + data
+        cut = data.rfind("\n") + 1
+        if cut:
+            yield data[:cut]
+        pending = data[cut:]
+
+class _Block:
+    """ One scanned block of text; line numbers are only counted when an error asks for one. """
+
+    def __init__(self, text, first_line):
+        self.text = "\n" + text
+        self.first_line = first_line
+        self._position = 0
+        self._line_number = first_line
+
+    def line_number(self, position):
+        """ Line number of the line whose leading LF is at position. """
+        if position < self._position:
+            self._position, self._line_number = 0, self.first_line
+        self._line_number += self.text.count("\n", self._position + 1, position + 1)
+        self._position = position
+        return self._line_number
+
+    def line(self, position):
+        end = self.text.find("\n", position + 1)
+        return self.text[position + 1:end + 1]
+
+def iter_validate_lines(lines, filename=None, follow_includes=True):
+    """ Check archive lines while streaming them, yielding a ValidationError for every problem.
+
+    Checks section marker nesting and balance, the integer fields, that
+    Nested points at an earlier Post of the same thread and that InSub
+    points at an earlier category ID of the same type.  Nothing is built
+    but a stack of open sections, the current thread's post IDs and the
+    current service's category IDs.  Included files are validated too.
+    This is a structural check rather than the parser's verdict, which
+    parse_file(validate_only=True) gives: unknown sections the parser skips
+    are errors here, and key lines inside bodies are not looked at.
+    """
+    return iter_validate_blocks(iter_text_blocks(lines), filename, follow_includes)
+
+def iter_validate_blocks(blocks, filename=None, follow_includes=True):
+    """ iter_validate_lines() over LF terminated text blocks (see iter_file_blocks()). """
+    # Open sections as (section, block, position), so their line numbers
+    # are only worked out for an error message
+    stack = []
+    top = ''
+    post_ids = set()
+    category_ids = {}
+    category_types = set(['Categories', 'Forums'])
+    category = None
+    # Included categories are not read here, so InSub may point at them
+    categories_included = False
+    include_text = None
+    include_start = 0
+    first_line = 1
+    for text in blocks:
+        block = _Block(text, first_line)
+        first_line += text.count("\n")
+        for match in _INTERESTING.finditer(block.text):
+            line, key, value = match.groups()
+
+            if key is not None:
+                if KEY_SECTIONS[key] != top:
+                    continue
+                value = value.strip()
+                if key in INTEGER_KEYS:
+                    if not value.isdecimal():
+                        position = match.start()
+                        line_number = block.line_number(position)
+                        message = _integer_error(value, key, line_number)
+                        if message is not None:
+                            yield ValidationError(filename, line_number, message, block.line(position))
+                            continue
+                    value = int(value)
+                    if key == 'Post':
+                        post_ids.add(value)
+                    elif key == 'Nested':
+                        if value != 0 and value not in post_ids:
+                            position = match.start()
+                            line_number = block.line_number(position)
+                            yield ValidationError(filename, line_number, "Nested value '{0}' on line {1} does not match any existing Post values in the current thread. Existing Post IDs: {2}".format(
+                                value, line_number, sorted(post_ids)), block.line(position))
+                    elif top == 'Category List':
+                        category[key] = value
+                elif key == 'Kind':
+                    category['Type'] = value.split(",")[0].strip()
+                else:
+                    category_types.add(key)
+                continue
+
+            line = line.rstrip()
+            marker = MARKERS.get(line) or split_marker(line)
+            if marker is None:
+                continue
+            kind, section = marker
+            if top == 'Comment Section' and section != 'Comment Section':
+                continue
+            position = match.start()
+            if kind == 'start':
+                if section not in SECTIONS:
+                    line_number = block.line_number(position)
+                    yield ValidationError(filename, line_number, "Unknown section '{0}' on line {1}".format(section, line_number), block.line(position))
+                else:
+                    parents = SECTIONS[section]
+                    if parents is not ANYWHERE and top not in parents:
+                        line_number = block.line_number(position)
+                        if top:
+                            message = "'{0}' on line {1} is inside '{2}' opened on line {3}".format(line, line_number, top, _start_line(stack[-1]))
+                        else:
+                            message = "'{0}' on line {1} is outside of any section".format(line, line_number)
+                        yield ValidationError(filename, line_number, message, block.line(position))
+                stack.append((section, block, position))
+                top = section
+                if section == 'Message Thread':
+                    post_ids = set()
+                elif section == 'Category List':
+                    category = {}
+                elif section == 'Archive Service':
+                    category_ids = {}
+                    category_types = set(['Categories', 'Forums'])
+                    categories_included = False
+                elif section == 'Categorization List':
+                    category_types = set()
+                elif section in INCLUDE_SECTIONS:
+                    include_text = ""
+                    include_start = match.end()
+                continue
+
+            if top != section:
+                opened = [number for number in range(len(stack) - 1, -1, -1) if stack[number][0] == section]
+                line_number = block.line_number(position)
+                if not opened:
+                    yield ValidationError(filename, line_number, "'{0}' on line {1} has no matching start".format(line, line_number), block.line(position))
+                    continue
+                # Report the sections left open, then recover by closing them
+                for entry in stack[opened[0] + 1:]:
+                    start_line = _start_line(entry)
+                    yield ValidationError(filename, start_line, "'--- Start {0} ---' on line {1} is not closed before '{2}' on line {3}".format(
+                        entry[0], start_line, line, line_number), block.line(position))
+                del stack[opened[0] + 1:]
+            stack.pop()
+            top = stack[-1][0] if stack else ''
+            if section == 'Category List' and category is not None:
+                category_type = category.get('Type', '')
+                if category_type not in category_types:
+                    line_number = block.line_number(position)
+                    yield ValidationError(filename, line_number, "Invalid 'Type' value '{0}' on line {1}. Expected one of {2}.".format(
+                        category_type, line_number, sorted(category_types)), block.line(position))
+                insub = category.get('InSub', 0)
+                ids = category_ids.setdefault(category_type, set())
+                if insub != 0 and insub not in ids and not categories_included:
+                    line_number = block.line_number(position)
+                    yield ValidationError(filename, line_number, "InSub value '{0}' on line {1} does not match any existing ID values.".format(insub, line_number), block.line(position))
+                if 'ID' in category:
+                    ids.add(category['ID'])
+                category = None
+            elif section in INCLUDE_SECTIONS and include_text is not None:
+                if section == 'Include Categories':
+                    categories_included = True
+                include_text += block.text[include_start:position]
+                include_files = [name.strip() for name in include_text.split("\n") if name.strip()]
+                include_text = None
+                if follow_includes:
+                    for include_file in include_files:
+                        for error in validate_file(include_file):
+                            yield error
+        if include_text is not None:
+            # The file list goes on in the next block
+            include_text += block.text[include_start:]
+            include_start = 0
+
+    for entry in stack:
+        start_line = _start_line(entry)
+        yield ValidationError(filename, start_line, "'--- Start {0} ---' on line {1} is never closed".format(entry[0], start_line), "")
+
+def _start_line(entry):
+    section, block, position = entry
+    return block.line_number(position)
+
+def _first_errors(errors, max_errors):
+    found = []
+    for error in errors:
+        found.append(error)
+        if max_errors is not None and len(found) >= max_errors:
+            break
+    return found
+
+def validate_lines(lines, max_errors=None, filename=None, follow_includes=True):
+    """ Return a list of up to max_errors ValidationErrors (all of them if None). """
+    return _first_errors(iter_validate_lines(lines, filename, follow_includes), max_errors)
+
+def validate_file(filename, max_errors=None, follow_includes=True):
+    """ Validate a (possibly compressed) archive file; see iter_validate_lines(). """
+    try:
+        with open_compressed_file(filename) as file:
+            return _first_errors(iter_validate_blocks(iter_file_blocks(file), filename, follow_includes), max_errors)
+    except (IOError, OSError, UnicodeDecodeError) as e:
+        return [ValidationError(filename, 0, "Cannot read '{0}': {1}".format(filename, e), "")]